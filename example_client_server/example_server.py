@@ -12,10 +12,180 @@ from session_logic.session_types import *
 from session_logic.parsers import session_into_message, payload_to_string # to convert session to str
 
 from websockets.legacy.server import WebSocketServerProtocol, serve # for websockets
+from typing import Any
 
 # for sending/receiving with proxy + proxy error exceptions
 from session_logic.helpers import *
 
+window = 1 # acknowledgement window negotiated with the proxy; set with the --window flag
+binary = False # whether binary frames are negotiated with the proxy; set with the --binary flag
+protocol_name_once = False # whether the proxy only names the protocol when a client starts it; set with the --once flag
+
+# actions where the client sends a payload
+actions_with_payload = {"A": ["Add", "Neg", "Greeting"], "B": ["Divide", "List"]}
+
+# use functions to create payload strings for payload types
+two_num_recv = payload_to_string("tuple", ["number", "number"])
+num_payload = payload_to_string("number")
+str_payload = payload_to_string("string")
+
+# define sessions and transform them to strings in order to send them to proxy as a JSON object;
+# they are the same for every connection, so they are only serialized once
+protocol_a_session = Def(
+    name="A",
+    cont=Choice(
+        dir=Dir("send"),
+        alternatives={
+            Label("Add"): Single(
+                dir=Dir("recv"),
+                payload=two_num_recv,
+                cont=Single(
+                    dir=Dir("send"),
+                    payload=num_payload,
+                    cont=Ref("A")
+                )
+            ),
+            Label("Neg"): Single(
+                dir=Dir("recv"),
+                payload=num_payload,
+                cont=Single(
+                    dir=Dir("send"),
+                    payload=num_payload,
+                    cont=Ref("A")
+                )
+            ),
+            Label("Greeting"): Single(
+                dir=Dir("recv"),
+                payload=str_payload,
+                cont=Single(
+                    dir=Dir("send"),
+                    payload=str_payload,
+                    cont=Ref("A")
+                )
+            ),
+            Label("Goodbye"): Single(
+                dir=Dir("send"),
+                payload=str_payload,
+                cont=Ref("A")
+            ),
+            Label("Quit"): End()
+        }
+    )
+)
+
+protocol_b_session = Def(
+    name="B",
+    cont=Choice(
+        dir=Dir("send"),
+        alternatives={
+            Label("Divide"):  Single(
+                dir=Dir("recv"),
+                payload=two_num_recv,
+                cont=Single(
+                    dir=Dir("send"),
+                    payload=num_payload,
+                    cont=Ref("B")
+                )
+            ),
+            Label("List"): Single(
+                dir=Dir("recv"),
+                payload='{ type: "string" }',
+                cont=Single(
+                    dir=Dir("send"),
+                    payload='{ type: "array", payload: { type: "number" } }',
+                    cont=Ref("B")
+                )
+            ),
+            Label("Quit"): End()
+        }
+    )
+)
+
+protocol_a_str = session_into_message(protocol_a_session)
+protocol_b_str = session_into_message(protocol_b_session)
+
+def carry_out(protocol:str, action:str, payload:Any=None) -> list[Any]:
+    '''
+    Carries out an action (session inside a protocol) of protocol A or B.
+
+    Args:
+        protocol: name of the protocol
+        action: name of the action
+        payload: payload the client sent, if the action has one
+
+    Returns:
+        The payloads the server sends back for the action, in order.
+    '''
+    match (protocol, action):
+        case ("A", "Add"):
+            return [int(payload[0]) + int(payload[1])]
+        case ("A", "Neg"):
+            return [-int(payload)]
+        case ("A", "Greeting"):
+            return [payload[:3]] # first three letters of name
+        case ("A", "Goodbye"):
+            return ["May we meet again"]
+        case ("B", "Divide"):
+            return [int(payload[0]) / int(payload[1])] # result of division
+        case ("B", "List"):
+            return [payload.split()] # split a sentence by spaces
+        case (_, "Quit"):
+            return []
+        case _:
+            raise SessionError("This action does not exist in the curent protocol")
+
+def carry_out_batch(protocol:str, commands:list[Any]) -> tuple[list[list[Any]], bool]:
+    '''
+    Carries out a batch of actions sent by the proxy.
+
+    Args:
+        protocol: name of the protocol
+        commands: actions as sent by the client (action name or [action, payload])
+
+    Returns:
+        The payloads sent back for each action and whether the protocol was quit.
+    '''
+    results: list[list[Any]] = []
+    for command in commands:
+        action, payload = (command, None) if isinstance(command, str) else command
+        results.append(carry_out(protocol, action, payload))
+        if action == "Quit":
+            return results, True
+    return results, False
+
+async def carry_out_actions(websocket:WebSocketServerProtocol, protocol:str) -> bool:
+    '''
+    Receives the client's actions in a protocol and sends back their payloads: only the next action if the proxy names
+    the protocol before every action, all of them until Quit if it only names it once (see the --once flag).
+
+    Args:
+        websocket: Server's websocket
+        protocol: name of the protocol the client is carrying out
+
+    Returns:
+        True if the client quit the protocol.
+    '''
+    while True:
+        # choose option in protocol
+        action = await receive(websocket)
+        if isinstance(action, dict): # several actions at once (the protocol name comes with them)
+            print(f'Doing batch of {len(action["batch"])} actions')
+            results, quit = carry_out_batch(action["protocol"], action["batch"])
+            await send(websocket, results) # one list of payloads per action
+            if quit:
+                return True
+            continue
+        print(f'Doing action: {action}')
+        # action refers to a specific session inside a protocol
+        if action == "Quit":
+            return True
+        payload = await receive(websocket) if action in actions_with_payload[protocol] else None
+        for result in carry_out(protocol, action, payload):
+            await send(websocket, result) # convert payload to json and send to proxy
+            print(f'Sent payload: {result}')
+        if not protocol_name_once: # next action comes with the protocol name again
+            return False
+
 async def ws_server(websocket:WebSocketServerProtocol):
     '''
     Main function of server where protocols are defined and information is sent back and forth.
@@ -27,162 +197,39 @@ async def ws_server(websocket:WebSocketServerProtocol):
     print("Connection succesful...")
     try:
         while True:
+            try:
+                # send protocols to proxy
+                print("Sending protocols to proxy...")
+                await send_protocols(websocket, [protocol_a_str, protocol_b_str], window=window, binary=binary, # only sent if proxy doesn't know them yet
+                                     protocol_name_once=protocol_name_once)
 
-            # use functions to create payload strings for payload types
-            two_num_recv = payload_to_string("tuple", ["number", "number"])
-            num_payload = payload_to_string("number")
-            str_payload = payload_to_string("string")
+                while True:
+                    # receive protocol info
+                    protocol = await receive(websocket)
+                    print(f'Got protocol {protocol}')
 
-            # define sessions and transform them to strings in order to send them to proxy as a JSON object
-            protocol_a_session = Def(
-            name="A",
-            cont=Choice(
-                dir=Dir("send"),
-                alternatives={
-                    Label("Add"): Single(
-                        dir=Dir("recv"),
-                        payload=two_num_recv,
-                        cont=Single(
-                            dir=Dir("send"),
-                            payload=num_payload,
-                            cont=Ref("A")
-                        )
-                    ),
-                    Label("Neg"): Single(
-                        dir=Dir("recv"),
-                        payload=num_payload,
-                        cont=Single(
-                            dir=Dir("send"),
-                            payload=num_payload,
-                            cont=Ref("A")
-                        )
-                    ),
-                    Label("Greeting"): Single(
-                        dir=Dir("recv"),
-                        payload=str_payload,
-                        cont=Single(
-                            dir=Dir("send"),
-                            payload=str_payload,
-                            cont=Ref("A")
-                        )
-                    ),
-                    Label("Goodbye"): Single(
-                        dir=Dir("send"),
-                        payload=str_payload,
-                        cont=Ref("A")
-                    ),
-                    Label("Quit"): End()
-                }
-                )
-            )
+                    # several actions at once
+                    if isinstance(protocol, dict):
+                        print(f'Doing batch of {len(protocol["batch"])} actions')
+                        results, quit = carry_out_batch(protocol["protocol"], protocol["batch"])
+                        await send(websocket, results) # one list of payloads per action
+                        if quit:
+                            break
+                        continue
 
-            protocol_b_session = Def(
-            name="B",
-            cont=Choice(
-                dir=Dir("send"),
-                alternatives={
-                    Label("Divide"):  Single(
-                        dir=Dir("recv"),
-                        payload=two_num_recv,
-                        cont=Single(
-                            dir=Dir("send"),
-                            payload=num_payload,
-                            cont=Ref("B")
-                        )
-                    ),
-                    Label("List"): Single(
-                        dir=Dir("recv"),
-                        payload='{ type: "string" }',
-                        cont=Single(
-                            dir=Dir("send"),
-                            payload='{ type: "array", payload: { type: "number" } }',
-                            cont=Ref("B")
-                        )
-                    ),
-                    Label("Quit"): End()
-                }
-            )
-            )
-
-            protocol_a_str = session_into_message(protocol_a_session)
-            protocol_b_str = session_into_message(protocol_b_session)
-
-            # send protocols to proxy
-            print("Sending protocols to proxy...")
-            await send(websocket, protocol_a_str)
-            await send(websocket, protocol_b_str)
-            await send(websocket, "Session: End") # signals we are done sending protocols
-
-            while True:
-                # receive protocol info
-                protocol = await receive(websocket)
-                print(f'Got protocol {protocol}')
-
-                # process previously defined prtocols
-                match protocol:
-                    case "A":
-                        # choose option in protocol
-                        action = await receive(websocket)
-                        print(f'Doing action: {action}')
-                        # action refers to a specific session inside a protocol
-
-                        match action:
-                            case "Add":
-                                nums = await receive(websocket) # payload
-                                c = int(nums[0]) + int(nums[1])
-                                await send(websocket, c) # convert payload to json and send to proxy
-                                print(f'Sent payload: {c}')
-                             
-                            case "Neg":
-                                a = await receive(websocket) # payload
-                                b = -int(a)
-                                await send(websocket, b) # convert payload to json and send to proxy
-                                print(f'Sent payload: {b}')
-                            
-                            case "Greeting":
-                                name = await receive(websocket) # payload
-                                nickname = name[:3] # first three letters of name
-                                await send(websocket, nickname) # send changed name
-                                print('Sent payload')
-
-                            case "Goodbye":
-                                await send(websocket, "May we meet again")
-                                print('Sent payload')
-
-                            case "Quit":
+                    # process previously defined prtocols
+                    match protocol:
+                        case "A" | "B":
+                            if await carry_out_actions(websocket, protocol): # client quit the protocol
                                 break
 
-                            case _:
-                                raise SessionError("This action does not exist in the curent protocol")
-
-                    
-                    case "B":
-                         # choose option in protocol
-                        action = await receive(websocket)
-                        # action refers to a specific session inside a protocol
-                        print(f'Doing action: {action}')
-
-                        match action:
-                            case "Divide":
-                                nums = await receive(websocket) # payload
-                                division = int(nums[0]) / int(nums[1])
-                                await send(websocket, division) # send result of division
-                            
-                            case "List":
-                                sentence = await receive(websocket) # receive string -> payload
-                                new_list = sentence.split() # split a sentence by spaces
-                                await send(websocket, new_list)
-                                 
-                            case "Quit":
-                                break
-
-                            case _:
-                                raise SessionError("This action does not exist in the curent protocol")
-
-
-                    case _:
-                        print(f'This protocol is not recognized') # could be handled as an exception
-                        await send(websocket, "Session: End")
+                        case _:
+                            print(f'This protocol is not recognized') # could be handled as an exception
+                            await send(websocket, "Session: End")
+            except SessionReset:
+                # proxy gives this connection to another client, so protocols are defined again
+                await acknowledge_reset(websocket)
+                print("Session reset by proxy")
     # handle ok and unexpected connections and errors
     except ProxyError as e:
         print(e)
@@ -215,7 +262,13 @@ if __name__ == "__main__":
     # take port as flag
     parser = argparse.ArgumentParser()
     parser.add_argument("-p", "--port", default = "7890", help="Port number")
+    parser.add_argument("-w", "--window", default = "1", help="Acknowledgement window negotiated with the proxy")
+    parser.add_argument("-bin", "--binary", action="store_true", help="Exchange binary frames instead of JSON text with the proxy")
+    parser.add_argument("-once", "--once", action="store_true", help="Only get the protocol name when a client starts a protocol, not before every action")
     args = parser.parse_args()
+    window = int(args.window)
+    binary = args.binary
+    protocol_name_once = args.once
 
     # start code
     print("Server started ...")
@@ -0,0 +1,85 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+# for sending/receiving with proxy + proxy error exceptions
+from session_logic.helpers import *
+
+import websockets
+import asyncio
+import argparse
+import time # to measure how long the clients take
+
+
+async def run_client(url:str, number:int, window:int=1, adds:int=1, batch:bool=False, binary:bool=False):
+    '''
+    Carries out the same actions as example_client.py for protocol A but without asking the user for input.
+
+    Args:
+        url (str): address of the proxy
+        number (int): number used as payload so every client sends something different
+        window (int): acknowledgement window negotiated with the proxy; with a window, all Add actions are sent
+                      before their results are received
+        adds (int): how many Add actions are carried out
+        batch (bool): if True, all Add actions are sent to the proxy in a single batch
+        binary (bool): if True, binary frames are exchanged with the proxy instead of JSON text
+    '''
+    async with websockets.connect(url) as ws:
+        if binary:
+            await negotiate_framing(ws)
+        if window > 1:
+            await negotiate_window(ws, window)
+        await send(ws, "Protocol: A") # choosing protocol
+        await send(ws, ["Greeting", f"Client{number}"])
+        await receive(ws)
+        await send(ws, ["Neg", number])
+        await receive(ws)
+        if batch:
+            await send_batch(ws, [["Add", [number, i]] for i in range(adds)])
+        elif window > 1:
+            # send all actions first and only then receive the results
+            for i in range(adds):
+                await send(ws, ["Add", [number, i]])
+            for i in range(adds):
+                await receive(ws)
+        else:
+            for i in range(adds):
+                await send(ws, ["Add", [number, i]])
+                await receive(ws)
+        await send(ws, "Goodbye")
+        await receive(ws)
+        await send(ws, "Quit") # quit protocol
+
+async def load_test(url:str, clients:int, window:int=1, adds:int=1, batch:bool=False, binary:bool=False):
+    '''
+    Starts the given number of clients at the same time and prints how many of them finished per second.
+    The proxy has to be started with the --concurrent flag and the example server has to be running.
+
+    Args:
+        url (str): address of the proxy
+        clients (int): how many clients connect at once
+        window (int): acknowledgement window every client negotiates with the proxy
+        adds (int): how many Add actions every client carries out
+        batch (bool): whether every client sends its Add actions as a single batch
+        binary (bool): whether every client exchanges binary frames with the proxy
+    '''
+    start = time.perf_counter()
+    results = await asyncio.gather(*[run_client(url, i + 1, window, adds, batch, binary) for i in range(clients)], return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    failed = [r for r in results if isinstance(r, Exception)]
+    print(f"{clients} clients in {elapsed:.2f}s ({(clients - len(failed)) / elapsed:.1f} clients/s), {len(failed)} failed")
+    if failed:
+        print(f"First error: {failed[0]!r}")
+
+#-- Start the load test ------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-pr", "--proxyport", default = "7891", help="Proxy port number")
+    parser.add_argument("-n", "--clients", default = "100", help="Number of clients connecting at the same time")
+    parser.add_argument("-w", "--window", default = "1", help="Acknowledgement window negotiated with the proxy")
+    parser.add_argument("-a", "--adds", default = "1", help="Number of Add actions per client")
+    parser.add_argument("-b", "--batch", action="store_true", help="Send all Add actions in a single batch")
+    parser.add_argument("-bin", "--binary", action="store_true", help="Exchange binary frames instead of JSON text with the proxy")
+    args = parser.parse_args()
+    asyncio.run(load_test(f"ws://127.0.0.1:{args.proxyport}", int(args.clients), int(args.window), int(args.adds), args.batch, args.binary))
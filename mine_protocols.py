@@ -0,0 +1,184 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from typing import Any, Iterable, Iterator, TextIO
+from collections import Counter, deque
+
+# to decode the recorded messages (with the fastest JSON library installed)
+from session_logic import codec
+
+# to define the log files and settings as flags (optional arguments)
+import argparse
+
+# to mine several chunks of the logs at once
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# for session types and turning them into strings
+from session_logic.session_types import *
+from session_logic.parsers import infer_payload_type, session_into_message
+
+# -- Recorded traffic -----------------------------------------------------------------------------------------------
+# Every line of a log is a JSON object with one action a client carried out and the messages it took, e.g.
+#   {"protocol": "A", "action": "Add", "messages": [["client", [1, 2]], ["server", 3]]}
+#   {"protocol": "A", "action": "Quit", "messages": [], "end": true}
+# "end" says the protocol ended after the action; otherwise the client could choose another action afterwards.
+# The shape of an action is what its messages look like: who sent each message and its payload type, and if the
+# protocol ended. Shapes are counted per protocol and action, so the logs never have to be kept in memory.
+
+Shape = tuple[tuple[tuple[str, str], ...], bool] # (sender and payload type of every message, protocol ended)
+Shapes = dict[tuple[str, str], Counter[Shape]] # how often every shape of every (protocol, action) was seen
+
+def mine_lines(lines: list[str], sample: int | None = None) -> tuple[Shapes, int]:
+    '''
+    Counts the shapes of the actions recorded in some lines of a log. Runs in the worker processes.
+
+        Args:
+            lines (list[str]): lines of a log
+            sample (int): how many elements of long lists are checked to infer payload types (all of them if None)
+
+        Returns:
+            The shapes of every action and how many lines were skipped because they aren't a recorded action.
+    '''
+    shapes: Shapes = {}
+    skipped = 0
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = codec.loads(line)
+            if not isinstance(record, dict):
+                raise TypeError("A recorded action has to be an object")
+            if not isinstance(record["protocol"], str) or not isinstance(record["action"], str):
+                raise TypeError("Protocol and action have to be strings")
+            messages = tuple((sender, infer_payload_type(payload, sample)) for sender, payload in record["messages"])
+            if not all(sender in ("client", "server") for sender, _ in messages):
+                raise ValueError("Messages are sent by the client or the server")
+        except (ValueError, KeyError, TypeError): # e.g. no JSON, missing fields or messages that aren't [sender, payload]
+            skipped += 1
+            continue
+        shapes.setdefault((record["protocol"], record["action"]), Counter())[(messages, bool(record.get("end", False)))] += 1
+    return shapes, skipped
+
+def read_chunks(logs: Iterable[TextIO], chunk_size: int) -> Iterator[list[str]]:
+    '''
+    Reads the lines of the logs in chunks, so only a few chunks are in memory at once.
+
+        Args:
+            logs (Iterable[TextIO]): log files
+            chunk_size (int): number of lines in a chunk
+
+        Returns:
+            Iterator[list[str]]: chunks of lines, in the order they are in the logs
+    '''
+    chunk: list[str] = []
+    for log in logs:
+        for line in log:
+            chunk.append(line)
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+def merge_shapes(shapes: Shapes, found: Shapes):
+    '''
+    Adds the shapes found in a chunk to the shapes of all chunks before it.
+    '''
+    for action, counts in found.items():
+        shapes.setdefault(action, Counter()).update(counts)
+
+def mine_logs(logs: Iterable[TextIO], workers: int = 1, chunk_size: int = 10000, sample: int | None = 64) -> tuple[Shapes, int]:
+    '''
+    Counts the shapes of all actions recorded in the logs. Chunks of lines are mined by a pool of worker processes;
+    only twice as many chunks as there are workers are read ahead, so logs of any size are mined in bounded memory.
+    Results are merged in the order of the chunks, so the protocols and actions keep the order they were first seen in.
+
+        Args:
+            logs (Iterable[TextIO]): log files with one recorded action per line
+            workers (int): number of worker processes (0 mines the chunks in this process)
+            chunk_size (int): number of lines mined at once by a worker
+            sample (int): how many elements of long lists are checked to infer payload types (all of them if None)
+
+        Returns:
+            The shapes of every action and how many lines were skipped.
+    '''
+    shapes: Shapes = {}
+    skipped = 0
+    if workers == 0:
+        for chunk in read_chunks(logs, chunk_size):
+            found, skipped_chunk = mine_lines(chunk, sample)
+            merge_shapes(shapes, found)
+            skipped += skipped_chunk
+        return shapes, skipped
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: deque[Future[tuple[Shapes, int]]] = deque()
+        for chunk in read_chunks(logs, chunk_size):
+            pending.append(pool.submit(mine_lines, chunk, sample))
+            while len(pending) >= 2 * workers or (pending and pending[0].done()): # oldest chunk first
+                found, skipped_chunk = pending.popleft().result()
+                merge_shapes(shapes, found)
+                skipped += skipped_chunk
+        while pending:
+            found, skipped_chunk = pending.popleft().result()
+            merge_shapes(shapes, found)
+            skipped += skipped_chunk
+    return shapes, skipped
+
+# -- Inferred protocols -----------------------------------------------------------------------------------------------
+
+def shapes_into_protocols(shapes: Shapes) -> tuple[list[Def], list[str]]:
+    '''
+    Makes a protocol (as the server defines it) for every protocol seen in the logs: a choice of all its actions,
+    where every action is the Single sessions of its most common shape (recv for messages of the client, send for
+    messages of the server) followed by End if the protocol ended after it or by a reference to the protocol otherwise.
+
+        Args:
+            shapes (Shapes): shapes of every action (see mine_logs)
+
+        Returns:
+            The protocols and a warning for every action seen with more than one shape.
+    '''
+    alternatives: dict[str, dict[Label, Session]] = {}
+    warnings: list[str] = []
+    for (protocol, action), counts in shapes.items():
+        (messages, ended), count = counts.most_common(1)[0]
+        if len(counts) > 1:
+            warnings.append(f"{action} of protocol {protocol} has {len(counts)} shapes; using the most common one "
+                            f"({count} of {sum(counts.values())} times)")
+        session: Session = End() if ended else Ref(protocol)
+        for sender, payload in reversed(messages):
+            session = Single(dir=Dir("recv" if sender == "client" else "send"), payload=payload, cont=session)
+        alternatives.setdefault(protocol, {})[Label(action)] = session
+    protocols = [Def(name=protocol, cont=Choice(dir=Dir("send"), alternatives=actions)) for protocol, actions in alternatives.items()]
+    return protocols, warnings
+
+
+#-- Mine protocols -------------------------------------------------------------------------------------------------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Infers the protocols of a server from recorded traffic (JSONL, one action per line)")
+    parser.add_argument("logs", nargs="+", help="Log files with one recorded action per line")
+    parser.add_argument("-o", "--output", default = None, help="File the protocols are written to, one per line (default: printed)")
+    parser.add_argument("-w", "--workers", default = "4", help="Number of worker processes (0 mines the logs in this process)")
+    parser.add_argument("-chunk", "--chunksize", default = "10000", help="Number of lines a worker mines at once")
+    parser.add_argument("-sample", "--sample", default = "64", help="Elements of long lists checked to infer payload types (0 checks all of them)")
+    args = parser.parse_args()
+
+    log_files = [open(log, encoding="utf-8") for log in args.logs]
+    try:
+        shapes, skipped = mine_logs(log_files, int(args.workers), int(args.chunksize), int(args.sample) or None)
+    finally:
+        for log in log_files:
+            log.close()
+    protocols, warnings = shapes_into_protocols(shapes)
+    for warning in warnings:
+        print(warning, file=sys.stderr)
+    if skipped:
+        print(f"Skipped {skipped} lines that aren't recorded actions", file=sys.stderr)
+    protocol_strings = "".join(session_into_message(protocol) + "\n" for protocol in protocols)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            output.write(protocol_strings)
+    else:
+        print(protocol_strings, end="")
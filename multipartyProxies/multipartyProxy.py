@@ -14,8 +14,8 @@ from websockets.legacy.client import WebSocketClientProtocol # for websockets cl
 # to check payload types are ok
 from session_logic import schema_validation
 
-# to send schema error message to client
-import json
+# to encode and decode messages (with the fastest JSON library installed)
+from session_logic import codec
 
 # to define ports as flags (optional arguments)
 import argparse
@@ -39,7 +39,7 @@ async def define_protocols(server_socket:WebSocketClientProtocol):
     Description here.
     '''
     try:
-        session_as_str = json.loads(await receive(server_socket)) # first protocol; minimum one has to be defined
+        session_as_str = codec.loads(await receive(server_socket)) # first protocol; minimum one has to be defined
         protocol_definition= message_into_session(session_as_str) # send type to session conversion so it can be added to name
         assert isinstance(protocol_definition, Def), "Expected a Def session from server" # to ensure only def sessions are given here
         protocol_info.add(protocol_definition) # add server protocol to global dictionary
@@ -47,7 +47,7 @@ async def define_protocols(server_socket:WebSocketClientProtocol):
 
         # define more protocols
         while protocol_definition.kind != "end":
-            session_as_str = json.loads(await receive(server_socket))
+            session_as_str = codec.loads(await receive(server_socket))
             protocol_definition = message_into_session(session_as_str)
             match (protocol_definition):
                 case End():
@@ -100,9 +100,9 @@ async def receive(socket:WebSocketServerProtocol|WebSocketClientProtocol) -> Any
 async def send_code(code:int, socket:WebSocketClientProtocol|WebSocketServerProtocol, info:str=""):
     match code:
         case 201:
-            await socket.send(json.dumps("201: There was an error defining the protocol. Please check the session syntax."))
+            await socket.send(codec.dumps("201: There was an error defining the protocol. Please check the session syntax."))
         case 501: # server success
-            await socket.send(json.dumps("502: Operation succesful."))
+            await socket.send(codec.dumps("502: Operation succesful."))
 
 # ------------- Proxy-Server Interaction ----------------------------------------------------------------------
 async def serverCode(server_address: str):
@@ -14,166 +14,350 @@ from websockets.legacy.client import WebSocketClientProtocol # for websockets cl
 # to check payload types are ok
 from session_logic import schema_validation
 
-# to send schema error message to client
-import json
+# to encode and decode messages (with the fastest JSON library installed)
+from session_logic import codec
 
 # to define ports as flags (optional arguments)
 import argparse
 
+# to run several proxy processes on the same port
+import multiprocessing
+from multiprocessing.connection import wait
+import signal
+import time
+
 # for session types, dictionary and errors
 from session_logic.session_types import *
 
 # for parsing messages back and forth, and functions taht alter messages
 from session_logic.parsers import *
 
+# to keep connections with the server open between clients
+from session_logic.connection_pool import ConnectionPool
+
+# to acknowledge messages once per window instead of once per message
+from session_logic.helpers import AckWindow
+from weakref import WeakKeyDictionary, WeakSet
+
+# for sockets that send binary frames instead of JSON text
+from session_logic.framing import Framing
+
+# protocols compiled into states
+from session_logic.state_machine import StateMachine, ProtocolError, END, SINGLE, CHOICE, REF, ERROR
+
+# -- define vars -----------------------------------------------------------------------
+
+MAX_WINDOW = 100 # biggest acknowledgement window a client or server can negotiate
+ack_windows: WeakKeyDictionary[Any, AckWindow] = WeakKeyDictionary() # sockets without one get every message acknowledged
+framings: WeakKeyDictionary[Any, Framing] = WeakKeyDictionary() # sockets that negotiated binary framing; all others use JSON text
+protocol_names_once: WeakSet[Any] = WeakSet() # servers that are only told the protocol when it starts, not before every action
+
         
 # ---- Client and server communications, session handlers -----------------------------------------------
 
-async def handle_session(ses_server: Session, ses_client: Session, server_socket: WebSocketClientProtocol, client_socket: WebSocketServerProtocol, 
-                         server_parser: Callable[..., Any], client_parser: Callable[..., Any], command:list[str, Any]|str=[]) -> tuple[Session, Session]:
+async def handle_session(state: int, server_socket: WebSocketClientProtocol, client_socket: WebSocketServerProtocol,
+                         server_parser: Callable[..., Any], client_parser: Callable[..., Any], protocol_info: GlobalDict, machine: StateMachine,
+                         protocol_name: str):
     '''
-    Performs actions depending on the given sessions and compares the server and client sessions are actually mirrored.
+    Carries out a protocol from its first state until its end: receives the client's actions at every choice and
+    transports the payloads of every single session in between. References to the protocol itself were linked when
+    it was compiled, so recursive protocols are carried out in this loop without looking them up again.
     Def sessions are not handled here because those define protocols and are instead handled in the define_protocols function.
 
         Args:
-            ses_server (Session): actual session the server is carrying out
-            ses_client (Session): actual session the client is carrying out
+            state (int): state the protocol starts in (see StateMachine)
             server_socket (WebsocketClientProtocol): socket to communicate between proxy and server (proxy is "client" in this case)
             client_socket (WebsocketServerProtocol): socket to communicate between proxy and client (proxy is "server" in this case)
             server_parser (Callable[..., Any]): function that changes the server message before sending it to the client
             client_parser (Callable[..., Any]): function that changes the client message before sending it to the server
-            command (str): Optional argument that refrences the action to be carried out; used for choice sessions
+            protocol_info (GlobalDict): protocols defined by the server for this connection
+            machine (StateMachine): compiled protocols
+            protocol_name (str): protocol the client chose
 
-        Returns:
-            Two sessions; one for the server and one for the client. However, in case there is an exception, it returns it.
-    '''
-    # initialize sessions
-    actual_sessions = (ses_server, ses_client)
-    ses_server_actual = actual_sessions[0]
-    ses_client_actual = actual_sessions[1]
-    payload = None # initialize but will change when tehrer is one
-    # carry out sessions in a loop (useful for cont)
-    while (not isinstance(ses_server_actual, End)) and (not isinstance(ses_client_actual, End)):
-        # print(payload) # debug
-        match (ses_server_actual, ses_client_actual):
-            case (Single(), Single()):
-                # type single (transports payload from server to client or vice versa)
-                # returns End sessions if schema validation fails -> could be handled differently
-                match (ses_server_actual.dir.dir, ses_client_actual.dir.dir):
-                    # client sends payload to server -> payload already checked in choice
-                    case ("recv", "send"):
-                        try:
-                            print(schema_validation.checkPayload(payload, ses_client_actual.payload, ses_server_actual.payload)) # check client paylaod
-                            await send_code(500, server_socket, client_socket) # let client know payload + action worked ok!
-                            await server_socket.send(json.dumps(["502: Operation succesful.", json.loads(payload)])) # send payload to server (case ok payload)
-                            payload = None # reset payload to none
-                            print("Message sent from client to server") # to track what proxy is doing at moment -> could be removed
-                        except Exception as e:
-                            await send_code(100, server_socket, client_socket, e)
-                            return End(), End()
-                    # server sends payload to client
-                    case ("send", "recv"):
-                        # check the payload type being transported matches the payload types defined in the sessions
-                        try:
-                            print("awaiting server payload") # debugging
-                            payload = await receive("server", client_socket, server_socket) # server has to send payload!
-                            print(schema_validation.checkPayload(payload, ses_server_actual.payload, ses_client_actual.payload))
-                            await client_socket.send(json.dumps(["502: Operation succesful.", json.loads(payload)])) # transport payload if type is ok
-                            payload = None # rest payload
-                            print("Message sent from server to client") # to track what proxy is doing at moment -> could be removed
-                            await send_code(501, server_socket, client_socket)
-                        except Exception as e:
-                            print(f"Problem sending payload: {json.loads(payload)}") # debugging
-                            await send_code(101, server_socket, client_socket, e)
-                            return End(), End()
-                    case _:
-                        # print(ses_server_actual.dir, ses_client_actual.dir) # comment out for debugging
-                        await send_code(321, server_socket, client_socket) # dir error
-                        return End(), End()
-                actual_sessions = (ses_server_actual.cont, ses_client_actual.cont) # after a single session start next session
-            # type choice (choose a session inside a protocol)
-            case(Choice(), Choice()):
-                # means you are given action by client and action comes with payload, therefore separate
-                # print(f'Looking up action: {command}...') # comment out to debug
+        Returns nothing once the protocol ended or there was an error (the error code is sent to both sides).
+    '''
+    states = machine.states
+    name_every_action = server_socket not in protocol_names_once # otherwise the server is only told the protocol once
+    if not name_every_action and state != END:
+        await send_message(server_socket, ["502: Operation succesful.", protocol_name])
+    while state != END:
+        current = states[state]
+        payload, payload_json = None, None # initialize but will change when tehrer is one
+        # type choice (choose a session inside a protocol)
+        if current.kind == CHOICE:
+            print(f"protocol name: {protocol_name}") # debugging
+            command, payload_json = load_command(await receive("client", client_socket, server_socket), client_socket) # action name; ok code sent after checking payload part of command
+            if isinstance(command, dict) and isinstance(command.get("batch"), list): # several actions at once
+                state = await handle_batch(state, server_socket, client_socket, protocol_info, machine, protocol_name, command["batch"])
+                continue
+            if name_every_action:
+                await send_message(server_socket, ["502: Operation succesful.", protocol_name]) # tell server which protocol is being used
+            try:
+                assert isinstance(command[0], str), "Command should be string" # to ensure command is string
+            except:
+                await send_code(340, server_socket, client_socket)
+                return
+            # means you are given action by client and action comes with payload, therefore separate
+            try:
+                # in case the command has payload with it
+                if not isinstance(command, str): # if it has payload it's of type list with action and payload; if not, it'd just string
+                    payload = command[1]
+                    print(f"payload type in choice: {type(payload)}") # debugging
+                    action = command[0]
+                else:
+                    action = command
+                print(f'Carrying out {action} action...') # to track what proxy is doing at moment -> could be removed
+                state = current.alternatives[action] # next states will be singles
+                await send_message(server_socket, ["502: Operation succesful.", action]) # let server know about command only if it IS a valid one
+                if not payload: # if no payload, means server is sending and therefore client waits for ok of action
+                    await send_code(500, server_socket, client_socket) # o.g. 502
+            except Exception as e:
+                await send_code(330, server_socket, client_socket)
+                return
+            current = states[state]
+        # carry out singles in a loop (useful for cont)
+        while current.kind == SINGLE:
+            # type single (transports payload from server to client or vice versa)
+            # ends the protocol if schema validation fails -> could be handled differently
+            if current.client_sends: # client sends payload to server -> payload already checked in choice
                 try:
-                    # in case the command has payload with it
-                    if not isinstance(command, str): # if it has payload it's of type list with action and payload; if not, it'd just string
-                        payload = command[1]
-                        print(f"payload type in choice: {type(payload)}") # debugging
-                        action = command[0]
-                    else:
-                        action = command
-                    print(f'Carrying out {action} action...') # to track what proxy is doing at moment -> could be removed
-                    actual_sessions = (ses_server_actual.lookup(Label(action)), ses_client_actual.lookup(Label(action))) # next sessions will be singles
-                    await server_socket.send(json.dumps(["502: Operation succesful.", action])) # let server know about command only if it IS a valid one
-                    if not payload: # if no payload, means server is sending and therefore client waits for ok of action
-                        await send_code(500, server_socket, client_socket) # o.g. 502
+                    print(schema_validation.checkSinglePayload(payload, current.single)) # check client paylaod
+                    await send_code(500, server_socket, client_socket) # let client know payload + action worked ok!
+                    if payload_json is None:
+                        payload_json = codec.dumps(payload)
+                    await send_payload(server_socket, payload_json) # send payload to server as the client sent it (case ok payload)
+                    payload, payload_json = None, None # reset payload to none
+                    print("Message sent from client to server") # to track what proxy is doing at moment -> could be removed
                 except Exception as e:
-                    await send_code(330, server_socket, client_socket)
-                    return End(), End()
-                payload = json.dumps(payload) # pack payload into json again for payload checks and transportation
-            # type ref (always returns a session of type choice)
-            case(Ref(), Ref()):
-                # Attempt to resolve references
+                    await send_code(100, server_socket, client_socket, e)
+                    return
+            else: # server sends payload to client
+                # check the payload type being transported matches the payload types defined in the sessions
                 try:
-                    found_server = protocol_info.lookup(ses_server_actual.name)
-                    found_client = protocol_info.lookup(ses_client_actual.name)
-                    return found_server, found_client
+                    print("awaiting server payload") # debugging
+                    payload_json = message_json(await receive("server", client_socket, server_socket), server_socket) # server has to send payload!
+                    print(schema_validation.checkSinglePayload(codec.loads(payload_json), current.single))
+                    await send_payload(client_socket, payload_json) # transport payload as the server sent it if type is ok
+                    payload, payload_json = None, None # rest payload
+                    print("Message sent from server to client") # to track what proxy is doing at moment -> could be removed
+                    await send_code(501, server_socket, client_socket)
                 except Exception as e:
-                    await send_code(350, server_socket, client_socket)
-                    return End(), End()
-            case _:
-                await send_code(312, server_socket, client_socket)
-                return End(), End()
-        # update sessions to use in while loop
-        ses_server_actual = actual_sessions[0]
-        ses_client_actual = actual_sessions[1]
-    return End(), End() # only returned when both sessions are end sessions
+                    print(f"Problem sending payload: {payload_json}") # debugging
+                    await send_code(101, server_socket, client_socket, e)
+                    return
+            state = current.next # after a single start next session
+            current = states[state]
+        # type ref to another protocol of the connection; protocols were checked when they were defined,
+        # so it is always defined and the sessions never get to a mismatch (no ERROR states)
+        if current.kind == REF:
+            state = machine.resolve(protocol_info, *current.names)
+        elif current.kind == ERROR: # only if the protocol wasn't checked
+            await send_code(current.code, server_socket, client_socket) # sessions don't match
+            return
+        elif current.kind not in (CHOICE, END): # never loop without waiting for a message
+            await send_code(402, server_socket, client_socket)
+            return
     
 
-async def define_protocols(server_socket:WebSocketClientProtocol, client_socket:WebSocketServerProtocol):
+def parse_protocol(session_as_str:str, protocol_store:ProtocolStore) -> tuple[Session, Session]:
+    '''
+    Turns a protocol sent by the server into its server and client sessions. If another connection already
+    defined the exact same protocol, the sessions kept in the shared store are returned instead of parsing it again.
+    New protocols get the validators of their payload types attached to their Single sessions.
+
+        Args:
+            session_as_str (str): protocol as sent by the server
+            protocol_store (ProtocolStore): protocols already parsed for any connection
+
+        Returns:
+            The server and client sessions; two End sessions if the server is done defining protocols.
+    '''
+    found = protocol_store.lookup(session_as_str)
+    if found:
+        return found
+    protocol_definition_server = message_into_session(session_as_str, "server") # send type to session conversion so it can be added to name
+    match (protocol_definition_server):
+        case End():
+            return End(), End()
+        case Def():
+            protocol_definition_client = dual(protocol_definition_server) # client session, without parsing the string again
+            schema_validation.attach_validators(protocol_definition_server, protocol_definition_client) # payload types are only compared once
+            protocol_store.add(session_as_str, protocol_definition_server, protocol_definition_client)
+            return protocol_definition_server, protocol_definition_client
+        case _:
+            raise SessionError("Trying to define session that is not a Def")
+
+def compile_protocol(protocol_definition_server:Def, protocol_definition_client:Def, machine:StateMachine) -> int:
+    '''
+    Compiles a protocol into states when it is defined, linking its references to itself, so the states are ready
+    before any client uses it (and found again for every other connection defining it).
+
+        Args:
+            protocol_definition_server (Def): protocol as parsed for the server
+            protocol_definition_client (Def): protocol as mirrored for the client
+            machine (StateMachine): compiled protocols
+
+        Returns:
+            int: the state the protocol starts in
+    '''
+    return machine.compile(protocol_definition_server.cont, protocol_definition_client.cont,
+                           (protocol_definition_server.name, protocol_definition_client.name))
+
+async def handle_batch(state: int, server_socket: WebSocketClientProtocol, client_socket: WebSocketServerProtocol,
+                       protocol_info: GlobalDict, machine: StateMachine, protocol_name: str, commands: list[Any]) -> int:
+    '''
+    Carries out several client commands at once. All commands are checked against the states in one pass before anything
+    is sent, then they are sent to the server in a single message ({"protocol": ..., "batch": [...]}). The server answers
+    with a list that has, for each command, the list of payloads it sends for that action; these are checked and sent
+    to the client in a single message.
+
+        Args:
+            state (int): state of the connection (a choice)
+            server_socket (WebsocketClientProtocol): socket to communicate between proxy and server
+            client_socket (WebsocketServerProtocol): socket to communicate between proxy and client
+            protocol_info (GlobalDict): protocols defined by the server for this connection
+            machine (StateMachine): compiled protocols
+            protocol_name (str): protocol the client chose
+            commands (list[Any]): commands as the client would send them one by one (action or [action, payload])
+
+        Returns:
+            The state after the last command; END if there was an error.
+    '''
+    states = machine.states
+    expected_results: list[list[Single]] = [] # sessions in which the server sends something, for each command
+    for command in commands:
+        # separate action and payload, like in the choice part of handle_session
+        if isinstance(command, str):
+            action, payload, has_payload = command, None, False
+        elif isinstance(command, list) and len(command) == 2 and isinstance(command[0], str):
+            action, payload, has_payload = command[0], command[1], True
+        else:
+            await send_code(340, server_socket, client_socket)
+            return END
+        current = states[state]
+        if current.kind != CHOICE or action not in current.alternatives: # e.g. an earlier command ended the protocol
+            await send_code(330, server_socket, client_socket)
+            return END
+        state = current.alternatives[action]
+        current = states[state]
+        # go through the singles of the action
+        results: list[Single] = []
+        while current.kind == SINGLE:
+            if current.client_sends: # client sends payload; a command only carries one
+                try:
+                    if not has_payload:
+                        raise SchemaValidationError("The action needs a payload")
+                    schema_validation.checkSinglePayload(payload, current.single)
+                except Exception as e:
+                    await send_code(100, server_socket, client_socket, str(e))
+                    return END
+                has_payload = False
+            else: # server sends payload; checked once the server answers
+                results.append(current.single)
+            state = current.next
+            current = states[state]
+        if current.kind == REF: # always defined, see handle_session
+            state = machine.resolve(protocol_info, *current.names)
+        elif current.kind == ERROR: # only if the protocol wasn't checked
+            await send_code(current.code, server_socket, client_socket)
+            return END
+        expected_results.append(results)
+
+    print(f"Carrying out batch of {len(commands)} actions...") # to track what proxy is doing at moment -> could be removed
+    await send_code(500, server_socket, client_socket) # let client know all commands are ok
+    await send_message(server_socket, ["502: Operation succesful.", {"protocol": protocol_name, "batch": commands}])
+    results_json = message_json(await receive("server", client_socket, server_socket), server_socket)
+    try:
+        results_given = codec.loads(results_json)
+        # checked explicitly (not with assert), as zip would otherwise cut short lists without an error
+        if not isinstance(results_given, list) or len(results_given) != len(expected_results):
+            raise SchemaValidationError("Expected one list of results per command")
+        for given, expected in zip(results_given, expected_results):
+            if not isinstance(given, list) or len(given) != len(expected):
+                raise SchemaValidationError("Wrong number of results for a command")
+            for result, single in zip(given, expected):
+                schema_validation.checkSinglePayload(result, single)
+    except Exception as e:
+        await send_code(101, server_socket, client_socket, str(e))
+        return END
+    await send_payload(client_socket, results_json) # forward results as the server sent them
+    await send_code(501, server_socket, client_socket)
+    return state
+
+async def define_protocols(server_socket:WebSocketClientProtocol, client_socket:WebSocketServerProtocol, protocol_info:GlobalDict,
+                           protocol_store:ProtocolStore, machine:StateMachine):
     '''
-    Receives strings from server that define protocols as Def sessions and adds them to the global
-    dictionary until an End Session is received.
+    Receives strings from server that define protocols as Def sessions and adds them to the connection's
+    protocol dictionary until an End Session is received. Once all are received, every protocol is checked (see
+    StateMachine.check) and the server is told right away if one isn't sound, instead of a client finding out later.
+    The server can instead start by announcing the digest of its protocols ("Digest: ..."); if the proxy already
+    knows that set of protocols it tells the server so and the protocols are not sent again.
 
         Args:
             server_socket (WebsocketClientProtocol): socket of the server
             client_socket (WebsocketServerProtocol): socket of the client
+            protocol_info (GlobalDict): dictionary where the protocols of this connection are kept
+            protocol_store (ProtocolStore): protocols shared by all connections so each one is only parsed once
+            machine (StateMachine): compiled protocols shared by all connections; new protocols are compiled when they are defined
     '''
-    session_as_str = json.loads(await receive("server", client_socket, server_socket)) # first protocol; minimum one has to be defined
-    # define server session
+    ack_windows.pop(server_socket, None) # server starts with a fresh protocol state, so window, framing and protocol names have to be negotiated again
+    framings.pop(server_socket, None)
+    protocol_names_once.discard(server_socket)
     try: # too long or ok? specially bc. it can fail bc. of dif. things
-        protocol_definition_server = message_into_session(session_as_str, "server") # send type to session conversion so it can be added to name
+        session_as_str = load_message(await receive("server", client_socket, server_socket), server_socket) # first protocol or digest of all protocols
+        while session_as_str.startswith(("Window: ", "Framing: ", "Protocol name: ")):
+            if session_as_str.startswith("Window: "):
+                await negotiate_window(session_as_str, server_socket)
+            elif session_as_str.startswith("Framing: "):
+                await negotiate_framing(session_as_str, server_socket)
+            else:
+                await negotiate_protocol_names(session_as_str, server_socket)
+            session_as_str = load_message(await receive("server", client_socket, server_socket), server_socket)
+        digest = None
+        if session_as_str.startswith("Digest: "):
+            digest = session_as_str[8:]
+            known_protocols = protocol_store.lookup_set(digest)
+            if known_protocols:
+                for protocol_definition_server, protocol_definition_client in known_protocols:
+                    protocol_info.add(protocol_definition_server)
+                    protocol_info.add(protocol_definition_client)
+                    compile_protocol(protocol_definition_server, protocol_definition_client, machine)
+                await send_code(503, server_socket, client_socket) # server doesn't have to send protocols
+                print(f"Registered protocols") # to track what proxy is doing at moment -> could be removed
+                return
+            await send_code(504, server_socket, client_socket) # ask server to send protocols
+            session_as_str = load_message(await receive("server", client_socket, server_socket), server_socket)
+        protocol_definition_server, protocol_definition_client = parse_protocol(session_as_str, protocol_store) # minimum one has to be defined
         assert isinstance(protocol_definition_server, Def), "Expected a Def session from server" # to ensure only def sessions are given here
-        protocol_info.add(protocol_definition_server) # add server protocol to global dictionary
-        # define client session
-        protocol_definition_client = message_into_session(session_as_str, "client") # send type to session conversion so it can be added to name
-        assert isinstance(protocol_definition_client, Def), "Expected a Def session from server" # to ensure session was properly mirrored as Def
-        protocol_info.add(protocol_definition_client) # add client protocol to global dictionary
-        await send_code(501, server_socket, client_socket)
 
-        # define more protocols
-        while protocol_definition_server.kind != "end":
-            session_as_str = json.loads(await receive("server", client_socket, server_socket))
-            protocol_definition_server = message_into_session(session_as_str, "server")
-            match (protocol_definition_server):
-                case End():
-                    await send_code(501, server_socket, client_socket)
-                    break
-                case Def():
-                    protocol_info.add(protocol_definition_server) # add server protocol to global dictionary
-                    protocol_definition_client = message_into_session(session_as_str, "client") # make client session
-                    assert isinstance(protocol_definition_client, Def), "Expected a Def session from server" # to ensure session was properly mirrored as Def
-                    protocol_info.add(protocol_definition_client) # add client protocol to global dictionary
-                    await send_code(501, server_socket, client_socket)
-                case _:
-                    raise SessionError("Trying to define session that is not a Def")
+        # define protocols until the server sends an End session
+        protocol_strings: list[str] = [] # to check the announced digest
+        definitions: list[tuple[Def, Def]] = []
+        while isinstance(protocol_definition_server, Def):
+            protocol_info.add(protocol_definition_server) # add server protocol to the connection's dictionary
+            protocol_info.add(protocol_definition_client) # add client protocol to the connection's dictionary
+            compile_protocol(protocol_definition_server, protocol_definition_client, machine) # only compiled the first time it is defined
+            protocol_strings.append(session_as_str)
+            definitions.append((protocol_definition_server, protocol_definition_client))
+            await send_code(501, server_socket, client_socket)
+            session_as_str = load_message(await receive("server", client_socket, server_socket), server_socket)
+            protocol_definition_server, protocol_definition_client = parse_protocol(session_as_str, protocol_store)
+        # check the protocols now that all references can be found; known sets were checked before they were kept
+        for protocol_definition_server, protocol_definition_client in definitions:
+            machine.check(protocol_info, protocol_definition_server.name, protocol_definition_client.name)
+        # only remember the set if the digest really belongs to the protocols that were sent
+        if digest is not None and protocols_digest(protocol_strings) == digest:
+            protocol_store.add_set(digest, definitions)
+        await send_code(501, server_socket, client_socket)
+    except ProtocolError as e:
+        await send_code(211, server_socket, client_socket, e.message)
     except:
         await send_code(201, server_socket, client_socket)
 
     print(f"Registered protocols") # to track what proxy is doing at moment -> could be removed
 
-async def proxy_websockets(server:WebSocketClientProtocol, websocket_client:WebSocketServerProtocol, server_parser: Callable[..., Any], client_parser: Callable[..., Any]):
+async def proxy_websockets(server:WebSocketClientProtocol, websocket_client:WebSocketServerProtocol, server_parser: Callable[..., Any], client_parser: Callable[..., Any],
+                           protocol_info:GlobalDict, protocol_store:ProtocolStore, machine:StateMachine):
     '''
     Manages the connection between the client and the server via sessions.
 
@@ -182,33 +366,33 @@ async def proxy_websockets(server:WebSocketClientProtocol, websocket_client:WebS
             websocket_client (WebsocketServerProtocol): client websocket to exchange information between it and the proxy
             server_parser (Callable[..., Any]): function that changes the server message before sending it to the client
             client_parser (Callable[..., Any]): function that changes the client message before sending it to the server
+            protocol_info (GlobalDict): protocols of this connection; every client gets its own so they don't clash
+            protocol_store (ProtocolStore): parsed protocols shared by all connections
+            machine (StateMachine): compiled protocols shared by all connections
     '''
     # async with websockets.connect(server) as server_ws
     try:
         # define protocols
-        await define_protocols(server, websocket_client) # errors already handled inside function
+        await define_protocols(server, websocket_client, protocol_info, protocol_store, machine) # errors already handled inside function
     
         while True:
-            protocol_name = json.loads(await receive("client", websocket_client, server)) # client chooses protocol 
+            protocol_name = load_message(await receive("client", websocket_client, server), websocket_client) # client chooses protocol 
+            if protocol_name.startswith("Window: "): # client can negotiate a window before choosing a protocol
+                await negotiate_window(protocol_name, websocket_client)
+                continue
+            if protocol_name.startswith("Framing: "): # or binary framing
+                await negotiate_framing(protocol_name, websocket_client)
+                continue
             protocol_name = protocol_name[10:] # protocol message structure: "Protocol: ___" 
             print(f'Executing protocol {protocol_name}...') # to track what proxy is doing at moment -> could be removed
-            # get both client and server sessions by referencing protocol
-            actual_ses_server, actual_ses_client = await handle_session(Ref(f"{protocol_name}_server"), Ref(f"{protocol_name}_client"),
-                                                                        server, websocket_client, server_parser, client_parser) # ref session
+            # get the state the protocol starts in by referencing it
+            state = machine.resolve(protocol_info, f"{protocol_name}_server", f"{protocol_name}_client")
+            if state is None:
+                await send_code(350, server, websocket_client) # protocol wasn't defined
+                state = END
             await send_code(500, server, websocket_client) # tell client protocol reference went ok
-            # recursively carry out sessions until we get two "End" sessions back
-            while actual_ses_server.kind != "end" and actual_ses_client.kind != "end":
-                print(f"protocol name: {protocol_name}") # debugging
-                await server.send(json.dumps(["502: Operation succesful.", protocol_name])) # always have to tell server which protocol is being used
-                command = json.loads(await receive("client", websocket_client, server)) # action name; ok code sent in handle_session after checking payload part of command
-                try:
-                    assert isinstance(command[0], str), "Command should be string" # to ensure command is string
-                except:
-                    await send_code(340, server, websocket_client)
-                    actual_ses_server, actual_ses_client = End(), End() # so handler returns end sessions and conenction is ended
-                # carry out action
-                actual_ses_server, actual_ses_client = await handle_session(actual_ses_server, actual_ses_client, server, #  carries out exchange dictated in that protocol's action 
-                                                                            websocket_client, server_parser, client_parser, command)
+            # carry out the protocol until it gets to its end
+            await handle_session(state, server, websocket_client, server_parser, client_parser, protocol_info, machine, protocol_name)
     # handle ok and unexpected connections
     except (websockets.ConnectionClosedOK, websockets.ConnectionClosedError):
         print("Connection terminated") # more specific client or server would be good!
@@ -220,12 +404,12 @@ async def proxy_websockets(server:WebSocketClientProtocol, websocket_client:WebS
         await send_code(402, server, websocket_client)
         print(f"Unexpected error in proxy: {e}")
     finally:
-        await server.close()
-        await websocket_client.close()
+        await websocket_client.close() # server connection is closed or given back to the pool by the handler
 
 
 # ------------- Initialize Proxy  ----------------------------------------------------------------------
-async def start_proxy(proxy_address: int, server_address: str):
+async def start_proxy(proxy_address: int, server_address: str, concurrent: bool = False,
+                      pool_max: int = 0, pool_min: int = 1, pool_idle: float = 60, reuse_port: bool = False, store_size: int = 1024):
     # maybe add error handling here
     '''
     Initializes the proxy's websocket connection and connects it to server, then starts main proxy function
@@ -234,30 +418,100 @@ async def start_proxy(proxy_address: int, server_address: str):
         Args:
             proxy_address (int): port where a connection with the proxy can be established
             server_address (str): server address
+            concurrent (bool): if True, the proxy keeps listening after a client disconnects and serves many clients
+                               at the same time; each of them gets its own server connection and protocols
+            pool_max (int): maximum number of server connections kept in a pool; 0 opens a new connection per client
+            pool_min (int): server connections the pool keeps open even when they are idle
+            pool_idle (float): seconds after which idle pooled connections above pool_min are closed
+            reuse_port (bool): if True, other processes can listen on the same port and the system spreads clients between them
+            store_size (int): number of parsed protocols (and sets of protocols) kept for all connections
     '''
     stop_event = asyncio.Event()  # Create event to track when to stop
-    
+    protocol_store = ProtocolStore(store_size) # parsed protocols are shared by all connections
+    machine = StateMachine() # and so are their compiled states
+    pool = None
+    if pool_max > 0:
+        pool = ConnectionPool(server_address, min_size=pool_min, max_size=pool_max, max_idle=pool_idle)
+        await pool.start()
+
+    async def serve_client(server_ws:WebSocketClientProtocol, websocket:WebSocketServerProtocol):
+        try:
+            protocol_info = GlobalDict({}) # protocol names are kept per connection so clients don't clash
+            await proxy_websockets(server_ws, websocket, server_parser_func, client_parser_func, protocol_info, protocol_store, machine)
+        except Exception as e:
+            print(f"Error in handler: {e}")
+        finally:
+            # print("Handler finished ...")
+            if not concurrent:
+                stop_event.set()  # Trigger stop when all clients are gone
+
     async def handler(websocket:WebSocketServerProtocol):
-        async with websockets.connect(server_address) as server_ws:
-            try:
+        if pool is None:
+            async with websockets.connect(server_address) as server_ws:
                 server_ws = cast(WebSocketClientProtocol, server_ws) # to correct type errors in websockets
-                await proxy_websockets(server_ws, websocket, server_parser_func, client_parser_func)
-            except Exception as e:
-                print(f"Error in handler: {e}")
+                await serve_client(server_ws, websocket)
+        else:
+            server_ws = cast(WebSocketClientProtocol, await pool.acquire())
+            try:
+                await serve_client(server_ws, websocket)
             finally:
-                # print("Handler finished ...")
-                stop_event.set()  # Trigger stop when all clients are gone
+                await pool.release(server_ws) # server goes back to defining protocols for the next client
 
     try:
-        server = await serve(handler, "localhost", proxy_address)
-        print("Proxy started, waiting for client...")
+        # in concurrent mode a bigger backlog lets many clients connect at once
+        server = await serve(handler, "localhost", proxy_address, backlog=1024 if concurrent else 100, reuse_port=reuse_port or None)
+        if concurrent:
+            print("Proxy started in concurrent mode, waiting for clients...")
+        else:
+            print("Proxy started, waiting for client...")
         await stop_event.wait()  # Exit when stop_event is set
         # print("Closing connection with server...") 
         server.close()
         await server.wait_closed()  # Ensure server fully shuts down
+        if pool:
+            print(f"Server connection pool: {pool.metrics()}") # once, not for every client
+            await pool.close()
     except Exception:
         print(f"The proxy encountered an error. Please try again!")
 
+# ------------- Worker processes  ----------------------------------------------------------------------
+def run_worker(proxy_address: int, server_address: str, pool_max: int, pool_min: int, pool_idle: float, store_size: int):
+    '''
+    Runs a concurrent proxy in a worker process; all workers listen on the same port.
+    '''
+    asyncio.run(start_proxy(proxy_address, server_address, True, pool_max, pool_min, pool_idle, reuse_port=True, store_size=store_size))
+
+def run_workers(workers: int, proxy_address: int, server_address: str, pool_max: int = 0, pool_min: int = 1, pool_idle: float = 60,
+                store_size: int = 1024):
+    '''
+    Starts worker processes that all listen on the proxy port, so JSON decoding and payload validation
+    are spread over several cores, and restarts workers that stop.
+
+        Args:
+            workers (int): number of worker processes
+            proxy_address (int): port where a connection with the proxy can be established
+            server_address (str): server address
+            pool_max, pool_min, pool_idle: settings of each worker's server connection pool (see start_proxy)
+            store_size (int): number of parsed protocols each worker keeps (see start_proxy)
+    '''
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0)) # so workers are stopped too when the proxy is stopped
+    worker_args = (proxy_address, server_address, pool_max, pool_min, pool_idle, store_size)
+    processes = [multiprocessing.Process(target=run_worker, args=worker_args) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    try:
+        while True:
+            wait([process.sentinel for process in processes]) # returns once a worker stopped
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    print(f"Worker {i} stopped with exit code {process.exitcode}, restarting...")
+                    time.sleep(1) # don't restart in a tight loop if workers keep failing
+                    processes[i] = multiprocessing.Process(target=run_worker, args=worker_args)
+                    processes[i].start()
+    finally:
+        for process in processes:
+            process.terminate()
+
 # -- Handle timeouts ----------------------------------------------------------------------------------------------------------------------
 async def receive(socket:Literal["server","client"], client_socket:WebSocketServerProtocol, server_socket:WebSocketClientProtocol) -> Any:
     '''
@@ -283,6 +537,103 @@ async def receive(socket:Literal["server","client"], client_socket:WebSocketServ
                 await send_code(402, server_socket, client_socket) # proxy error because timeout should be either with server or client
                 raise websockets.ConnectionClosedError
 
+#-- Acknowledgement windows ----------------------------------------------------------------------------------------------------------------
+
+async def negotiate_window(message:str, socket:WebSocketClientProtocol|WebSocketServerProtocol):
+    '''
+    Sets the acknowledgement window asked for with a "Window: N" message; from then on, only every N-th success
+    code (500 for the client, 501 for the server) is sent to that socket and acknowledges all messages before it.
+
+        Args:
+            message (str): negotiation message sent by the client or server
+            socket (WebSocketClientProtocol|WebSocketServerProtocol): socket that asked for the window
+    '''
+    try:
+        size = int(message[8:])
+    except ValueError:
+        size = 1 # no window if the size can't be read
+    size = max(1, min(size, MAX_WINDOW))
+    ack_windows[socket] = AckWindow(size)
+    await send_message(socket, f"502: Window {size}.") # tell sender which size will be used
+    print(f"Acknowledgement window: {size}") # to track what proxy is doing at moment -> could be removed
+
+async def negotiate_protocol_names(message:str, socket:WebSocketClientProtocol):
+    '''
+    Sets when the server is told which protocol the client is carrying out, asked for with a "Protocol name: once" or
+    "Protocol name: always" message. By default the proxy sends the protocol name before every action; with "once",
+    it is only sent when the client starts the protocol and the server gets every action until the protocol ends.
+
+        Args:
+            message (str): negotiation message sent by the server
+            socket (WebSocketClientProtocol): server socket
+    '''
+    once = message[15:] == "once"
+    if once:
+        protocol_names_once.add(socket)
+    else:
+        protocol_names_once.discard(socket)
+    await send_message(socket, f"502: Protocol name {'once' if once else 'always'}.") # tell server what it will get
+    print(f"Protocol name: {'once' if once else 'always'}") # to track what proxy is doing at moment -> could be removed
+
+#-- Binary framing ------------------------------------------------------------------------------------------------------------------------
+
+async def negotiate_framing(message:str, socket:WebSocketClientProtocol|WebSocketServerProtocol):
+    '''
+    Sets the framing asked for with a "Framing: binary" or "Framing: text" message; after "Framing: binary", messages to
+    and from that socket are binary frames (see session_logic/framing.py). The answer is still sent as JSON text.
+
+        Args:
+            message (str): negotiation message sent by the client or server
+            socket (WebSocketClientProtocol|WebSocketServerProtocol): socket that asked for the framing
+    '''
+    framings.pop(socket, None)
+    binary = message[9:] == "binary"
+    await socket.send(codec.dumps(f"502: Framing {'binary' if binary else 'text'}.")) # tell sender which framing will be used
+    if binary:
+        framings[socket] = Framing()
+    print(f"Framing: {'binary' if binary else 'text'}") # to track what proxy is doing at moment -> could be removed
+
+def load_message(message:str|bytes, socket:WebSocketClientProtocol|WebSocketServerProtocol) -> Any:
+    '''
+    Decodes a message received from a socket, whether it is JSON text or a binary frame.
+    '''
+    framing = framings.get(socket)
+    if framing and isinstance(message, bytes):
+        return framing.decode(message)
+    return codec.loads(message)
+
+def load_command(message:str|bytes, socket:WebSocketServerProtocol) -> tuple[Any, str|bytes|None]:
+    '''
+    Decodes a command received from the client and returns it with the JSON of its payload (see decode_command).
+    '''
+    framing = framings.get(socket)
+    if framing and isinstance(message, bytes):
+        return framing.decode_command(message)
+    return decode_command(message)
+
+def message_json(message:str|bytes, socket:WebSocketClientProtocol) -> str|bytes:
+    '''
+    Returns the JSON of a message received from a socket, so payloads can be forwarded without being encoded again.
+    '''
+    framing = framings.get(socket)
+    if framing and isinstance(message, bytes):
+        return framing.json(message)
+    return message
+
+async def send_message(socket:WebSocketClientProtocol|WebSocketServerProtocol, message:Any):
+    '''
+    Sends a message as JSON text or, if the socket negotiated it, as a binary frame.
+    '''
+    framing = framings.get(socket)
+    await socket.send(framing.encode(message) if framing else codec.dumps(message))
+
+async def send_payload(socket:WebSocketClientProtocol|WebSocketServerProtocol, payload_json:str|bytes):
+    '''
+    Forwards a payload that is already JSON together with the success code, without encoding it again.
+    '''
+    framing = framings.get(socket)
+    await socket.send(framing.encode_payload(payload_json) if framing else wrap_payload(payload_json))
+
 #-- Define proxy errors + success messages and exceptions ----------------------------------------------------------------------------------
 
 async def send_code(code:int, server_socket:WebSocketClientProtocol, client_socket:WebSocketServerProtocol, info:str=""):
@@ -300,69 +651,82 @@ async def send_code(code:int, server_socket:WebSocketClientProtocol, client_sock
 
         # 100's is payload error
         case 100:
-            await client_socket.send(json.dumps(str(code) + payload_error + f" ({info}).")) # add details of schema error?
-            await server_socket.send(json.dumps(client_prob_error))
+            await send_message(client_socket, str(code) + payload_error + f" ({info}).") # add details of schema error?
+            await send_message(server_socket, client_prob_error)
             await client_socket.close(reason=payload_error + f" ({info}).") # close conenction -> try it out
         case 101:
-            await client_socket.send(json.dumps(server_prob_error))
-            await server_socket.send(json.dumps(payload_error + f" ({e})")) # add details of schema error?
+            await send_message(client_socket, server_prob_error)
+            await send_message(server_socket, payload_error + f" ({info})") # add details of schema error?
             # for server error, close connection with both
             await client_socket.close(reason=server_prob_error)
-            await server_socket.close(reason=payload_error + f" ({e})")
+            await server_socket.close(reason=payload_error + f" ({info})")
         case 201:
-            await server_socket.send(json.dumps("201: There was an error defining the protocol. Please check the session syntax."))
-            await client_socket.send(json.dumps(server_prob_error))
+            await send_message(server_socket, "201: There was an error defining the protocol. Please check the session syntax.")
+            await send_message(client_socket, server_prob_error)
             # for server error, close connection with both
             await client_socket.close(reason=server_prob_error)
             await server_socket.close(reason="201: There was an error defining the protocol. Please check the session syntax.")
+        case 211: # a protocol is not sound (codes 312, 321 and 350 found when it is defined)
+            await send_message(server_socket, f"211: The protocols are not sound: {info}.")
+            await send_message(client_socket, server_prob_error)
+            await client_socket.close(reason=server_prob_error)
+            await server_socket.close(reason=f"211: The protocols are not sound: {info}.")
         # 300's are errors in session
         case 312:
             # not sure if client prob. or server prob...
-            await client_socket.send(json.dumps("312: Defined session not matched."))
+            await send_message(client_socket, "312: Defined session not matched.")
             await client_socket.close(reason="312: Defined session not matched.")
         case 321:
-            await server_socket.send(json.dumps("321: Invalid direction or it does not match the defined one."))
-            await client_socket.send(json.dumps(server_prob_error))
+            await send_message(server_socket, "321: Invalid direction or it does not match the defined one.")
+            await send_message(client_socket, server_prob_error)
             # not sure if client prob. or server prob. ....
             await client_socket.close(reason=server_prob_error)
             await server_socket.close(reason="321: Invalid direction or it does not match the defined one.")
         case 330:
-            await client_socket.send(json.dumps("330: This action is not defined in the protocol."))
-            await server_socket.send(json.dumps(client_prob_error))
+            await send_message(client_socket, "330: This action is not defined in the protocol.")
+            await send_message(server_socket, client_prob_error)
             await client_socket.close(reason="330: This action is not defined in the protocol.")
         case 340:
-            await client_socket.send(json.dumps("340: The action must be given as a string."))
-            await server_socket.send(json.dumps(client_prob_error))
+            await send_message(client_socket, "340: The action must be given as a string.")
+            await send_message(server_socket, client_prob_error)
             await client_socket.close(reason="340: The action must be given as a string.")
         case 350:
-            await client_socket.send(json.dumps("350: This protocol cannot be found."))
-            await server_socket.send(json.dumps(client_prob_error))
+            await send_message(client_socket, "350: This protocol cannot be found.")
+            await send_message(server_socket, client_prob_error)
             await client_socket.close(reason="350: This protocol cannot be found.")
         # 400's are timeouts and proxy disconnections
         case 400:
-            await client_socket.send(json.dumps("400: Timeout error"))
-            await server_socket.send(json.dumps("400: Client timeout error"))
+            await send_message(client_socket, "400: Timeout error")
+            await send_message(server_socket, "400: Client timeout error")
             # disconnect from client only; tell it there was a timeout error
             await client_socket.close(reason="400: Timeout error")
         case 401:
-            await client_socket.send(json.dumps("401: Server timeout error"))
-            await server_socket.send(json.dumps("401: Timeout error"))
+            await send_message(client_socket, "401: Server timeout error")
+            await send_message(server_socket, "401: Timeout error")
             # disconnect with both
             await client_socket.close(reason="401: Server timeout error")
             await server_socket.close(reason="401: Timeout error")
         case 402:
-            await client_socket.send(json.dumps("402: Unexpected error in proxy."))
-            await server_socket.send(json.dumps("402: Unexpected error in proxy."))
+            await send_message(client_socket, "402: Unexpected error in proxy.")
+            await send_message(server_socket, "402: Unexpected error in proxy.")
             # for proxy error, disconnect with both
             await client_socket.close(reason="402: Unexpected error in proxy.")
             await server_socket.close(reason="402: Unexpected error in proxy.")
         case 502: # signal success for both -> default ok message; 500 and 501 are for proxy to know better what happened
-            await client_socket.send(json.dumps("502: Operation succesful."))
-            await server_socket.send(json.dumps("502: Operation succesful."))
-        case 500: # client success
-            await client_socket.send(json.dumps("502: Operation succesful."))
-        case 501: # server success
-            await server_socket.send(json.dumps("502: Operation succesful."))
+            await send_message(client_socket, "502: Operation succesful.")
+            await send_message(server_socket, "502: Operation succesful.")
+        case 500: # client success; with a window only every window-th message is acknowledged
+            window = ack_windows.get(client_socket)
+            if window is None or window.count():
+                await send_message(client_socket, "502: Operation succesful.")
+        case 501: # server success; with a window only every window-th message is acknowledged
+            window = ack_windows.get(server_socket)
+            if window is None or window.count():
+                await send_message(server_socket, "502: Operation succesful.")
+        case 503: # server success; digest of protocols is known
+            await send_message(server_socket, "502: Protocols known.")
+        case 504: # server success; digest of protocols is not known so they have to be sent
+            await send_message(server_socket, "502: Protocols unknown.")
 
 class TimeoutError(Exception):
     """Exception raised for timeout errors caused by client or server"""
@@ -377,12 +741,16 @@ if __name__ == "__main__":
     connection_given = False
     
     while True:
-        protocol_info = GlobalDict({}) # initialize global dictionary for protocols
-
         # define ports for proxy and server as flags
         parser = argparse.ArgumentParser()
         parser.add_argument("-pr", "--proxyport", default = "7891", help="Proxy port number")
         parser.add_argument("-s", "--serverport", default = "7890", help="Server port number")
+        parser.add_argument("-c", "--concurrent", action="store_true", help="Serve many clients at once without restarting")
+        parser.add_argument("-pmax", "--poolmax", default = "0", help="Maximum number of pooled server connections (0 disables the pool)")
+        parser.add_argument("-pmin", "--poolmin", default = "1", help="Server connections the pool keeps open when idle")
+        parser.add_argument("-pidle", "--poolidle", default = "60", help="Seconds before idle pooled server connections are closed")
+        parser.add_argument("-w", "--workers", default = "1", help="Number of proxy processes sharing the port (more than 1 implies concurrent mode)")
+        parser.add_argument("-pstore", "--protocolstore", default = "1024", help="Number of protocols (and sets of protocols) shared by all connections (0 disables sharing)")
         args = parser.parse_args()
         print(f"Welcome to the proxy!\nProxy port: {args.proxyport}\nServer port or address: {args.serverport}")
 
@@ -394,8 +762,15 @@ if __name__ == "__main__":
         
         print("Connecting...")
 
+        if int(args.workers) > 1:
+            print(f"Starting {args.workers} workers...")
+            run_workers(int(args.workers), args.proxyport, server_address, int(args.poolmax), int(args.poolmin), float(args.poolidle),
+                        int(args.protocolstore))
+            break # workers are restarted by run_workers, so no need to restart here
+
         try:
             # run proxy
-            asyncio.run(start_proxy(args.proxyport, server_address))
+            asyncio.run(start_proxy(args.proxyport, server_address, args.concurrent,
+                                    int(args.poolmax), int(args.poolmin), float(args.poolidle), store_size=int(args.protocolstore)))
         except Exception as e:
             print(f"The proxy encountered an error. Please try again!")
\ No newline at end of file
@@ -0,0 +1,107 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import json
+from typing import Any, Callable, Dict
+
+# faster JSON library, only used if it is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# -- JSON backends -----------------------------------------------------------------------------------------------
+# every message the proxy, server and client exchange goes through loads and dumps,
+# so all of them encode and decode JSON the same way
+
+def json_loads(data: str | bytes) -> Any:
+    if isinstance(data, bytes):
+        data = data.decode() # messages are always UTF-8, so the encoding doesn't have to be detected
+    return json.loads(data)
+
+def json_dumps(obj: Any) -> str:
+    return json.dumps(obj)
+
+def json_dumps_bytes(obj: Any) -> bytes:
+    return json.dumps(obj).encode()
+
+def orjson_loads(data: str | bytes) -> Any:
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        return json.loads(data) # e.g. NaN or Infinity, which only the standard library accepts (or raises the usual error)
+
+def orjson_dumps(obj: Any) -> str:
+    try:
+        return orjson.dumps(obj).decode() # websockets sends str as text frames
+    except TypeError:
+        return json.dumps(obj) # e.g. integers bigger than 64 bits or keys that aren't strings
+
+def orjson_dumps_bytes(obj: Any) -> bytes:
+    try:
+        return orjson.dumps(obj)
+    except TypeError:
+        return json.dumps(obj).encode()
+
+backends: Dict[str, tuple[Callable[[str | bytes], Any], Callable[[Any], str], Callable[[Any], bytes]]] = {
+    "json": (json_loads, json_dumps, json_dumps_bytes)
+}
+if orjson is not None:
+    backends["orjson"] = (orjson_loads, orjson_dumps, orjson_dumps_bytes)
+
+backend = "orjson" if orjson is not None else "json" # name of the backend in use
+_loads, _dumps, _dumps_bytes = backends[backend]
+
+def use_backend(name: str):
+    '''
+    Chooses the JSON library used to encode and decode messages.
+    By default orjson is used if it is installed, otherwise the standard library.
+
+        Args:
+            name (str): "json" or "orjson"
+    '''
+    global backend, _loads, _dumps, _dumps_bytes
+    if name not in backends:
+        raise ValueError(f"JSON backend {name} is not available")
+    backend = name
+    _loads, _dumps, _dumps_bytes = backends[name]
+
+def loads(data: str | bytes) -> Any:
+    '''
+    Decodes a JSON message. Raises json.JSONDecodeError (or a subclass) if it isn't valid JSON.
+    Note that orjson turns integers bigger than 64 bits into floats.
+
+        Args:
+            data (str | bytes): message as received
+
+        Returns:
+            The decoded message.
+    '''
+    return _loads(data)
+
+def dumps(obj: Any) -> str:
+    '''
+    Encodes an object as a JSON message. The output is compact with orjson and uses ", " and ": " with
+    the standard library; both are the same JSON.
+
+        Args:
+            obj (Any): object to encode
+
+        Returns:
+            str: the JSON message
+    '''
+    return _dumps(obj)
+
+def dumps_bytes(obj: Any) -> bytes:
+    '''
+    Encodes an object as UTF-8 JSON, for binary frames.
+
+        Args:
+            obj (Any): object to encode
+
+        Returns:
+            bytes: the JSON message
+    '''
+    return _dumps_bytes(obj)
@@ -0,0 +1,173 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from session_logic import codec # to send reset messages
+import time # to know how long connections have been idle
+import asyncio
+import websockets
+from typing import Any, Dict
+
+# -- Pool of connections to the server ----------------------------------------------------------------------------------
+
+class ConnectionPool:
+    '''
+    Keeps connections to the server open so clients don't have to wait for a new connection to be established.
+    Connections are checked with a ping before being handed out and are reset to a fresh protocol state
+    (the server defines its protocols again) when they are given back.
+    '''
+    def __init__(self, server_address: str, min_size: int = 1, max_size: int = 10, max_idle: float = 60, timeout: float = 5):
+        '''
+        Args:
+            server_address (str): address of the server
+            min_size (int): connections kept open even if they are idle
+            max_size (int): maximum number of connections open at the same time
+            max_idle (float): seconds after which idle connections above min_size are closed
+            timeout (float): seconds to wait for pings and reset acknowledgements
+        '''
+        if min_size > max_size:
+            raise PoolError("The minimum pool size can't be bigger than the maximum size")
+        self.server_address = server_address
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.idle: list[tuple[Any, float]] = [] # idle connections and when they were last given back
+        self.size = 0 # open connections, idle or in use
+        self.available = asyncio.Condition() # to wait for connections when the pool is full
+        self.counters: Dict[str, int] = {"created": 0, "reused": 0, "discarded": 0, "evicted": 0, "waited": 0}
+        self.eviction_task: asyncio.Task[None] | None = None
+
+    async def start(self):
+        '''
+        Opens the minimum number of connections and starts closing connections that are idle for too long.
+        '''
+        for _ in range(self.min_size):
+            self.idle.append((await self.connect(), time.monotonic()))
+        self.eviction_task = asyncio.create_task(self.evict_idle())
+
+    async def close(self):
+        '''
+        Stops the eviction of idle connections and closes all idle connections.
+        '''
+        if self.eviction_task:
+            self.eviction_task.cancel()
+        while self.idle:
+            await self.discard(self.idle.pop()[0])
+
+    async def acquire(self) -> Any:
+        '''
+        Hands out a healthy connection to the server; waits if max_size connections are already in use.
+
+            Returns:
+                A connection to the server that will define its protocols next.
+        '''
+        while True:
+            while self.idle:
+                server_ws, _ = self.idle.pop() # most recently used connection first
+                if await self.is_healthy(server_ws):
+                    self.counters["reused"] += 1
+                    return server_ws
+                self.counters["discarded"] += 1
+                await self.discard(server_ws)
+            if self.size < self.max_size:
+                return await self.connect()
+            self.counters["waited"] += 1
+            async with self.available:
+                await self.available.wait() # until a connection is given back
+
+    async def release(self, server_ws: Any):
+        '''
+        Gives a connection back to the pool after resetting it; connections that can't be reset are closed.
+
+            Args:
+                server_ws: connection handed out by acquire
+        '''
+        if await self.reset(server_ws):
+            self.idle.append((server_ws, time.monotonic()))
+        else:
+            self.counters["discarded"] += 1
+            await self.discard(server_ws)
+        async with self.available:
+            self.available.notify()
+
+    def metrics(self) -> Dict[str, int]:
+        '''
+        Returns:
+            How many connections are open, idle and in use and how many were created, reused, discarded
+            and evicted so far, as well as how many times a client had to wait for a connection.
+        '''
+        return {"size": self.size, "idle": len(self.idle), "in_use": self.size - len(self.idle), **self.counters}
+
+    # -- helper functions ---------------------------------------------------------------------------------
+
+    async def connect(self) -> Any:
+        '''
+        Returns: a new connection to the server
+        '''
+        self.size += 1 # counted before connecting so no more than max_size connections are opened
+        try:
+            server_ws = await websockets.connect(self.server_address)
+        except Exception:
+            self.size -= 1
+            raise
+        self.counters["created"] += 1
+        return server_ws
+
+    async def discard(self, server_ws: Any):
+        '''
+        Closes a connection and removes it from the pool.
+        '''
+        self.size -= 1
+        try:
+            await server_ws.close()
+        except Exception:
+            pass # connection is gone anyway
+
+    async def is_healthy(self, server_ws: Any) -> bool:
+        '''
+        Returns: True if the server answers a ping in time
+        '''
+        try:
+            pong_waiter = await server_ws.ping()
+            await asyncio.wait_for(pong_waiter, timeout=self.timeout)
+            return True
+        except Exception:
+            return False
+
+    async def reset(self, server_ws: Any) -> bool:
+        '''
+        Asks the server to go back to defining its protocols. Messages the server sent before acknowledging
+        the reset belong to the previous client and are dropped.
+
+            Returns:
+                True if the server acknowledged the reset in time.
+        '''
+        try:
+            await server_ws.send(codec.dumps("505: Session reset."))
+            while True:
+                message = await asyncio.wait_for(server_ws.recv(), timeout=self.timeout)
+                if isinstance(message, str) and codec.loads(message) == "Session: Reset": # binary frames are never the acknowledgement
+                    return True
+        except Exception:
+            return False
+
+    async def evict_idle(self):
+        '''
+        Closes connections that have been idle for longer than max_idle, keeping at least min_size connections.
+        '''
+        while True:
+            await asyncio.sleep(self.max_idle / 2)
+            now = time.monotonic()
+            # oldest connections are at the start of the list
+            while self.idle and self.size > self.min_size and now - self.idle[0][1] > self.max_idle:
+                await self.discard(self.idle.pop(0)[0])
+                self.counters["evicted"] += 1
+
+# -- Define exceptions -------------------------------------------------------------------------------------------------
+class PoolError(Exception):
+    """Exception raised for wrong pool settings."""
+    def __init__(self, message:str="Pool error"):
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,178 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from typing import Any, Dict
+from session_logic import codec # to encode and decode payloads
+from session_logic.parsers import decode_command # for commands sent as plain messages
+
+# -- Binary frames ------------------------------------------------------------------------------------------------
+# Instead of JSON text, a socket that negotiated binary framing ("Framing: binary") sends binary frames:
+# one byte saying what the frame is, followed by what the frame carries. Text frames can still be sent at any time
+# (e.g. for negotiations or session resets) and are always read as JSON text.
+
+FRAME_OK = 0 # "502: Operation succesful."; nothing follows
+FRAME_OK_PAYLOAD = 1 # ["502: Operation succesful.", payload]; the payload follows as JSON
+FRAME_MESSAGE = 2 # any other message (protocol choice, errors, payloads sent by the server, ...); follows as JSON
+FRAME_ACTION = 3 # action with an id given before: 1 byte id, then its payload as JSON (nothing if it has none)
+FRAME_NEW_ACTION = 4 # gives an action an id and sends it: 1 byte id, 1 byte label length, label, then its payload as JSON
+
+OK_MESSAGE = "502: Operation succesful."
+OK_FRAME = bytes((FRAME_OK,))
+ACTION_KIND = bytes((FRAME_ACTION,))
+MAX_ACTIONS = 256 # ids fit in one byte; further actions are sent as plain messages
+
+class Framing:
+    '''
+    Binary framing of one socket. Every action label is only sent once per direction; afterwards its id is sent.
+    '''
+    def __init__(self, commands: bool = False):
+        self.commands = commands # True for clients: [action, payload] lists are sent as actions
+        self.sent_ids: Dict[str, int] = {} # ids of the actions this side sent
+        self.received_labels: Dict[int, str] = {} # actions the other side sent, by id
+
+    def encode(self, message: Any) -> bytes:
+        '''
+        Turns a message (as it would be given to codec.dumps) into a binary frame.
+
+            Args:
+                message (Any): message to send
+
+            Returns:
+                bytes: the frame
+        '''
+        if message == OK_MESSAGE:
+            return OK_FRAME
+        if isinstance(message, list) and len(message) == 2 and isinstance(message[0], str):
+            if message[0] == OK_MESSAGE:
+                return bytes((FRAME_OK_PAYLOAD,)) + codec.dumps_bytes(message[1])
+            if self.commands:
+                return self.encode_action(message[0], codec.dumps_bytes(message[1]))
+        return bytes((FRAME_MESSAGE,)) + codec.dumps_bytes(message)
+
+    def encode_payload(self, payload_json: str | bytes) -> bytes:
+        '''
+        Makes the frame that forwards a payload that is already JSON ("502: Operation succesful." with the payload).
+
+            Args:
+                payload_json (str | bytes): payload as JSON
+
+            Returns:
+                bytes: the frame
+        '''
+        if isinstance(payload_json, str):
+            payload_json = payload_json.encode()
+        return bytes((FRAME_OK_PAYLOAD,)) + payload_json
+
+    def encode_action(self, action: str, payload_json: str | bytes = b"") -> bytes:
+        '''
+        Makes the frame of an action, giving the action an id the first time it is sent.
+
+            Args:
+                action (str): action label
+                payload_json (str | bytes): payload of the action as JSON; empty if it has none
+
+            Returns:
+                bytes: the frame
+        '''
+        if isinstance(payload_json, str):
+            payload_json = payload_json.encode()
+        action_id = self.sent_ids.get(action)
+        if action_id is not None:
+            return bytes((FRAME_ACTION, action_id)) + payload_json
+        label = action.encode()
+        if len(self.sent_ids) >= MAX_ACTIONS or len(label) > 255: # no ids left or label too long for its length byte
+            return bytes((FRAME_MESSAGE,)) + codec.dumps_bytes([action, codec.loads(payload_json)] if payload_json else action)
+        action_id = self.sent_ids[action] = len(self.sent_ids)
+        return bytes((FRAME_NEW_ACTION, action_id, len(label))) + label + payload_json
+
+    def split(self, frame: bytes) -> tuple[int, str | None, bytes]:
+        '''
+        Splits a frame into its kind, its action (for action frames) and the JSON that follows.
+
+            Args:
+                frame (bytes): frame as received
+
+            Returns:
+                The kind of frame, the action label or None and the JSON part (can be empty).
+        '''
+        if not frame:
+            raise FramingError("Empty frame")
+        kind = frame[0]
+        if kind in (FRAME_OK, FRAME_OK_PAYLOAD, FRAME_MESSAGE):
+            return kind, None, frame[1:]
+        if kind == FRAME_ACTION:
+            if len(frame) < 2 or frame[1] not in self.received_labels:
+                raise FramingError("Action id was never given")
+            return kind, self.received_labels[frame[1]], frame[2:]
+        if kind == FRAME_NEW_ACTION:
+            if len(frame) < 3 or len(frame) < 3 + frame[2]:
+                raise FramingError("Frame too short")
+            label = frame[3:3 + frame[2]].decode()
+            self.received_labels[frame[1]] = label
+            return kind, label, frame[3 + frame[2]:]
+        raise FramingError(f"Unknown frame kind {kind}")
+
+    def decode(self, frame: bytes) -> Any:
+        '''
+        Decodes a binary frame into the message it stands for (the same as if it had been sent as JSON text).
+
+            Args:
+                frame (bytes): frame as received
+
+            Returns:
+                The message.
+        '''
+        if frame == OK_FRAME: # most frames are only acknowledgements
+            return OK_MESSAGE
+        kind = frame[0] if frame else None
+        if kind == FRAME_OK_PAYLOAD:
+            return [OK_MESSAGE, codec.loads(frame[1:])]
+        if kind == FRAME_MESSAGE:
+            return codec.loads(frame[1:])
+        kind, action, payload_json = self.split(frame)
+        return [action, codec.loads(payload_json)] if payload_json else action
+
+    def decode_command(self, frame: bytes) -> tuple[Any, bytes | None]:
+        '''
+        Decodes a command sent by a client like parsers.decode_command, also returning the JSON of its payload.
+
+            Args:
+                frame (bytes): frame as received
+
+            Returns:
+                The command and the JSON of its payload (None if it has no payload).
+        '''
+        if frame[:1] == ACTION_KIND and len(frame) > 1 and frame[1] in self.received_labels: # most commands
+            action, payload_json = self.received_labels[frame[1]], frame[2:]
+        else:
+            kind, action, payload_json = self.split(frame)
+            if kind == FRAME_MESSAGE:
+                return decode_command(payload_json)
+            if kind not in (FRAME_ACTION, FRAME_NEW_ACTION):
+                return self.decode(frame), None
+        if payload_json:
+            return [action, codec.loads(payload_json)], payload_json
+        return action, None
+
+    def json(self, frame: bytes) -> bytes:
+        '''
+        Returns the JSON of a message received as a frame, without decoding it if possible (for forwarding payloads).
+
+            Args:
+                frame (bytes): frame as received
+
+            Returns:
+                bytes: the message as JSON
+        '''
+        if frame[:1] == bytes((FRAME_MESSAGE,)):
+            return frame[1:]
+        return codec.dumps_bytes(self.decode(frame))
+
+# -- Define exceptions -------------------------------------------------------------------------------------------------
+class FramingError(Exception):
+    """Exception raised for binary frames that can't be read."""
+    def __init__(self, message:str="Invalid frame"):
+        self.message = message
+        super().__init__(self.message)
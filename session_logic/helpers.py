@@ -1,7 +1,152 @@
-import json # to send and receive payloads
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from session_logic import codec # to send and receive payloads
 from typing import Any
+from collections import deque # for payloads received while waiting for an acknowledgement
+from weakref import WeakKeyDictionary # to keep acknowledgement windows per socket
 from websockets.legacy.server import WebSocketServerProtocol, serve # for websockets server websocket
 from websockets import ClientProtocol # for websockets client
+from session_logic.parsers import protocols_digest # for defining protocols with a digest
+from session_logic.framing import Framing # for binary frames instead of JSON text
+
+# -- Acknowledgement windows -----------------------------------------------------------------------
+class AckWindow:
+    '''
+    Counts the messages sent since the last acknowledgement when acknowledgements are only sent once per window
+    instead of once per message, and keeps the payloads that arrive while waiting for an acknowledgement.
+    '''
+    def __init__(self, size:int=1):
+        self.size = size # 1 means every message is acknowledged
+        self.unacked = 0
+        self.pending: deque[Any] = deque()
+
+    def count(self) -> bool:
+        '''
+        Counts a sent (or, for the proxy, received) message.
+
+        Returns:
+            bool: True if the window is full and an acknowledgement is due.
+        '''
+        self.unacked += 1
+        if self.unacked >= self.size:
+            self.unacked = 0
+            return True
+        return False
+
+# windows negotiated with the proxy; sockets without one are acknowledged message by message
+ack_windows: WeakKeyDictionary[Any, AckWindow] = WeakKeyDictionary()
+
+# binary framing negotiated with the proxy; sockets without one send JSON text
+framings: WeakKeyDictionary[Any, Framing] = WeakKeyDictionary()
+
+async def negotiate_window(websocket:ClientProtocol|WebSocketServerProtocol, size:int) -> int:
+    """
+    Asks the proxy to only acknowledge every size-th message sent through this socket, so up to size messages
+    can be sent without waiting. Clients negotiate before choosing a protocol; servers before defining their protocols.
+
+    Args:
+        websocket(ClientProtocol|WebSocketServerProtocol): client or server socket
+        size(int): wanted number of messages per acknowledgement
+
+    Returns:
+        int: window size the proxy agreed to (it can be smaller than the one asked for).
+
+    Raises:
+        ProxyError: If the proxy message includes an error code.
+    """
+    await send_message(websocket, f"Window: {size}")
+    proxy_msg = await receive_message(websocket)
+    if proxy_msg == "505: Session reset.":
+        raise SessionReset()
+    if not proxy_msg.startswith("502: Window "):
+        raise ProxyError("Proxy error " + proxy_msg)
+    agreed_size = int(proxy_msg[11:-1]) # message structure: "502: Window N."
+    ack_windows[websocket] = AckWindow(agreed_size)
+    return agreed_size
+
+# -- Binary framing -------------------------------------------------------------------------------
+
+async def negotiate_framing(websocket:ClientProtocol|WebSocketServerProtocol, binary:bool=True, client:bool=True) -> bool:
+    """
+    Asks the proxy to exchange binary frames instead of JSON text through this socket (see session_logic/framing.py):
+    success codes take one byte and actions are sent as one byte ids after the first time. Clients negotiate before
+    choosing a protocol; servers before defining their protocols.
+
+    Args:
+        websocket(ClientProtocol|WebSocketServerProtocol): client or server socket
+        binary(bool): True for binary frames, False to go back to JSON text
+        client(bool): True for clients, whose [action, payload] messages are sent as actions; False for servers
+
+    Returns:
+        bool: whether binary frames are used from now on.
+
+    Raises:
+        ProxyError: If the proxy message includes an error code.
+    """
+    await send_message(websocket, f"Framing: {'binary' if binary else 'text'}")
+    framings.pop(websocket, None) # the answer is JSON text
+    proxy_msg = await receive_message(websocket)
+    if proxy_msg == "505: Session reset.":
+        raise SessionReset()
+    if not proxy_msg.startswith("502: Framing "):
+        raise ProxyError("Proxy error " + proxy_msg)
+    if proxy_msg == "502: Framing binary.":
+        framings[websocket] = Framing(commands=client)
+        return True
+    return False
+
+async def receive_message(websocket:ClientProtocol|WebSocketServerProtocol) -> Any:
+    """
+    Receives a message from the proxy and decodes it, whether it was sent as JSON text or as a binary frame.
+    """
+    message = await websocket.recv()
+    framing = framings.get(websocket)
+    if framing and isinstance(message, bytes):
+        return framing.decode(message)
+    return codec.loads(message)
+
+async def send_message(websocket:ClientProtocol|WebSocketServerProtocol, message:Any):
+    """
+    Sends a message to the proxy as JSON text or, if it was negotiated, as a binary frame.
+    """
+    framing = framings.get(websocket)
+    await websocket.send(framing.encode(message) if framing else codec.dumps(message))
+
+def forget_negotiations(websocket:ClientProtocol|WebSocketServerProtocol):
+    """
+    Drops the window and framing negotiated for a socket, e.g. after a session reset.
+    """
+    ack_windows.pop(websocket, None)
+    framings.pop(websocket, None)
+
+# -- Protocol names -------------------------------------------------------------------------------
+
+async def negotiate_protocol_names(websocket:ClientProtocol|WebSocketServerProtocol, once:bool=True) -> bool:
+    """
+    Asks the proxy to only send the protocol name when the client starts a protocol instead of before every action;
+    the server then gets every action of the protocol (or batches of them) until it ends with Quit. Servers negotiate
+    before defining their protocols.
+
+    Args:
+        websocket(ClientProtocol|WebSocketServerProtocol): server socket
+        once(bool): True to get the protocol name once per protocol, False to get it before every action
+
+    Returns:
+        bool: whether the protocol name is only sent once from now on.
+
+    Raises:
+        ProxyError: If the proxy message includes an error code.
+    """
+    await send_message(websocket, f"Protocol name: {'once' if once else 'always'}")
+    proxy_msg = await receive_message(websocket)
+    if proxy_msg == "505: Session reset.":
+        raise SessionReset()
+    if not proxy_msg.startswith("502: Protocol name "):
+        raise ProxyError("Proxy error " + proxy_msg)
+    return proxy_msg == "502: Protocol name once."
 
 # -- Send and receive functions -------------------------------------------------------------------
 async def receive(websocket:ClientProtocol|WebSocketServerProtocol)-> Any:
@@ -18,14 +163,22 @@ async def receive(websocket:ClientProtocol|WebSocketServerProtocol)-> Any:
 
     Raises:
         ProxyError: If the proxy message reports an error.
+        SessionReset: If the proxy wants the server to go back to defining its protocols.
     """
     payload = None
-    proxy_msg = json.loads(await websocket.recv())
+    window = ack_windows.get(websocket)
+    if window and window.pending:
+        proxy_msg = window.pending.popleft() # arrived while send was waiting for an acknowledgement
+    else:
+        proxy_msg = await receive_message(websocket)
     if type(proxy_msg) == list: # separate payload from ok/failure message
         message = proxy_msg[0]
         payload = proxy_msg[1]
     else:
         message = proxy_msg
+    if message == "505: Session reset.":
+        forget_negotiations(websocket) # window and framing have to be negotiated again
+        raise SessionReset()
     if "502" not in message: # handle errors
         raise ProxyError("Proxy error " + proxy_msg)
     if payload: # if not only error or success code in proxy
@@ -34,7 +187,8 @@ async def receive(websocket:ClientProtocol|WebSocketServerProtocol)-> Any:
 async def send(websocket:ClientProtocol|WebSocketServerProtocol, message:Any):
         """
         Packs the payload to be sent into a JSON object and receives succes or failure message
-        back from the proxy.
+        back from the proxy. If a window was negotiated, only every window-th message waits for
+        the (cumulative) acknowledgement.
 
         Args:
             websocket(ClientProtocol|WebSocketServerProtocol): client or server socket
@@ -42,15 +196,98 @@ async def send(websocket:ClientProtocol|WebSocketServerProtocol, message:Any):
         
         Raises:
             ProxyError: If the proxy message includes an error code.
+            SessionReset: If the proxy wants the server to go back to defining its protocols.
         """
-        await websocket.send(json.dumps(message))
-        proxy_msg = json.loads(await websocket.recv())
+        await send_message(websocket, message)
+        window = ack_windows.get(websocket)
+        if window and not window.count():
+            return # acknowledged later together with the rest of the window
+        proxy_msg = await receive_message(websocket)
+        while window and type(proxy_msg) == list: # payloads sent before the acknowledgement are kept for receive
+            window.pending.append(proxy_msg)
+            proxy_msg = await receive_message(websocket)
+        if proxy_msg == "505: Session reset.":
+            forget_negotiations(websocket) # window and framing have to be negotiated again
+            raise SessionReset()
         if "502" not in proxy_msg:
             raise ProxyError("Proxy error " + proxy_msg)
         
+async def send_batch(websocket:ClientProtocol|WebSocketServerProtocol, commands:list[Any]) -> list[list[Any]]:
+        """
+        Sends several commands (action names or [action, payload] lists) of the chosen protocol in one message.
+        The proxy checks all of them before the server carries them out.
+
+        Args:
+            websocket(ClientProtocol|WebSocketServerProtocol): client socket
+            commands(list[Any]): commands in the order they should be carried out
+
+        Returns:
+            list[list[Any]]: for each command, the payloads the server sent back for it.
+
+        Raises:
+            ProxyError: If the proxy message includes an error code.
+        """
+        await send(websocket, {"batch": commands})
+        return await receive(websocket)
+
+async def send_protocols(websocket:ClientProtocol|WebSocketServerProtocol, protocols:list[str], use_digest:bool=True, window:int=1,
+                         binary:bool=False, protocol_name_once:bool=False):
+        """
+        Defines the server's protocols with the proxy and ends the definitions with an End session.
+        If use_digest is True, the proxy is first given the digest of the protocols and they are only
+        sent if the proxy doesn't know them yet.
+
+        Args:
+            websocket(ClientProtocol|WebSocketServerProtocol): server socket
+            protocols(list[str]): protocols (Def sessions) as strings, always in the same order
+            use_digest(bool): whether to announce the digest of the protocols first
+            window(int): if bigger than 1, acknowledgement window negotiated with the proxy for this connection
+            binary(bool): whether to negotiate binary frames with the proxy for this connection
+            protocol_name_once(bool): whether to only get the protocol name when a client starts a protocol
+                                      (see negotiate_protocol_names) instead of before every action
+
+        Raises:
+            ProxyError: If the proxy message includes an error code.
+            SessionReset: If the proxy wants the server to go back to defining its protocols.
+        """
+        if binary:
+            await negotiate_framing(websocket, client=False)
+        if window > 1:
+            await negotiate_window(websocket, window)
+        if protocol_name_once:
+            await negotiate_protocol_names(websocket)
+        if use_digest:
+            await send_message(websocket, f"Digest: {protocols_digest(protocols)}")
+            proxy_msg = await receive_message(websocket)
+            if proxy_msg == "505: Session reset.":
+                forget_negotiations(websocket) # window and framing have to be negotiated again
+                raise SessionReset()
+            if "502" not in proxy_msg:
+                raise ProxyError("Proxy error " + proxy_msg)
+            if proxy_msg == "502: Protocols known.": # proxy already has them
+                return
+        for protocol in protocols:
+            await send(websocket, protocol)
+        await send(websocket, "Session: End") # signals we are done sending protocols
+
+async def acknowledge_reset(websocket:ClientProtocol|WebSocketServerProtocol):
+        """
+        Tells the proxy the server got a SessionReset and will define its protocols again next,
+        so the connection can be used for another client.
+
+        Args:
+            websocket(ClientProtocol|WebSocketServerProtocol): server socket
+        """
+        await send_message(websocket, "Session: Reset")
+
 # -- Define exceptions -------------------------------------------------------------------------------------------------
 class ProxyError(Exception):
     """Exception raised for when proxy sends a message reporting an error."""
     def __init__(self, message:str="Proxy error"):
         self.message = message
-        super().__init__(self.message) 
\ No newline at end of file
+        super().__init__(self.message) 
+
+class SessionReset(ProxyError):
+    """Exception raised for when the proxy asks the server to go back to defining its protocols."""
+    def __init__(self, message:str="505: Session reset."):
+        super().__init__(message)
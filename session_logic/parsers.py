@@ -8,6 +8,8 @@ import re # for parsing sessions
 from typing import Any, Literal, Union, cast # for type definition
 
 import json
+import hashlib # for protocol digests
+from session_logic import codec # to encode and decode payloads
 
 # -- Define functions that enable proxy to change payload ------------------------------
 
@@ -21,9 +23,16 @@ def client_parser_func(message:Any):
 
 #-- String <--> Session Parsers --------------------------------------------------------
 
-def message_into_session(ses_info:str, type_socket:Literal["send", "recv"]="") -> Session:
+# pieces of session strings; all of them are matched at a position of the string, so it's never copied
+name_pattern = re.compile(r"[^,()\[\]]*") # names, labels, directions and actors end at a comma or bracket
+brace_pattern = re.compile(r'[{}"]') # to find the end of a payload type
+
+def message_into_session(ses_info:str, type_socket:Literal["server", "client"]="") -> Session:
     '''
     Parses a string and transforms into into a session object.
+    The string is read once from start to end and nested sessions are kept on a stack instead of
+    parsing them recursively, so sessions of any size and depth can be parsed. Identical parts of sessions
+    are shared (see SessionTable), so the parsed sessions must not be changed.
 
         Args:
             ses_info (str): session as a string
@@ -33,97 +42,146 @@ def message_into_session(ses_info:str, type_socket:Literal["send", "recv"]="") -
         Returns:
             The parsed session
     '''
+    position = 0
+    table = SessionTable() # identical parts of the session are only made once
 
-    if ses_info.startswith("Session: "):
-        ses_info = ses_info[9:] # split string to figure out which kind of session
-        # print(f"Parsing session {ses_info}...") # comment out for debugging
+    def syntax_error(expected:str):
+        return SessionError(f"Error parsing message into session: wrong syntax at position {position} (expected {expected})")
 
-        # single session
-        if ses_info.startswith("Single"):
-            # pattern for normal client-server proxy
-            pattern = r"Single, Dir: (.*?), Payload: (.*?), Cont: (.*)"
-            match = re.match(pattern, ses_info)
-
-            # pattern for multiparty proxy
-            patternMulti = r"Single, Dir: (.*?), Actor: (.*?), Payload: (.*?), Cont: (.*)"
-            matchMulti = re.match(patternMulti, ses_info)
-
-            if matchMulti:
-                dir_given, actor_given, pay_given, cont_ses = matchMulti.groups()
-                #return single session and parse the cont str to make it a session too
-                session_changed = Single(dir=Dir(dir_given), actor=actor_given, payload=pay_given, cont=message_into_session(cont_ses, type_socket))
-            elif match:
-                dir_given, pay_given, cont_ses = match.groups()
-                match (dir_given, type_socket):
-                    case ("send", "server"):
-                        dir_given = "send"
-                    case ("send", "client"):
-                        dir_given = "recv"
-                    case ("recv", "server"):
-                        dir_given = "recv"
-                    case ("recv", "client"):
-                        dir_given = "send"
-                    case _:
-                        print("Error: invalid direction given") # not handled as exception but could be
-                #return single session and parse the cont str to make it a session too
-                session_changed = Single(dir=Dir(dir_given), payload=pay_given, cont=message_into_session(cont_ses, type_socket))
-            else:
-                raise SessionError("Error parsing message into session: wrong syntax")
+    def expect(text:str):
+        nonlocal position
+        if not ses_info.startswith(text, position):
+            raise syntax_error(f"'{text}'")
+        position += len(text)
 
-        # def session; uses type_socket parameter
-        elif ses_info.startswith("Def"):
-            pattern = r"Def, Name: (.*?), Cont: (.*)"
-            match = re.match(pattern, ses_info)
-            if match:
-                name_given, cont_ses = match.groups()
-                # print(f"Parsing protocol {name_given}") # comment put to debug
-                # recursively parse choice sessions defined in protocol with "cont"
-                if type_socket != "":
-                    session_changed = Def(name=f"{name_given}_{type_socket}", cont=message_into_session(cont_ses, type_socket))
-                else:
-                    session_changed = Def(name=f"{name_given}", cont=message_into_session(cont_ses, type_socket))
-            else:
-                raise SessionError("Error parsing message into session: wrong syntax")
+    def read_name() -> str:
+        nonlocal position
+        match = name_pattern.match(ses_info, position)
+        position = match.end()
+        return match.group().strip()
 
-        # ref session
-        elif ses_info.startswith("Ref"):
-            if ses_info.startswith("Ref, Name: "):
-                name_given = ses_info[11:] # references protocol name
-                session_changed = Ref(name=f"{name_given}_{type_socket}")
+    def read_payload() -> str:
+        # payload types are { ... } with nested braces; quoted strings can contain anything
+        nonlocal position
+        if not ses_info.startswith("{", position):
+            raise syntax_error("a payload type")
+        depth, index = 0, position
+        while True:
+            found = brace_pattern.search(ses_info, index)
+            if found is None:
+                raise syntax_error("the end of the payload type")
+            index = found.end()
+            if found.group() == '"':
+                closing = ses_info.find('"', index)
+                if closing == -1:
+                    raise syntax_error("the end of a string in the payload type")
+                index = closing + 1
+            elif found.group() == "{":
+                depth += 1
             else:
-                raise SessionError("Error parsing message into session: wrong syntax")
+                depth -= 1
+                if depth == 0:
+                    payload = ses_info[position:index]
+                    position = index
+                    return payload
+
+    def name_for(name:str) -> str:
+        return f"{name}_{type_socket}" if type_socket != "" else name
 
+    # sessions still waiting for the session that comes after them (their cont or their next alternative)
+    pending: list[list] = []
+    expect_prefix = True # alternatives are written without "Session: "
+    while True:
+        if expect_prefix and not ses_info.startswith("Session: ", position):
+            raise SessionError(f"Error parsing session at position {position}")
+        position += 9 if expect_prefix else 0
+        session_changed: Session | None = None
+
+        # single session
+        if ses_info.startswith("Single, Dir: ", position):
+            position += 13
+            dir_given = read_name()
+            actor_given = None
+            if ses_info.startswith(", Actor: ", position): # multiparty proxy
+                position += 9
+                actor_given = read_name()
+            expect(", Payload: ")
+            pay_given = read_payload()
+            expect(", Cont: ")
+            if actor_given is None:
+                if dir_given not in mirrored_dirs:
+                    print("Error: invalid direction given") # not handled as exception but could be
+                elif type_socket == "client":
+                    dir_given = mirrored_dirs[dir_given]
+            pending.append(["single", dir_given, actor_given, pay_given])
+        # def session; uses type_socket parameter
+        elif ses_info.startswith("Def", position):
+            expect("Def, Name: ")
+            name_given = read_name()
+            expect(", Cont: ")
+            pending.append(["def", name_given])
+        # ref session
+        elif ses_info.startswith("Ref", position):
+            expect("Ref, Name: ")
+            session_changed = table.ref(name_for(read_name())) # references protocol name
         # choice session
-        # Idea: session would look like: Session: Choice, Dir: send, Alternatives: [{Label: Add, Session: Single, }]
-        elif ses_info.startswith("Choice"):
-            pattern = r"Choice, Dir: (.*?), Alternatives: \[(.*)\]" # alternatives like that so it's dict
-            match = re.match(pattern, ses_info)
-            if match:
-                dir_given, alternatives_given = match.groups()
-                # parse alternatives
-                alternatives_parsed = {} # to keep track of all sessions in alternatives dictionay
-                alt_matches = re.findall(r"\(Label: (.*?), Session: (.*?)\)", alternatives_given) # find all things with this structure in alternatives
-                for label, alt_session in alt_matches:
-                    # Parse each alternative's session recursively
-                    alternatives_parsed[Label(label.strip())] = message_into_session(f"Session: {alt_session.strip()}", type_socket)
-                alternatives_parsed:Dict[Label, Session] # in order for the creation of Choice to be ok
-                session_changed = Choice(dir=Dir(dir_given), alternatives=alternatives_parsed)
+        # Idea: session would look like: Session: Choice, Dir: send, Alternatives: [(Label: Add, Session: Single, ...), ...]
+        elif ses_info.startswith("Choice", position):
+            expect("Choice, Dir: ")
+            dir_given = read_name()
+            expect(", Alternatives: [")
+            if ses_info.startswith("]", position):
+                position += 1
+                session_changed = table.choice(Dir(dir_given), {})
             else:
-                raise SessionError("Error parsing message into session: wrong syntax")
+                expect("(Label: ")
+                label = read_name()
+                expect(", Session: ")
+                pending.append(["choice", dir_given, {}, label])
         # end session
-        elif ses_info == "End":
+        elif ses_info.startswith("End", position):
+            position += 3
             session_changed = End()
         # if no cases match
         else:
-            raise SessionError("Error parsing session")
-        # return resulting session
-        return session_changed
-    else:
-        raise SessionError("Error parsing session")
+            raise SessionError(f"Error parsing session at position {position}")
+
+        expect_prefix = True
+        if session_changed is None:
+            expect_prefix = pending[-1][0] != "choice"
+            continue # parse the session that comes next
+
+        # give the finished session to the sessions waiting for it
+        while pending:
+            waiting = pending[-1]
+            if waiting[0] == "single":
+                pending.pop()
+                session_changed = table.single(Dir(waiting[1]), waiting[3], session_changed, waiting[2])
+            elif waiting[0] == "def":
+                pending.pop()
+                session_changed = table.definition(name_for(waiting[1]), session_changed)
+            else:
+                waiting[2][Label(waiting[3])] = session_changed
+                expect(")")
+                if ses_info.startswith(", (Label: ", position): # next alternative
+                    position += 10
+                    waiting[3] = read_name()
+                    expect(", Session: ")
+                    expect_prefix = False
+                    break
+                expect("]")
+                pending.pop()
+                session_changed = table.choice(Dir(waiting[1]), waiting[2])
+        else:
+            if ses_info[position:].strip() != "":
+                raise syntax_error("the end of the session")
+            return session_changed
 
 def session_into_message(session: Session) -> str:
     '''
     Serializes a Session object into a string.
+    The parts of the string are collected in one list and joined at the end, so long protocols are serialized
+    in linear time (and without running into the recursion limit).
     
         Args:
             session (Session): the session object to serialize
@@ -131,42 +189,103 @@ def session_into_message(session: Session) -> str:
         Returns:
             str: string representation of the session
     '''
-    if isinstance(session, Single):
-        if session.actor:
-            return (
-                f"Session: Single, Dir: {session.dir}, Actor: {session.actor}, Payload: {session.payload}, "
-                f"Cont: {session_into_message(session.cont)}"
-            )
+    parts: list[str] = ["Session: "]
+    pending: list[Session | str] = [session] # sessions still to serialize and text that goes after them, last first
+    while pending:
+        item = pending.pop()
+        if isinstance(item, str):
+            parts.append(item)
+
+        elif isinstance(item, Single):
+            actor = f"Actor: {item.actor}, " if item.actor else ""
+            parts.append(f"Single, Dir: {item.dir}, {actor}Payload: {item.payload}, Cont: Session: ")
+            pending.append(item.cont)
+
+        elif isinstance(item, Def):
+            parts.append(f"Def, Name: {item.name}, Cont: Session: ")
+            pending.append(item.cont)
+
+        elif isinstance(item, Ref):
+            parts.append(f"Ref, Name: {item.name}")
+
+        elif isinstance(item, Choice):
+            parts.append(f"Choice, Dir: {item.dir}, Alternatives: [")
+            pending.append("]")
+            alternatives = list(item.alternatives.items())
+            for i in range(len(alternatives) - 1, -1, -1): # pushed in reverse so they come out in order
+                label_given, alt_session = alternatives[i]
+                pending.append(")")
+                pending.append(alt_session)
+                pending.append(f"(Label: {label_given.label}, Session: " if i == 0 else f", (Label: {label_given.label}, Session: ")
+
+        elif isinstance(item, End):
+            parts.append("End")
+
         else:
-            return (
-                f"Session: Single, Dir: {session.dir}, Payload: {session.payload}, "
-                f"Cont: {session_into_message(session.cont)}"
-            )
-    
-    elif isinstance(session, Def):
-        return (
-            f"Session: Def, Name: {session.name}, Cont: {session_into_message(session.cont)}"
-        )
-    
-    elif isinstance(session, Ref):
-        return f"Session: Ref, Name: {session.name}"
-    
-    elif isinstance(session, Choice):
-        alternatives: list[str] = []
-        for label_given, alt_session in session.alternatives.items():
-            alt_str = (
-                f"(Label: {label_given.label}, Session: {session_into_message(alt_session)[9:]})"
-            )
-            alternatives.append(alt_str)
-        return (
-            f"Session: Choice, Dir: {session.dir}, Alternatives: [{', '.join(alternatives)}]"
-        )
-    
-    elif isinstance(session, End):
-        return "Session: End"
-    
-    else:
-        raise ValueError("Unknown session type")
+            raise ValueError("Unknown session type")
+    return "".join(parts)
+
+
+def protocols_digest(protocols: list[str]) -> str:
+    '''
+    Makes a digest of a set of protocols so the server can announce them without sending them.
+    The order of the protocols matters, so servers have to send them in the same order every time.
+
+        Args:
+            protocols (list[str]): protocols (Def sessions) as strings
+
+        Returns:
+            str: sha256 hex digest of the protocols
+    '''
+    return hashlib.sha256(json.dumps(protocols).encode()).hexdigest() # standard library so every side gets the same digest
+
+
+#-- Forward payloads without encoding them again ----------------------------------------
+
+json_decoder = json.JSONDecoder() # to decode the action at the start of a command
+whitespace = re.compile(r"[ \t\n\r]*") # whitespace allowed between JSON values
+
+def decode_command(message: str | bytes) -> tuple[Any, str | None]:
+    '''
+    Decodes a command sent by the client. Commands with a payload are sent as [action, payload]; for those the
+    JSON text of the payload is returned too, so it can be forwarded as it was sent instead of encoding it again.
+
+        Args:
+            message (str | bytes): message as received from the client
+
+        Returns:
+            The decoded command and the JSON text of its payload (None if the command is not [action, payload]).
+    '''
+    if isinstance(message, bytes):
+        message = message.decode()
+    start = whitespace.match(message).end()
+    if message.startswith("[", start):
+        try:
+            # only the action is decoded on its own; whatever is between the next comma and the closing ] is the payload
+            action, end = json_decoder.raw_decode(message, whitespace.match(message, start + 1).end())
+            position = whitespace.match(message, end).end()
+            last = len(message.rstrip(" \t\n\r")) - 1 # position of the closing ]
+            if message.startswith(",", position) and message[last] == "]":
+                payload_json = message[position + 1:last].strip(" \t\n\r")
+                return [action, codec.loads(payload_json)], payload_json # fails if the list has more than two elements
+        except json.JSONDecodeError:
+            pass # not [action, payload], so it's decoded as a whole
+    return codec.loads(message), None
+
+def wrap_payload(payload_json: str | bytes) -> str:
+    '''
+    Puts a payload that is already JSON text into the message that forwards it ("502: Operation succesful.", payload),
+    without decoding and encoding it again.
+
+        Args:
+            payload_json (str | bytes): payload as JSON text; it has to be valid JSON
+
+        Returns:
+            str: message to forward
+    '''
+    if isinstance(payload_json, bytes):
+        payload_json = payload_json.decode()
+    return '["502: Operation succesful.", ' + payload_json + ']'
 
 
 #-- Create payload string easier --------------------------------------------------------
@@ -221,57 +340,92 @@ def payload_to_string(type_str:AllTypes, payload:PayloadTypes=None) -> str:
             raise ParsingError("This payload couldn't be turned into a string")
 
 
-def json_payload_to_string(payload:Any) -> str:
+leaf_payload_types = {bool: '{ type: "bool" }', str: '{ type: "string" }', type(None): '{ type: "null" }',
+                      int: '{ type: "number" }', float: '{ type: "number" }'} # payload type of JSON values without elements
+
+def infer_payload_type(value:Any, sample:int|None=None) -> str:
     '''
-    Analyzes a JSON object and makes a payload string (as accepted in session descriptions) describing its type.
+    Makes a payload string (as accepted in session descriptions) describing the type of an already decoded JSON object.
+    The object is gone through once, without recursion, and the types of the elements of lists are merged:
+
+    - Lists whose elements all have the same type are type "array" (of that type)
+    - Other lists are type "tuple", with the type of every element; an empty list is a tuple without elements
+    - Lists longer than sample (if given) only have sample elements spread from the first to the last one checked;
+      if these don't all have the same type, the list is type "union" of their types, since the position of each
+      type is not known
+    - Dicts with only one element are type "def" and dicts with any other number of elements type "record"
 
-    Note:
-    - All lists with only one element get defined as type "array"
-    - All lists with more than one element get defined as type "tuple" (so no unions)
-    - All dicts with only one element get defined as type "def"
-    - All dicts with more than one element get defined as type "record"
-        
         Args:
-            payload (JSON object): optional string or list of strings describing extra payloads (for tupless, arrays, unions and records)
-        
+            value (Any): decoded JSON object
+            sample (int): how many elements of long lists are checked (all of them if None)
+
         Returns:
-            str: string representation of the payload
+            str: payload string describing the type of the object
     '''
-    unpacked:Any = json.loads(payload) # unpack payload from JSON
-    if isinstance(unpacked, bool):
-        return '{ type: "bool" }'
-    elif isinstance(unpacked, str):
-        return '{ type: "string" }'
-    elif unpacked is None:
-        return '{ type: "null" }'
-    elif isinstance(unpacked, (int, float, complex)):
-        return '{ type: "number" }'
-    elif isinstance(unpacked, list):
-        items = cast(list[Any], unpacked) # declaring type of list so no type errors
-        if all(isinstance(a, type(items[0])) for a in items): # checking case array elements are of the same type
-            return f'{{ type: "array", payload: {json_payload_to_string(payload=json.dumps(items[0]))} }}'
-        # case union or tuple? return list of both options?
-        else:
-            elements:list[str] = [json_payload_to_string(json.dumps(i)) for i in items]
-            return f'{{ type: "tuple", payload: [' + ", ".join(elements) + '] }'
-    elif isinstance(unpacked, dict): # maybe check keys are strings ALWAYS?
-        defined_dict = cast(dict[Any, Any], unpacked) # declaring dict generally to avoid type errors
-        if all(isinstance(key, str) for key in defined_dict.keys()):
-            if len(defined_dict) == 1: # if dict only has one element it could be def or record?? but do def!
-                # get first key and then first value with that
-                val = defined_dict[list(defined_dict.keys())[0]]
-                return f'{{ type: "def", name: {{ type: "string" }}, payload: {json_payload_to_string(json.dumps(val))} }}'
-            # if 2+ elems then definitely record
+    if sample is not None and sample < 1:
+        raise ParsingError("At least one element of a list has to be sampled")
+    inferred:list[str|None] = [None]
+    # values whose type goes to a position of the types of their list or dict; once the types of
+    # their elements are pending too, these are given so they can be merged after them
+    pending:list[tuple[Any, list[str|None], int, list[str|None]|None]] = [(value, inferred, 0, None)]
+    while pending:
+        current, types, position, element_types = pending.pop()
+        if element_types is not None: # types of all elements are known, so they are merged
+            if isinstance(current, dict):
+                if len(element_types) == 1:
+                    merged = f'{{ type: "def", name: {{ type: "string" }}, payload: {element_types[0]} }}'
+                else:
+                    merged = '{ type: "record", payload: [' + ", ".join(element_types) + '] }'
             else:
-                elements = [json_payload_to_string(json.dumps(i)) for i in list(defined_dict.values())] # iterate through all values of keys
-                return f'{{ type: "record", payload: [' + ", ".join(list(elements)) + '] }'
+                distinct = list(dict.fromkeys(element_types))
+                if len(distinct) == 1:
+                    merged = f'{{ type: "array", payload: {distinct[0]} }}'
+                elif len(element_types) < len(current): # sampled, so only the types are known, not where they are
+                    merged = '{ type: "union", payload: [' + ", ".join(distinct) + '] }'
+                else:
+                    merged = '{ type: "tuple", payload: [' + ", ".join(element_types) + '] }'
+            types[position] = sys.intern(merged) # same types are the same string, so they are quick to compare
+            continue
+        leaf = leaf_payload_types.get(type(current))
+        if leaf is not None:
+            types[position] = leaf
+            continue
+        if isinstance(current, list):
+            items = cast(list[Any], current) # declaring type of list so no type errors
+            if sample is not None and len(items) > sample:
+                last = len(items) - 1
+                items = [items[i * last // (sample - 1)] for i in range(sample)] if sample > 1 else items[:1]
+        elif isinstance(current, dict):
+            defined_dict = cast(dict[Any, Any], current) # declaring dict generally to avoid type errors
+            if not all(isinstance(key, str) for key in defined_dict.keys()):
+                # technically won't happen because JSON makes all keys strings but just in case
+                raise ParsingError("All keys in a def or record type have to be strings")
+            items = list(defined_dict.values())
+        elif isinstance(current, (int, float, complex)): # e.g. subclasses of int
+            types[position] = '{ type: "number" }'
+            continue
         else:
-            # technically won't happen because JSON makes all keys strings but just in case
-            raise ParsingError("All keys in a def or record type have to be strings")
-    else:
-        # technically shouldn't be possible to reach here but just in case
-        raise ParsingError ("This is not a type that is handled as payload by the proxy")
-    
+            # technically shouldn't be possible to reach here but just in case
+            raise ParsingError("This is not a type that is handled as payload by the proxy")
+        element_types = [leaf_payload_types.get(type(item)) for item in items] # elements without elements are done right away
+        pending.append((current, types, position, element_types))
+        pending.extend((item, element_types, i, None) for i, item in enumerate(items) if element_types[i] is None)
+    return cast(str, inferred[0])
+
+def json_payload_to_string(payload:Any, sample:int|None=None) -> str:
+    '''
+    Analyzes a JSON object and makes a payload string (as accepted in session descriptions) describing its type.
+    The JSON is only decoded once; see infer_payload_type for how the types are chosen.
+
+        Args:
+            payload (JSON object): JSON string of the payload
+            sample (int): how many elements of long lists are checked (all of them if None)
+
+        Returns:
+            str: string representation of the payload
+    '''
+    return infer_payload_type(codec.loads(payload), sample)
+
 # define custom exceptions for parsing errors
 class ParsingError(Exception):
     """Exception raised for errors in parsing"""
@@ -1,7 +1,13 @@
 import json
 import jsonschema
-import re # to parse payload types for tuple and union
-from typing import Any, Dict
+from session_logic import codec # to decode payloads
+import re # to split payload types into tokens
+from dataclasses import dataclass # for the parsed payload types
+from typing import Any, Callable, Dict
+from functools import lru_cache # to keep validators of payload types that were already seen
+
+# to attach validators to sessions
+from session_logic.session_types import Session, Single, Choice, Def
 
 # ---------------- define json schemas ----------------------------------------------------------------
 # these schemas are like the "templates" the payload types are compared against
@@ -41,51 +47,49 @@ schema_any:JsonSchema = {
 # dynamically create the following schemas:
 
 # def schema
-def schema_def(name: str, payload_type:str) -> JsonSchema:
+def schema_def(payload_type:JsonSchema) -> JsonSchema:
     '''
     Function that returns a JSONSchema based on a a payload of type def.
+    The name can be any string, so the schema only asks for exactly one field of the given type.
 
         Args:
-            name (str): how it will be defined
-            payload_type (str): payload that comes with definition
+            payload_type (JsonSchema): schema of the payload that comes with definition
 
         Returns:
             A JSON schema that matches payload type def.
     '''
     return {
         "type": "object",
-        "properties": {
-            name: {"type": payload_type}
-        },
-        "required": [name],  # Ensure the name field is required
-        "additionalProperties": False  # Prevent extra fields
+        "minProperties": 1,  # Ensure the name field is there
+        "maxProperties": 1,  # Prevent extra fields
+        "additionalProperties": payload_type
     }
 
 # array schema
-def schema_array(type_array:str) -> JsonSchema:
+def schema_array(type_array:JsonSchema) -> JsonSchema:
    '''
     Function that returns a JSONSchema based on a a payload of type array.
     An array has a variable length but all elements should be of same type.
 
         Args:
-            type_array (str): str to define type of payload inside array so it can later be checked by a schema.
+            type_array (JsonSchema): schema of the payload inside array so it can later be checked.
 
         Returns:
             A JSON schema that matches payload type array.
     '''
    return {
         "type": "array",
-        "items": {"type": type_array}
+        "items": type_array
     }
 
 # tuple schema
-def schema_tuple(type_list: list[str], supposed_length: int) -> JsonSchema:
+def schema_tuple(type_list: list[JsonSchema], supposed_length: int) -> JsonSchema:
     '''
     Function that returns a JSONSchema based on a a payload of type tuple.
     A tuple is of a fixed length but its elements can be of different types
 
         Args:
-            type_list (list[str]): list (in order) of what type ach element in tuple is.
+            type_list (list[JsonSchema]): list (in order) of the schema of each element in tuple.
             suppsoed_length (int): fixed length of tuple
 
         Returns:
@@ -93,19 +97,19 @@ def schema_tuple(type_list: list[str], supposed_length: int) -> JsonSchema:
     '''
     return {
         "type": "array",
-        "prefixItems": [{"type": t} for t in type_list],  # should be at the top level
+        "prefixItems": type_list,  # should be at the top level
         "minItems": supposed_length,
         "maxItems": supposed_length
     }
 
 # union schema
-def schema_union(type_array:list[str]) -> JsonSchema:
+def schema_union(type_array:list[JsonSchema]) -> JsonSchema:
     '''
     Function that returns a JSONSchema based on a a payload of type union.
     A union is an array but it's elements can be of any type listed beforehand.
 
         Args:
-            type_array (list[str]): all possible types of elements in union.
+            type_array (list[JsonSchema]): schemas of all possible types of elements in union.
 
         Returns:
             A JSON schema that matches payload type union.
@@ -113,33 +117,142 @@ def schema_union(type_array:list[str]) -> JsonSchema:
     return {
         "type": "array",
         "items": {
-            "oneOf": [{"type": t} for t in type_array]  # Each item can be one of these types
+            "oneOf": type_array  # Each item can be one of these types
         }
     }
 
 # record schema
-def schema_record(field_names: list[str], type_list: list[str]) -> JsonSchema:
+def schema_record(type_list: list[JsonSchema]) -> JsonSchema:
     '''
     Function that returns a JSONSchema based on a a payload of type record.
     A record is kind of like a python dictionary that keeps payloads and gives them a name as "key".
+    Fields are matched to types by order, whatever their names, which JSON schema can't express;
+    so the schema only asks for at most one field per type and every field to be one of the types.
+    The validators made by get_validator do check the order.
 
         Args:
-            field_names (list[str]): names of each element in dictionary, in order
-            type_list (list[str]): payload type of each element in dictionary, in order
+            type_list (list[JsonSchema]): schema of each element in dictionary, in order
 
         Returns:
             A JSON schema that matches payload type record.
     '''
     return {
         "type": "object",
-        "properties": {
-            field: {"type": type_list[i]}  # Match field to type by order
-            for i, field in enumerate(field_names)
-        },
-        "required": field_names,  # All fields are required
-        "additionalProperties": False  # No extra fields allowed
+        "maxProperties": len(type_list),  # No extra fields allowed
+        "additionalProperties": {"anyOf": type_list} if type_list else False
     }
 
+# -- parse payload types ---------------------------------------------------------------------------------------
+# payload types are written like { type: "tuple", payload: [{ type: "number" }, { type: "string" }] }
+# and are parsed once into a tree of PayloadType, which validators and schemas are made from
+
+@dataclass(frozen=True)
+class PayloadType:
+    kind: str # any, number, string, bool, null, array, tuple, union, def or record
+    items: tuple["PayloadType", ...] = () # inner payload types, in order (one for array and def)
+
+# payload types that don't have inner payloads
+simple_kinds = {"any", "number", "string", "bool", "null"}
+
+# one token per match: a symbol, a word or a quoted string (whitespace in between is skipped)
+token_pattern = re.compile(r'\s*(?:([{}\[\],:])|(\w+)|"([^"]*)")')
+
+def tokenize_payload_type(payload_in_ses: str) -> list[tuple[str, str, int]]:
+    '''
+    Splits a payload type into tokens in a single pass.
+
+    Args:
+        payload_in_ses (str): the payload type according to the session
+
+    Returns:
+        A list of (kind, text, position) where kind is "symbol", "word" or "string".
+    '''
+    tokens: list[tuple[str, str, int]] = []
+    position = 0
+    while position < len(payload_in_ses):
+        match = token_pattern.match(payload_in_ses, position)
+        if match is None:
+            if payload_in_ses[position:].strip() == "":
+                break # only whitespace left
+            raise TypeError(f"Error! unexpected character at position {position} of payload type {payload_in_ses}")
+        symbol, word, string = match.groups()
+        if symbol is not None:
+            tokens.append(("symbol", symbol, match.start(1)))
+        elif word is not None:
+            tokens.append(("word", word, match.start(2)))
+        else:
+            tokens.append(("string", string, match.start(3)))
+        position = match.end()
+    return tokens
+
+@lru_cache(maxsize=1024)
+def parse_payload_type(payload_in_ses: str) -> PayloadType:
+    '''
+    Parses a payload type as written in sessions into a PayloadType tree. Inner payload types can be nested
+    as deep as needed (arrays of tuples, tuples of tuples, ...).
+
+    Args:
+        payload_in_ses (str): the payload type according to the session
+
+    Returns:
+        The parsed payload type.
+    '''
+    tokens = tokenize_payload_type(payload_in_ses)
+    position = 0
+
+    def fail(expected: str):
+        found = f"'{tokens[position][1]}' at position {tokens[position][2]}" if position < len(tokens) else "the end"
+        raise TypeError(f"Error! expected {expected} but found {found} in payload type {payload_in_ses}")
+
+    def expect(kind: str, text: str | None = None) -> str:
+        nonlocal position
+        if position >= len(tokens) or tokens[position][0] != kind or (text is not None and tokens[position][1] != text):
+            fail(text or kind)
+        position += 1
+        return tokens[position - 1][1]
+
+    def field(name: str):
+        expect("symbol", ",")
+        expect("word", name)
+        expect("symbol", ":")
+
+    def parse_type() -> PayloadType:
+        nonlocal position
+        expect("symbol", "{")
+        expect("word", "type")
+        expect("symbol", ":")
+        kind = expect("string")
+        if kind in simple_kinds:
+            items: tuple[PayloadType, ...] = ()
+        elif kind == "array":
+            field("payload")
+            items = (parse_type(),)
+        elif kind == "def":
+            field("name")
+            if parse_type() != PayloadType("string"):
+                raise TypeError(f"Error! the name of a def has to be a string in payload type {payload_in_ses}")
+            field("payload")
+            items = (parse_type(),)
+        elif kind in ("tuple", "union", "record"):
+            field("payload")
+            expect("symbol", "[")
+            inner: list[PayloadType] = []
+            while not (position < len(tokens) and tokens[position][:2] == ("symbol", "]")):
+                if inner:
+                    expect("symbol", ",")
+                inner.append(parse_type())
+            position += 1 # skip ]
+            items = tuple(inner)
+        else:
+            raise TypeError("Error! payload is not of a recognized type")
+        expect("symbol", "}")
+        return PayloadType(kind, items)
+
+    payload_type = parse_type()
+    if position != len(tokens):
+        fail("the end")
+    return payload_type
+
 # --- functions for checking -----------------------------------------------------------------------------------
 
 # any is considered any of the other types
@@ -158,49 +271,178 @@ def checkPayload(payload_sender:Any, payload_in_ses: str, expected_payload: str)
     if payload_in_ses != expected_payload:
         raise TypeError("The session payload types are different!")
     else:
-        data = json.loads(payload_sender) # Convert JSON string to Python data
-        if payload_in_ses == '{ type: "any" }': 
-            return try_schema(data, schema_any, payload_in_ses)
-        if payload_in_ses == '{ type: "number" }': 
-            return try_schema(data, schema_number, payload_in_ses)
-        elif payload_in_ses == '{ type: "string" }':
-            return try_schema(data, schema_string, payload_in_ses)
-        elif payload_in_ses == '{ type: "null" }':
-            return try_schema(data, schema_null, payload_in_ses)
-        elif payload_in_ses == '{ type: "bool" }':
-            return try_schema(data, schema_bool, payload_in_ses)
-        # array
-        elif ('{ type: "array"' in payload_in_ses):
-            type = extract_types(payload_in_ses[26:-2])[0] # get the type in array according to session description
-            return try_schema(data, schema_array(type), payload_in_ses) # create array schema dynamically
-        # tuple
-        elif ('{ type: "tuple"' in payload_in_ses):
-            types = extract_types(payload_in_ses[26:].replace("[", "").replace("]", "")) # get the types in array according to session description
-            supposed_length = len(types) # how many items there should be in tuple
-            return try_schema(data, schema_tuple(types, supposed_length), payload_in_ses) # create tuple schema dynamically
-        # union
-        elif ('{ type: "union"' in payload_in_ses):
-            types = extract_types(payload_in_ses[26:].replace("[", "").replace("]", "")) # get the types in array according to session description
-            return try_schema(data, schema_union(types), payload_in_ses) # create union schema dynamically
-        # def
-        elif ('{ type: "def"' in payload_in_ses):
-            # extract payload type with the usual format to check it in schema
-            payload_type = payload_in_ses.split(", ")[2]
-            payload_type = payload_type.replace('payload: { type: "', '')
-            payload_type = payload_type.replace('" } }', '')
-
-            # checking actual_name and passing it on to the dynamic schema
-            actual_name = list(data.items())[0][0]  # def object is like dict!
-
-            return try_schema(data, schema_def(actual_name, payload_type), payload_in_ses)
-        # record
-        elif ('{ type: "record"' in payload_in_ses):
-            field_names = list(data.keys())  # Extracts keys in order
-            types = extract_types(payload_in_ses[27:].replace("[", "").replace("]", "")) # get the types in record according to session description
-            return try_schema(data, schema_record(field_names, types), payload_in_ses) # create union schema dynamically
-        else:
+        data = codec.loads(payload_sender) # Convert JSON string to Python data
+        validator = get_validator(payload_in_ses) # built only the first time this payload type is seen
+        return try_validator(data, validator, payload_in_ses)
+
+def checkSinglePayload(data: Any, single: Single) -> str | Exception:
+    '''
+    Checks the payload sent in a Single session with the validator attached to it by attach_validators.
+    The payload types of server and client were already compared then, so only the payload is checked.
+
+    Args:
+        data (Any): payload that was sent, already loaded from JSON
+        single (Single): session the payload was sent in
+
+    Returns:
+        A string if it worked and an exception otherwise
+    '''
+    validator = single.validator or get_validator(single.payload) # sessions that were never registered have none
+    return try_validator(data, validator, single.payload)
+
+def attach_validators(ses_server: Session, ses_client: Session):
+    '''
+    Walks the server and client versions of a protocol together and attaches the validator of its payload type
+    to every pair of Single sessions, after checking server and client agree on the payload type.
+
+    Args:
+        ses_server (Session): protocol as parsed for the server
+        ses_client (Session): protocol as parsed for the client
+
+    Returns nothing if it works and raises a TypeError if server and client sessions don't match.
+    '''
+    pending = [(ses_server, ses_client)]
+    while pending:
+        server, client = pending.pop()
+        match (server, client):
+            case (Single(), Single()):
+                if server.payload != client.payload:
+                    raise TypeError("The session payload types are different!")
+                server.validator = client.validator = get_validator(server.payload)
+                pending.append((server.cont, client.cont))
+            case (Choice(), Choice()):
+                if server.alternatives.keys() != client.alternatives.keys():
+                    raise TypeError("The session choices are different!")
+                pending.extend((alternative, client.alternatives[label]) for label, alternative in server.alternatives.items())
+            case (Def(), Def()):
+                pending.append((server.cont, client.cont))
+            case _ if server.kind == client.kind: # Ref and End sessions have no payloads
+                pass
+            case _:
+                raise TypeError("The server and client sessions are different!")
+
+@lru_cache(maxsize=1024)
+def get_validator(payload_in_ses: str) -> Callable[[Any], bool]:
+    '''
+    Parses a payload type and creates a validator for it: a plain python check made by compile_payload_type.
+    The most recently used validators are kept, so this only happens once per payload type.
+
+    Args:
+        payload_in_ses (str): the payload type according to the session
+
+    Returns:
+        A function that returns True if a payload is of the payload type.
+    '''
+    return compile_payload_type(parse_payload_type(payload_in_ses))
+
+# python checks for the payload types without inner payloads; bools are not numbers in JSON
+type_checks: Dict[str, Callable[[Any], bool]] = {
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "string": lambda value: isinstance(value, str),
+    "bool": lambda value: isinstance(value, bool),
+    "null": lambda value: value is None,
+    "any": lambda value: value is None or isinstance(value, (str, bool, int, float, list)), # anything but objects
+}
+
+def compile_payload_type(payload_type: PayloadType) -> Callable[[Any], bool]:
+    '''
+    Turns a parsed payload type into a python function that checks a payload with isinstance and length checks.
+    It gives the same result as checking the payload against the schema made by payload_schema, except that
+    record fields are also checked by order.
+
+    Args:
+        payload_type (PayloadType): parsed payload type
+
+    Returns:
+        The check.
+    '''
+    kind = payload_type.kind
+    if kind in type_checks:
+        return type_checks[kind]
+    checks = [compile_payload_type(item) for item in payload_type.items]
+    match kind:
+        case "array":
+            item_check = checks[0]
+            return lambda value: isinstance(value, list) and all(item_check(item) for item in value)
+        case "tuple":
+            length = len(checks)
+            return lambda value: isinstance(value, list) and len(value) == length and all(check(item) for check, item in zip(checks, value))
+        case "union":
+            # like oneOf in JSON schema, every element has to match exactly one of the types
+            return lambda value: isinstance(value, list) and all(sum(1 for check in checks if check(item)) == 1 for item in value)
+        case "def":
+            field_check = checks[0]
+            return lambda value: isinstance(value, dict) and len(value) == 1 and all(field_check(item) for item in value.values())
+        case "record":
+            # fields are matched to types by order, whatever their names
+            length = len(checks)
+            return lambda value: isinstance(value, dict) and len(value) <= length and all(check(item) for check, item in zip(checks, value.values()))
+        case _:
             raise TypeError("Error! payload is not of a recognized type")
 
+def payload_schema(payload_in_ses: str) -> JsonSchema:
+    '''
+    Returns the JSON schema for a payload type as written in sessions.
+
+    Args:
+        payload_in_ses (str): the payload type according to the session
+
+    Returns:
+        A JSON schema that matches the payload type.
+    '''
+    return type_schema(parse_payload_type(payload_in_ses))
+
+def type_schema(payload_type: PayloadType) -> JsonSchema:
+    '''
+    Builds the JSON schema for a parsed payload type, including the schemas of inner payload types.
+
+    Args:
+        payload_type (PayloadType): parsed payload type
+
+    Returns:
+        A JSON schema that matches the payload type.
+    '''
+    inner = [type_schema(item) for item in payload_type.items]
+    match payload_type.kind:
+        case "any":
+            return schema_any
+        case "number":
+            return schema_number
+        case "string":
+            return schema_string
+        case "null":
+            return schema_null
+        case "bool":
+            return schema_bool
+        case "array":
+            return schema_array(inner[0]) # create array schema dynamically
+        case "tuple":
+            return schema_tuple(inner, len(inner)) # create tuple schema dynamically
+        case "union":
+            return schema_union(inner) # create union schema dynamically
+        case "def":
+            return schema_def(inner[0])
+        case "record":
+            return schema_record(inner) # create record schema dynamically
+        case _:
+            raise TypeError("Error! payload is not of a recognized type")
+
+def try_validator(data: Any, validator: Callable[[Any], bool], expected: str) -> str | Exception:
+    '''
+    Checks the payload with an already built validator.
+
+    Args:
+        data: actual payload to be checked
+        validator: validator made by get_validator
+        expected: name of the expected type of payload
+
+    Returns:
+        A string if it worked and a json schema exception otherwise
+    '''
+    if validator(data):
+        return(f"Valid payload type")
+    raise jsonschema.ValidationError(f"Invalid data type! Expected type {expected} for {data}")
+
 def try_schema(data: Any, schema_to_check: JsonSchema, expected: str) -> str | Exception:
     '''
     Compares the payload against a json schema to see if it matches it's supposed type.
@@ -220,23 +462,3 @@ def try_schema(data: Any, schema_to_check: JsonSchema, expected: str) -> str | E
         raise jsonschema.ValidationError(f"Invalid data type! Expected type {expected} for {data}")
     except json.JSONDecodeError:
         raise ValueError("Invalid JSON format!")
-    
-# -- helper functions ---------------------------------------------------------------------------------
-def extract_types(payload_str:str) -> list[str]:
-    '''
-    Parses the string that describes a session of type tuple in order to extract the types of the tuple elements.
-
-    Args:
-        tuple_types (str): string of tuple session
-
-    Returns:
-        A list of JSON types as strings.
-    '''
-    # Extract types inside payload
-    type_pattern = r'\{ type:\s*"(\w+)" \}'
-    types = re.findall(type_pattern, payload_str)
-
-    # Replace "bool" with "boolean"
-    types = ["boolean" if t == "bool" else t for t in types]
-
-    return types
\ No newline at end of file
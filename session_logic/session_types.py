@@ -1,10 +1,36 @@
-from typing import Dict
-from dataclasses import dataclass # so that @dataclass(frozen=true) can be used
+import sys # to intern strings
+from typing import Callable, ClassVar, Dict
+from dataclasses import FrozenInstanceError # raised when trying to change a session
+from weakref import WeakValueDictionary # so labels only stay interned while a protocol uses them
+from collections import OrderedDict # for the least recently used protocols
 
 # -- define session components "dir" and "label" --------------------------------------------------------------------------
 class Dir:
-    def __init__(self, dir: str):
-        self.dir = dir # only send or recv
+    '''
+    Direction of a session. Dir("send") and Dir("recv") always return the shared Dir.SEND and Dir.RECV.
+    '''
+    __slots__ = ("dir",)
+    known: ClassVar[Dict[str, "Dir"]] = {}
+    SEND: ClassVar["Dir"]
+    RECV: ClassVar["Dir"]
+
+    def __new__(cls, dir: str):
+        found = cls.known.get(dir)
+        if found is None:
+            found = object.__new__(cls)
+            object.__setattr__(found, "dir", dir) # only send or recv
+            if dir in ("send", "recv"):
+                cls.known[dir] = found
+        return found
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, Dir) and self.dir == other.dir)
+
+    def __hash__(self):
+        return hash(self.dir)
 
     # to make it work with session to string parser
     def __str__(self):
@@ -13,45 +39,123 @@ class Dir:
     def __repr__(self):
         return self.dir
 
-@dataclass(frozen=True)
+Dir.SEND = Dir("send")
+Dir.RECV = Dir("recv")
+
 class Label:
-    label: str
+    '''
+    Label of an alternative in a Choice. Labels are interned: Label("Add") returns the same object as long as one exists.
+    '''
+    __slots__ = ("label", "__weakref__")
+    interned: ClassVar[WeakValueDictionary] = WeakValueDictionary()
+
+    def __new__(cls, label: str):
+        found = cls.interned.get(label)
+        if found is None:
+            found = object.__new__(cls)
+            object.__setattr__(found, "label", sys.intern(label))
+            cls.interned[label] = found
+        return found
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, Label) and self.label == other.label)
+
+    def __hash__(self):
+        return hash(self.label)
+
+    def __repr__(self):
+        return f"Label(label={self.label!r})"
 
 # -- define session and session types ---------------------------------------------------------------------------------
+# Sessions can't be changed once they are made (only the validator of Single sessions is attached later), so parsed
+# protocols can be shared between connections. Two sessions are equal if they describe the same session.
 class Session:
-    def __init__(self, kind: str):
-        self.kind = kind
+    __slots__ = ("__weakref__",) # so the compiled states of a protocol can be freed with its sessions
+    kind: ClassVar[str] = "session"
+    values: ClassVar[tuple[str, ...]] = () # fields compared by __eq__ (besides the sessions that come next)
+
+    def __setattr__(self, name, value):
+        raise FrozenInstanceError(f"cannot assign to field '{name}'")
+
+    def __delattr__(self, name):
+        raise FrozenInstanceError(f"cannot delete field '{name}'")
+
+    def __eq__(self, other):
+        if not isinstance(other, Session):
+            return NotImplemented
+        pending = [(self, other)] # compared without recursion, so sessions of any depth can be compared
+        while pending:
+            first, second = pending.pop()
+            if first is second:
+                continue
+            if type(first) is not type(second) or any(getattr(first, name) != getattr(second, name) for name in first.values):
+                return False
+            if isinstance(first, Choice):
+                if first.alternatives.keys() != second.alternatives.keys():
+                    return False
+                pending.extend((alternative, second.alternatives[label]) for label, alternative in first.alternatives.items())
+            elif isinstance(first, (Single, Def)):
+                pending.append((first.cont, second.cont))
+        return True
+
+    __hash__ = None # equality looks at the whole session
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.values)
+        return f"{type(self).__name__}({fields})"
 
-@dataclass
 class Single(Session):
+    __slots__ = ("dir", "payload", "cont", "actor", "validator", "closed")
+    __match_args__ = ("dir", "payload", "cont", "actor")
+    kind = "single"
+    values = ("dir", "payload", "actor")
+
     def __init__(self, dir: Dir, payload:str, cont: Session, actor:str=None):
-        super().__init__("single")
-        self.dir = dir
-        self.payload = payload
-        self.cont = cont
-        self.actor = actor # for multiparty sessions
+        init = object.__setattr__
+        init(self, "dir", dir)
+        init(self, "payload", sys.intern(payload)) # the same payload types are used all over the protocols
+        init(self, "cont", cont)
+        init(self, "actor", actor) # for multiparty sessions
+        init(self, "validator", None) # payload check attached when the protocol is registered
+        init(self, "closed", False) # True if shared by all protocols (see SessionTable)
+
+    def __setattr__(self, name, value):
+        if name == "validator": # the only field set after the session is made
+            object.__setattr__(self, name, value)
+        else:
+            super().__setattr__(name, value)
 
-@dataclass
 class Choice(Session):
+    __slots__ = ("dir", "alternatives", "closed")
+    __match_args__ = ("dir", "alternatives")
+    kind = "choice"
+    values = ("dir",)
+
     def __init__(self, dir: Dir, alternatives: Dict[Label, Session]):
-        super().__init__("choice")
-        self.dir = dir
-        self.alternatives = alternatives
+        init = object.__setattr__
+        init(self, "dir", dir)
+        init(self, "alternatives", alternatives)
+        init(self, "closed", False) # True if shared by all protocols (see SessionTable)
     
-    def add(self, name: Label, new_ses: Session):
+    def add(self, name: Label, new_ses: Session) -> "Choice":
         '''
-        Adds a new session to the choice session dictionary.
+        Makes a choice session with one more alternative. The choice itself isn't changed, as it may be shared
+        by other protocols (see SessionTable).
 
         Args:
             name (Label): what the session is called
             new_ses (Session): actual session to be added
         
-        Returns nothing if succesful.
+        Returns:
+            A new choice session with the alternatives of this one and the new session.
         '''
         if name in self.alternatives:
             raise ErrorInSessionDicts("defining existing session", name.label, "Choice session")
         else:
-            self.alternatives[name] = new_ses
+            return Choice(dir=self.dir, alternatives={**self.alternatives, name: new_ses})
     
     def lookup(self, name: Label) -> Session:
         '''
@@ -63,29 +167,178 @@ class Choice(Session):
         Returns:
             A session if there is one in the dictionary.
         '''
-        if not name in self.alternatives:
+        found = self.alternatives.get(name)
+        if found is None:
             raise ErrorInSessionDicts("lookup", name.label, context="Choice session")
-        else:
-            return self.alternatives[name]
+        return found
 
-@dataclass
 class Def(Session):
+    __slots__ = ("name", "cont")
+    __match_args__ = ("name", "cont")
+    kind = "def"
+    values = ("name",)
+
     def __init__(self, name: str, cont: Session):
-        super().__init__("def")
-        self.name = name
-        self.cont = cont
+        init = object.__setattr__
+        init(self, "name", sys.intern(name))
+        init(self, "cont", cont)
 
-@dataclass
 class Ref(Session):
+    __slots__ = ("name",)
+    __match_args__ = ("name",)
+    kind = "ref"
+    values = ("name",)
+
     def __init__(self, name: str):
-        super().__init__("ref")
-        self.name = name
+        object.__setattr__(self, "name", sys.intern(name))
 
-@dataclass
 class End(Session):
+    '''
+    End of a session; End() always returns the same shared session.
+    '''
+    __slots__ = ()
+    kind = "end"
+
+    def __new__(cls):
+        return end_session
+
+end_session = object.__new__(End)
+
+# --- share identical sessions ---------------------------------------------------------------------------------------
+
+class SessionTable:
+    '''
+    Hash-consing of sessions: every session made through the table is shared with the identical session made before
+    (same fields and the very same sessions after it), so identical parts of a protocol, like Single sessions sending the
+    same payload type before the same Ref, are only kept once. Sessions without any Ref in them (e.g. the Single sessions
+    of a Quit action before End) are shared by all protocols, but only as long as a protocol uses them; the others are
+    only shared within the sessions made through the same table, which is dropped afterwards.
+    Choices made through the table are shared too, so alternatives must not be added to them afterwards.
+    '''
+    closed: ClassVar[WeakValueDictionary] = WeakValueDictionary() # sessions without references, shared by every protocol
+
     def __init__(self):
-        super().__init__("end")
+        self.sessions: Dict[tuple, Session] = {} # sessions with references made through this table
+
+    def is_closed(self, session: Session) -> bool:
+        return session is end_session or getattr(session, "closed", False)
 
+    def keep(self, key: tuple, closed: bool, session: Callable[[], Session]) -> Session:
+        # keys have the ids of the sessions that come next, which live as long as the session kept
+        table = self.closed if closed else self.sessions
+        found = table.get(key)
+        if found is None:
+            found = table[key] = session()
+            if closed:
+                object.__setattr__(found, "closed", True)
+        return found
+
+    def single(self, dir: Dir, payload: str, cont: Session, actor: str = None) -> Single:
+        # the cont is shared already, so it is enough to compare which one it is
+        return self.keep(("single", dir, payload, actor, id(cont)), self.is_closed(cont),
+                         lambda: Single(dir=dir, payload=payload, cont=cont, actor=actor))
+
+    def choice(self, dir: Dir, alternatives: Dict[Label, Session]) -> Choice:
+        return self.keep(("choice", dir, tuple((label.label, id(alternative)) for label, alternative in alternatives.items())),
+                         all(self.is_closed(alternative) for alternative in alternatives.values()),
+                         lambda: Choice(dir=dir, alternatives=alternatives))
+
+    def definition(self, name: str, cont: Session) -> Def:
+        return self.keep(("def", name, id(cont)), False, lambda: Def(name=name, cont=cont))
+
+    def ref(self, name: str) -> Ref:
+        return self.keep(("ref", name), False, lambda: Ref(name=name))
+
+    def share(self, session: Session) -> Session:
+        '''
+        Returns the shared version of a session made without a table (e.g. written by hand), made without recursion.
+
+            Args:
+                session (Session): session to share
+
+            Returns:
+                Session: identical session whose parts are all shared
+        '''
+        order: list[Session] = [] # every session comes before the sessions it contains
+        pending = [session]
+        while pending:
+            current = pending.pop()
+            order.append(current)
+            if isinstance(current, (Single, Def)):
+                pending.append(current.cont)
+            elif isinstance(current, Choice):
+                pending.extend(current.alternatives.values())
+        shared: Dict[int, Session] = {}
+        for current in reversed(order):
+            if isinstance(current, Single):
+                shared[id(current)] = self.single(current.dir, current.payload, shared[id(current.cont)], current.actor)
+            elif isinstance(current, Choice):
+                alternatives = {label: shared[id(alternative)] for label, alternative in current.alternatives.items()}
+                shared[id(current)] = self.choice(current.dir, alternatives)
+            elif isinstance(current, Def):
+                shared[id(current)] = self.definition(current.name, shared[id(current.cont)])
+            elif isinstance(current, Ref):
+                shared[id(current)] = self.ref(current.name)
+            else:
+                shared[id(current)] = current # End is always shared
+        return shared[id(session)]
+
+# --- define duality -------------------------------------------------------------------------------------------------
+
+mirrored_dirs = {"send": "recv", "recv": "send"}
+mirrored_markers = {"_server": "_client", "_client": "_server"}
+
+def dual_name(name: str) -> str:
+    '''
+    Swaps the "_server"/"_client" marker at the end of a protocol name; names without one stay the same.
+    '''
+    marker = name[-7:]
+    return name[:-7] + mirrored_markers[marker] if marker in mirrored_markers else name
+
+def dual(session: Session) -> Session:
+    '''
+    Makes the session the other side carries out: Single sessions without an actor change direction and
+    the "_server"/"_client" markers of Def and Ref names are swapped. Choices keep their direction
+    (the same as parsing the session string for the other side). dual(dual(session)) gives back the same session.
+    The session is walked without recursion, so sessions of any depth can be transformed.
+
+        Args:
+            session (Session): session of one side (e.g. as parsed for the server)
+
+        Returns:
+            Session: new session for the other side, made of shared sessions (see SessionTable); the given session isn't changed
+    '''
+    # every session comes before the sessions it contains, so going backwards each one's parts are done before it
+    order: list[Session] = []
+    pending = [session]
+    while pending:
+        current = pending.pop()
+        order.append(current)
+        if isinstance(current, (Single, Def)):
+            pending.append(current.cont)
+        elif isinstance(current, Choice):
+            pending.extend(current.alternatives.values())
+
+    duals: Dict[int, Session] = {}
+    table = SessionTable()
+    for current in reversed(order):
+        if isinstance(current, Single):
+            dir_given = current.dir
+            if not current.actor: # multiparty sessions keep their direction
+                dir_given = Dir(mirrored_dirs.get(str(dir_given), str(dir_given)))
+            duals[id(current)] = table.single(dir_given, current.payload, duals[id(current.cont)], current.actor)
+        elif isinstance(current, Choice):
+            alternatives = {label: duals[id(alternative)] for label, alternative in current.alternatives.items()}
+            duals[id(current)] = table.choice(current.dir, alternatives)
+        elif isinstance(current, Def):
+            duals[id(current)] = table.definition(dual_name(current.name), duals[id(current.cont)])
+        elif isinstance(current, Ref):
+            duals[id(current)] = table.ref(dual_name(current.name))
+        elif isinstance(current, End):
+            duals[id(current)] = current
+        else:
+            raise ValueError("Unknown session type")
+    return duals[id(session)]
 
 # --- define session dictionary --------------------------------------------------------------------------------------
         
@@ -126,6 +379,101 @@ class GlobalDict:
         else:
             return self.records[name]
 
+# shared store of parsed protocols; one per proxy, every connection's GlobalDict points into it
+class ProtocolStore:
+    '''
+    Parsed protocols shared by all connections. Servers can send any protocol strings, so only the maxsize least
+    recently used protocols (and as many sets of protocols) are kept; once a protocol is dropped, its sessions and
+    compiled states are freed as soon as no connection uses them anymore.
+    '''
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize # 0 disables the store
+        self.records: OrderedDict[str, tuple[Def, Def]] = OrderedDict()
+        self.sets: OrderedDict[str, list[tuple[Def, Def]]] = OrderedDict() # whole protocol sets by digest, for the digest handshake
+        self.hits = 0 # protocol strings found, so they weren't parsed again
+        self.misses = 0
+
+    def add(self, definition: str, def_server: Def, def_client: Def):
+        '''
+        Keeps the parsed server and client versions of a protocol so other connections defining
+        the exact same protocol can reuse them instead of parsing the string again.
+        The stored sessions are shared between connections, so they must not be changed afterwards.
+
+            Args:
+                definition (str): protocol as the string the server sent
+                def_server (Def): protocol as parsed for the server
+                def_client (Def): protocol as parsed (mirrored) for the client
+
+        Returns nothing if it works.
+        '''
+        if definition in self.records:
+            raise ErrorInSessionDicts("add protcol", def_server.name, context="ProtocolStore")
+        elif self.maxsize > 0:
+            self.records[definition] = (def_server, def_client)
+            if len(self.records) > self.maxsize:
+                self.records.popitem(last=False)
+
+    def lookup(self, definition: str) -> tuple[Def, Def] | None:
+        '''
+        Returns the already parsed server and client versions of a protocol.
+
+            Args:
+                definition (str): protocol as the string the server sent
+
+            Returns:
+                The server and client Def sessions or None if the protocol was never defined before (or was dropped).
+        '''
+        found = self.records.get(definition)
+        if found is not None:
+            self.hits += 1
+            self.records.move_to_end(definition)
+        else:
+            self.misses += 1
+        return found
+
+    def add_set(self, digest: str, definitions: list[tuple[Def, Def]]):
+        '''
+        Keeps all protocols a server defined under the digest of their strings so servers announcing
+        the same digest later don't have to send them again.
+
+            Args:
+                digest (str): digest of the protocol strings, as made by protocols_digest
+                definitions (list[tuple[Def, Def]]): server and client versions of every protocol in the set
+        '''
+        if self.maxsize > 0:
+            self.sets[digest] = definitions
+            self.sets.move_to_end(digest)
+            if len(self.sets) > self.maxsize:
+                self.sets.popitem(last=False)
+
+    def lookup_set(self, digest: str) -> list[tuple[Def, Def]] | None:
+        '''
+        Returns the protocols kept under a digest.
+
+            Args:
+                digest (str): digest announced by the server
+
+            Returns:
+                The server and client versions of every protocol in the set or None if the digest is unknown.
+        '''
+        found = self.sets.get(digest)
+        if found is not None:
+            self.sets.move_to_end(digest)
+        return found
+
+    def resize(self, maxsize: int):
+        '''
+        Changes how many protocols and sets are kept, dropping the least recently used ones if there are too many.
+
+            Args:
+                maxsize (int): new size of the store; 0 disables it
+        '''
+        self.maxsize = maxsize
+        while len(self.records) > max(maxsize, 0):
+            self.records.popitem(last=False)
+        while len(self.sets) > max(maxsize, 0):
+            self.sets.popitem(last=False)
+
 # --- define errors and exceptions  --------------------------------------------------------------------------------------
 
 class SchemaValidationError(Exception):
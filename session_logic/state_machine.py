@@ -0,0 +1,247 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from typing import Dict
+from weakref import finalize # to free the states of a protocol once nothing uses it
+from session_logic.session_types import *
+
+# -- States -----------------------------------------------------------------------------------------------------------
+# The proxy doesn't walk the server and client sessions side by side for every message; each protocol is compiled once
+# into states of a table shared by all connections, and a connection only keeps the number of the state it is in.
+
+END = 0 # state 0 is always the end of the session
+SINGLE = 1 # a payload goes from one side to the other, then the session goes on with state.next
+CHOICE = 2 # the client chooses an action; state.alternatives has the next state of every label
+REF = 3 # the session goes on with another protocol of the connection (state.names)
+ERROR = 4 # the server and client sessions don't match; state.code is sent when the session gets here
+
+class State:
+    __slots__ = ("kind", "client_sends", "single", "next", "alternatives", "names", "code")
+
+    def __init__(self, kind: int, client_sends: bool = False, single: Single | None = None, next: int = END,
+                 alternatives: Dict[str, int] | None = None, names: tuple[str, str] | None = None, code: int = 0):
+        self.kind = kind
+        self.client_sends = client_sends # for SINGLE: True if the client sends the payload, False if the server does
+        self.single = single # for SINGLE: session whose validator checks the payload
+        self.next = next # for SINGLE: state that comes after it
+        self.alternatives = alternatives # for CHOICE: next state of every label
+        self.names = names # for REF: names of the server and client protocols
+        self.code = code # for ERROR: error code sent to both sides
+
+class CompiledProtocol:
+    __slots__ = ("start", "states", "references")
+
+    def __init__(self, start: int, states: list[int]):
+        self.start = start # state the protocol starts in
+        self.states = states # states made for the protocol, freed with it
+        self.references: list[tuple[str, str]] | None = None # references to other protocols, once checked
+
+class StateMachine:
+    '''
+    States of the protocols in use. Protocols are compiled once, the first time a connection uses them; the server
+    and client sessions have to stay the same afterwards (like the ones in ProtocolStore). The states of a protocol
+    are kept as long as its server and client sessions are: while the ProtocolStore keeps the protocol or a connection
+    defined it. Once neither does, its states are freed and their numbers are given to the next protocol compiled, so the
+    states only take as much memory as the protocols of the store and of the open connections.
+    '''
+    def __init__(self):
+        self.states: list[State | None] = [State(END)] # None for freed states
+        self.free: list[int] = [] # numbers of freed states
+        self.protocols: Dict[tuple[int, int, tuple[str, str] | None], CompiledProtocol] = {} # by the ids of the sessions and names
+
+    def compile(self, ses_server: Session, ses_client: Session, names: tuple[str, str] | None = None) -> int:
+        '''
+        Compiles the server and client sessions of a protocol into states, or finds the states they were compiled into before.
+        References to the protocol itself are linked to its first state, so recursive protocols become loops of states
+        and are never looked up by name; references to other protocols are resolved when the session gets to them.
+
+            Args:
+                ses_server (Session): session the server carries out (e.g. the cont of a protocol's Def)
+                ses_client (Session): mirrored session the client carries out
+                names (tuple[str, str]): names of the server and client protocols the sessions belong to, if any
+
+            Returns:
+                int: the state the sessions start in
+        '''
+        if isinstance(ses_server, End) or isinstance(ses_client, End):
+            return END
+        key = self.key_for(ses_server, ses_client, names)
+        compiled = self.protocols.get(key)
+        if compiled is not None:
+            return compiled.start
+        pending: list[tuple[int, Session, Session]] = [] # states made but not filled in yet
+        made: Dict[tuple[int, int], int] = {} # state of every pair of sessions compiled (all part of the two sessions)
+        start: int | None = None
+
+        def state_for(server: Session, client: Session) -> int:
+            if isinstance(server, End) or isinstance(client, End): # the session ends once either side is done
+                return END
+            if start is not None and isinstance(server, Ref) and isinstance(client, Ref) and (server.name, client.name) == names:
+                return start # back to the start of the protocol
+            found = made.get((id(server), id(client)))
+            if found is not None:
+                return found
+            if self.free:
+                state = self.free.pop()
+                self.states[state] = State(ERROR) # filled in below
+            else:
+                state = len(self.states)
+                self.states.append(State(ERROR))
+            made[(id(server), id(client))] = state
+            pending.append((state, server, client))
+            return state
+
+        start = state_for(ses_server, ses_client)
+        while pending:
+            state, server, client = pending.pop()
+            match (server, client):
+                case (Single(), Single()):
+                    match (server.dir.dir, client.dir.dir):
+                        case ("recv", "send"): # client sends payload to server
+                            self.states[state] = State(SINGLE, client_sends=True, single=client, next=state_for(server.cont, client.cont))
+                        case ("send", "recv"): # server sends payload to client
+                            self.states[state] = State(SINGLE, client_sends=False, single=server, next=state_for(server.cont, client.cont))
+                        case _:
+                            self.states[state] = State(ERROR, code=321) # dir error
+                case (Choice(), Choice()):
+                    alternatives = {label.label: state_for(alternative, client.alternatives[label])
+                                    for label, alternative in server.alternatives.items() if label in client.alternatives}
+                    self.states[state] = State(CHOICE, alternatives=alternatives)
+                case (Ref(), Ref()):
+                    self.states[state] = State(REF, names=(server.name, client.name))
+                case _:
+                    self.states[state] = State(ERROR, code=312)
+        self.protocols[key] = CompiledProtocol(start, list(made.values()))
+        # freed once either session is gone (both are kept for as long as the protocol is used), so no id in the
+        # key can be given to another session while the key is used; nothing here keeps the sessions themselves
+        finalize(ses_server, self.release, key)
+        if ses_client is not ses_server: # e.g. both are the same shared Choice of a protocol without Single sessions
+            finalize(ses_client, self.release, key)
+        return start
+
+    def key_for(self, ses_server: Session, ses_client: Session, names: tuple[str, str] | None) -> tuple[int, int, tuple[str, str] | None]:
+        '''
+        Returns the key of a protocol in self.protocols. Sessions without references (see SessionTable) are shared by
+        all protocols and compiled the same way whatever the protocol is called, so their names aren't part of the key.
+        '''
+        if getattr(ses_server, "closed", False) and getattr(ses_client, "closed", False):
+            names = None
+        return (id(ses_server), id(ses_client), names)
+
+    def release(self, key: tuple[int, int, tuple[str, str] | None]):
+        '''
+        Frees the states of a protocol once its server or client session is gone.
+
+            Args:
+                key (tuple): ids of the server and client sessions and names the protocol was compiled with
+        '''
+        compiled = self.protocols.pop(key, None)
+        if compiled is not None:
+            for state in compiled.states:
+                self.states[state] = None
+            self.free.extend(compiled.states)
+
+    def resolve(self, protocol_info: GlobalDict, name_server: str, name_client: str) -> int | None:
+        '''
+        Finds the state a protocol of a connection starts in.
+
+            Args:
+                protocol_info (GlobalDict): protocols defined by the server for the connection
+                name_server (str): name of the server's protocol (e.g. A_server)
+                name_client (str): name of the client's protocol (e.g. A_client)
+
+            Returns:
+                The state or None if the connection has no such protocols.
+        '''
+        try:
+            return self.compile(protocol_info.lookup(name_server), protocol_info.lookup(name_client), (name_server, name_client))
+        except ErrorInSessionDicts:
+            return None
+
+    def check(self, protocol_info: GlobalDict, name_server: str, name_client: str) -> int:
+        '''
+        Checks a protocol of a connection once all its protocols are defined, so problems are found before any client
+        uses it: the server and client sessions have to match (no ERROR state can be reached), every protocol it
+        references has to be defined for the connection and recursion has to go through an action, otherwise the
+        protocol would reference itself forever. The states reached are the same for every connection, so they are
+        only walked the first time (while the protocol is kept); only the references are looked up again.
+
+            Args:
+                protocol_info (GlobalDict): protocols defined by the server for the connection
+                name_server (str): name of the server's protocol (e.g. A_server)
+                name_client (str): name of the client's protocol (e.g. A_client)
+
+            Returns:
+                int: the state the protocol starts in
+
+            Raises a ProtocolError with the code a client would have gotten if the protocol is not sound.
+        '''
+        try:
+            ses_server, ses_client = protocol_info.lookup(name_server), protocol_info.lookup(name_client)
+        except ErrorInSessionDicts:
+            raise ProtocolError(350, f"protocol {name_server} is not defined")
+        start = self.compile(ses_server, ses_client, (name_server, name_client))
+        compiled = self.protocols.get(self.key_for(ses_server, ses_client, (name_server, name_client)))
+        if compiled is None: # the protocol is only End
+            return start
+        if compiled.references is None:
+            compiled.references = self.find_references(start, name_server)
+        references = compiled.references
+        for names in references:
+            seen = {start}
+            target = self.resolve(protocol_info, *names)
+            while target is not None and self.states[target].kind == REF: # protocol only references another one
+                if target in seen:
+                    raise ProtocolError(312, f"protocol {name_server} references itself without any action in between")
+                seen.add(target)
+                names = self.states[target].names
+                target = self.resolve(protocol_info, *names)
+            if target is None:
+                raise ProtocolError(350, f"protocol {names[0]} referenced by {name_server} is not defined")
+        return start
+
+    def find_references(self, start: int, name_server: str) -> list[tuple[str, str]]:
+        '''
+        Walks the states reached from a state up to the references to other protocols.
+
+            Args:
+                start (int): state to start from
+                name_server (str): name of the server's protocol, for the error message
+
+            Returns:
+                list[tuple[str, str]]: names of the server and client protocols referenced
+
+            Raises a ProtocolError if an ERROR state is reached.
+        '''
+        references: list[tuple[str, str]] = []
+        seen = {start}
+        pending = [start]
+        while pending:
+            state = self.states[pending.pop()]
+            if state.kind == SINGLE:
+                following = [state.next]
+            elif state.kind == CHOICE:
+                following = state.alternatives.values()
+            elif state.kind == REF:
+                references.append(state.names)
+                continue
+            elif state.kind == ERROR:
+                reason = "directions" if state.code == 321 else "sessions"
+                raise ProtocolError(state.code, f"the server and client {reason} of protocol {name_server} don't match")
+            else:
+                continue
+            for next_state in following:
+                if next_state not in seen:
+                    seen.add(next_state)
+                    pending.append(next_state)
+        return references
+
+# -- Define exceptions -------------------------------------------------------------------------------------------------
+class ProtocolError(Exception):
+    """Exception raised when a protocol defined by a server is not sound."""
+    def __init__(self, code: int, message: str = "Protocol error"):
+        self.code = code # error code the session would have ended with at runtime
+        self.message = message
+        super().__init__(self.message)
@@ -0,0 +1,33 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import timeit # to time encoding and decoding
+from session_logic import codec
+
+# payloads like the ones sent through the proxy
+payloads = {
+    "numbers": list(range(10000)), # array of 10k numbers
+    "records": [{"name": f"user{i}", "age": i, "admin": i % 2 == 0, "tags": ["a", "b"], "address": {"city": "Vienna", "zip": 1010}}
+                for i in range(1000)], # nested records
+    "small": ["502: Operation succesful.", 42], # typical acknowledged payload
+}
+
+def run_benchmark(name: str, payload: object, number: int = 200):
+    '''
+    Times encoding and decoding a payload with every JSON backend that is installed.
+    '''
+    for backend in codec.backends:
+        codec.use_backend(backend)
+        message = codec.dumps(payload)
+        encode = timeit.timeit(lambda: codec.dumps(payload), number=number) / number
+        decode = timeit.timeit(lambda: codec.loads(message), number=number) / number
+        print(f"{name:<8} {backend:<7} dumps: {encode * 1e6:9.1f} us   loads: {decode * 1e6:9.1f} us   ({len(message)} bytes)")
+
+
+if __name__ == "__main__":
+    default = codec.backend
+    for name, payload in payloads.items():
+        run_benchmark(name, payload, number=200 if name != "small" else 20000)
+    codec.use_backend(default)
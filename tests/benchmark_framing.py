@@ -0,0 +1,42 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import timeit # to time encoding and decoding
+from session_logic import codec
+from session_logic.framing import Framing
+from session_logic.parsers import decode_command
+
+# small messages like the ones exchanged for every action
+messages = {
+    "ack": "502: Operation succesful.",
+    "result": ["502: Operation succesful.", 42],
+    "action": ["Add", [1, 2]],
+}
+
+def run_benchmark(name: str, message: object, number: int = 50000):
+    '''
+    Compares the size of a message and the time to decode it as JSON text and as a binary frame.
+    '''
+    sender, receiver = Framing(commands=True), Framing()
+    text = codec.dumps(message)
+    frame = sender.encode(message)
+    receiver.decode(frame) # so the action already has an id
+    frame = sender.encode(message)
+    # decoded the way the proxy does it
+    decode_text = decode_command if name == "action" else codec.loads
+    decode = receiver.decode_command if name == "action" else receiver.decode
+    text_time = min(timeit.repeat(lambda: decode_text(text), number=number, repeat=5)) / number # best of 5 runs
+    frame_time = min(timeit.repeat(lambda: decode(frame), number=number, repeat=5)) / number
+    print(f"{name:<7} text: {len(text):3} bytes {text_time * 1e9:6.0f} ns   binary: {len(frame):3} bytes {frame_time * 1e9:6.0f} ns")
+
+
+if __name__ == "__main__":
+    default = codec.backend
+    for backend in codec.backends:
+        print(f"JSON backend: {backend}")
+        codec.use_backend(backend)
+        for name, message in messages.items():
+            run_benchmark(name, message)
+    codec.use_backend(default)
@@ -0,0 +1,28 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import json
+import timeit # to time the payload checks
+from session_logic.schema_validation import checkPayload, try_schema, payload_schema, get_validator
+
+def run_benchmark(name:str, payload:str, payload_type:str, number:int=2000):
+    '''
+    Times checking a payload with a schema that is built and checked every time (try_schema) against
+    checkPayload, which reuses the compiled python check for the payload type.
+    '''
+    data = json.loads(payload)
+    rebuilt = timeit.timeit(lambda: try_schema(data, payload_schema(payload_type), payload_type), number=number) / number
+    cached = timeit.timeit(lambda: checkPayload(payload, payload_type, payload_type), number=number) / number
+    print(f"{name:<8} rebuilt schema: {rebuilt * 1e6:8.1f} us   compiled check: {cached * 1e6:8.1f} us   ({rebuilt / cached:.1f}x)")
+
+
+if __name__ == "__main__":
+    run_benchmark("number", json.dumps(42), '{ type: "number" }')
+    run_benchmark("string", json.dumps("hello"), '{ type: "string" }')
+    run_benchmark("array", json.dumps(list(range(100))), '{ type: "array", payload: { type: "number" } }')
+    run_benchmark("tuple", json.dumps([1, 2, "and", False]),
+                  '{ type: "tuple", payload: [{ type: "number" }, { type: "number" }, { type: "string" }, { type: "bool" }] }')
+    run_benchmark("union", json.dumps([1, "a", True] * 10), '{ type: "union", payload: [{ type: "number" }, { type: "bool" }, { type: "string" }] }')
+    print(get_validator.cache_info())
@@ -0,0 +1,61 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import timeit # to time dispatching on session types
+import tracemalloc # to measure the memory the sessions take
+from session_logic.session_types import *
+from session_logic.parsers import message_into_session
+
+# a protocol like the ones servers define, with a Choice of several actions; the same fragments (like the
+# Status and Quit actions) are repeated in every protocol, as in the multiparty flight example
+protocol = (
+    'Session: Def, Name: P{i}, Cont: Session: Choice, Dir: send, Alternatives: ['
+    '(Label: Add, Session: Single, Dir: recv, Payload: { type: "tuple", payload: [{ type: "number" }, { type: "number" }] }, Cont: '
+    'Session: Single, Dir: send, Payload: { type: "number" }, Cont: Session: Ref, Name: P{i}), '
+    '(Label: Neg, Session: Single, Dir: recv, Payload: { type: "number" }, Cont: '
+    'Session: Single, Dir: send, Payload: { type: "number" }, Cont: Session: Ref, Name: P{i}), '
+    '(Label: Greeting, Session: Single, Dir: recv, Payload: { type: "string" }, Cont: '
+    'Session: Single, Dir: send, Payload: { type: "string" }, Cont: Session: Ref, Name: P{i}), '
+    '(Label: Status, Session: Single, Dir: send, Payload: { type: "bool" }, Cont: Session: End), '
+    '(Label: Quit, Session: Single, Dir: send, Payload: { type: "string" }, Cont: Session: End)]'
+)
+
+def measure_registry(count: int) -> list[Session]:
+    '''
+    Prints how much memory a registry of parsed protocols takes (payload strings are shared, like in the proxy).
+    '''
+    strings = [protocol.replace("{i}", str(i)) for i in range(count)]
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    registry = [message_into_session(string, "server") for string in strings]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    print(f"{count} protocols: {size / 1024:9.1f} KiB   ({size / count:7.1f} bytes per protocol)")
+    return registry
+
+def time_dispatch(registry: list[Session], number: int = 20):
+    '''
+    Times walking every session of the registry and matching on its type, like the proxy does for every message.
+    '''
+    def walk():
+        for definition in registry:
+            pending = [definition]
+            while pending:
+                match pending.pop():
+                    case Def(cont=cont) | Single(cont=cont):
+                        pending.append(cont)
+                    case Choice(alternatives=alternatives):
+                        pending.extend(alternatives.values())
+                    case Ref() | End():
+                        pass
+    seconds = timeit.timeit(walk, number=number) / number
+    print(f"walking {len(registry)} protocols: {seconds * 1e3:7.2f} ms")
+
+
+if __name__ == "__main__":
+    for count in (100, 500, 10000):
+        registry = measure_registry(count)
+    time_dispatch(registry)
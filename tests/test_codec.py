@@ -0,0 +1,42 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import json
+
+import pytest # for tests
+from session_logic import codec
+
+# -- Run every test with every backend that is installed -------------------------------------------------------------
+
+@pytest.fixture(params=list(codec.backends))
+def backend(request):
+    default = codec.backend
+    codec.use_backend(request.param)
+    yield request.param
+    codec.use_backend(default)
+
+# ---------------------- Valid tests -----------------------------------------------------------------------------------------------------------
+
+def test_round_trip(backend):
+    message = ["502: Operation succesful.", {"name": "Alice", "scores": [1, 2.5, None, True]}]
+    assert json.loads(codec.dumps(message)) == message
+    assert codec.loads(json.dumps(message)) == message
+
+def test_dumps_returns_text(backend):
+    assert isinstance(codec.dumps("Session: End"), str)
+
+def test_values_only_the_standard_library_handles(backend):
+    assert json.loads(codec.dumps(2 ** 70 + 1)) == 2 ** 70 + 1 # bigger than 64 bits
+    assert codec.loads("NaN") != codec.loads("NaN") # NaN isn't equal to itself
+
+# ---------------------- Failing tests ----------------------
+
+def test_invalid_json(backend):
+    with pytest.raises(json.JSONDecodeError):
+        codec.loads('["Add", [1, 2]')
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        codec.use_backend("simplejson")
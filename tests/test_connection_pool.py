@@ -0,0 +1,86 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import json
+import asyncio
+
+import pytest # for tests
+import websockets
+
+from session_logic.connection_pool import ConnectionPool, PoolError
+from session_logic.helpers import acknowledge_reset
+
+# -- Define a server that only answers resets -----------------------------------------------------------------------
+
+async def reset_server(websocket):
+    async for message in websocket:
+        if json.loads(message) == "505: Session reset.":
+            await acknowledge_reset(websocket)
+
+async def with_pool(test, **pool_settings):
+    '''Runs a test coroutine with a pool connected to a local server.'''
+    async with websockets.serve(reset_server, "localhost", 0) as server:
+        port = list(server.sockets)[0].getsockname()[1]
+        pool = ConnectionPool(f"ws://localhost:{port}", **pool_settings)
+        await pool.start()
+        try:
+            await test(pool)
+        finally:
+            await pool.close()
+
+# ---------------------- Valid tests -----------------------------------------------------------------------------------------------------------
+
+def test_pool_starts_with_min_size():
+    async def test(pool):
+        assert pool.metrics()["idle"] == 2
+        assert pool.metrics()["created"] == 2
+    asyncio.run(with_pool(test, min_size=2, max_size=4))
+
+def test_pool_reuses_released_connection():
+    async def test(pool):
+        first = await pool.acquire()
+        await pool.release(first)
+        second = await pool.acquire()
+        assert first is second
+        assert pool.metrics()["reused"] == 2
+        await pool.release(second)
+    asyncio.run(with_pool(test, min_size=1, max_size=1))
+
+def test_pool_discards_closed_connection():
+    async def test(pool):
+        server_ws = await pool.acquire()
+        await server_ws.close()
+        await pool.release(server_ws)
+        assert pool.metrics()["discarded"] == 1
+        assert pool.metrics()["size"] == 0
+    asyncio.run(with_pool(test, min_size=0, max_size=1))
+
+def test_pool_waits_when_full():
+    async def test(pool):
+        server_ws = await pool.acquire()
+        waiting = asyncio.create_task(pool.acquire())
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        await pool.release(server_ws)
+        assert await asyncio.wait_for(waiting, timeout=5) is server_ws
+        assert pool.metrics()["waited"] == 1
+        await pool.release(server_ws)
+    asyncio.run(with_pool(test, min_size=0, max_size=1))
+
+def test_pool_evicts_idle_connections():
+    async def test(pool):
+        connections = [await pool.acquire() for _ in range(3)]
+        for server_ws in connections:
+            await pool.release(server_ws)
+        await asyncio.sleep(0.5)
+        assert pool.metrics()["size"] == 1
+        assert pool.metrics()["evicted"] == 2
+    asyncio.run(with_pool(test, min_size=1, max_size=3, max_idle=0.1))
+
+# ---------------------- Failing tests ----------------------
+
+def test_pool_min_bigger_than_max():
+    with pytest.raises(PoolError):
+        ConnectionPool("ws://localhost:1", min_size=2, max_size=1)
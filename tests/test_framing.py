@@ -0,0 +1,54 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import pytest # for tests
+from session_logic.framing import Framing, FramingError, FRAME_OK
+from session_logic import codec
+
+# -- Run tests that look at encoded payloads with every backend that is installed ----------------------------------------
+
+@pytest.fixture(params=list(codec.backends))
+def backend(request):
+    default = codec.backend
+    codec.use_backend(request.param)
+    yield request.param
+    codec.use_backend(default)
+
+# ---------------------- Valid tests -----------------------------------------------------------------------------------------------------------
+
+def test_success_code_is_one_byte():
+    assert Framing().encode("502: Operation succesful.") == bytes((FRAME_OK,))
+    assert Framing().decode(bytes((FRAME_OK,))) == "502: Operation succesful."
+
+def test_messages_round_trip():
+    sender, receiver = Framing(), Framing()
+    for message in ["Protocol: A", ["502: Operation succesful.", [1, "a", None]], "330: This action is not defined in the protocol.",
+                    {"batch": ["Quit"]}, ["a", 1]]:
+        assert receiver.decode(sender.encode(message)) == message
+
+def test_actions_get_ids(backend):
+    client, proxy = Framing(commands=True), Framing()
+    first = client.encode(["Add", [1, 2]])
+    second = client.encode(["Add", [3, 4]])
+    assert len(second) < len(first) # label only sent the first time
+    command, payload_json = proxy.decode_command(first)
+    assert command == ["Add", [1, 2]] and codec.loads(payload_json) == [1, 2] # spacing depends on the backend
+    command, payload_json = proxy.decode_command(second)
+    assert command == ["Add", [3, 4]] and codec.loads(payload_json) == [3, 4]
+    assert proxy.decode_command(client.encode("Quit")) == ("Quit", None) # actions without payload are plain messages
+
+def test_forwarded_payload():
+    proxy, client = Framing(), Framing(commands=True)
+    assert client.decode(proxy.encode_payload('{"a": [1, 2]}')) == ["502: Operation succesful.", {"a": [1, 2]}]
+
+# ---------------------- Failing tests ----------------------
+
+def test_unknown_action_id():
+    with pytest.raises(FramingError):
+        Framing().decode(Framing(commands=True).encode(["Add", [1, 2]])[:1] + bytes((7,)))
+
+def test_unknown_frame_kind():
+    with pytest.raises(FramingError):
+        Framing().decode(bytes((42,)))
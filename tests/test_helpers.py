@@ -0,0 +1,16 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+from session_logic.helpers import *
+
+# -- Acknowledgement window tests -----------------------------------------------------------------------------------
+
+def test_window_of_one_acknowledges_every_message():
+    window = AckWindow()
+    assert all(window.count() for _ in range(5))
+
+def test_window_acknowledges_once_per_window():
+    window = AckWindow(3)
+    assert [window.count() for _ in range(7)] == [False, False, True, False, False, True, False]
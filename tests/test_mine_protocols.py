@@ -0,0 +1,65 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import io
+import json
+import pytest
+from mine_protocols import *
+from session_logic.parsers import message_into_session
+
+# recorded actions of clients carrying out protocol A of example_server.py
+recorded = [
+    {"protocol": "A", "action": "Greeting", "messages": [["client", "Alice"], ["server", "Hello Alice"]]},
+    {"protocol": "A", "action": "Add", "messages": [["client", [1, 2]], ["server", 3]]},
+    {"protocol": "A", "action": "Neg", "messages": [["client", 5], ["server", -5]]},
+    {"protocol": "A", "action": "Goodbye", "messages": [["server", "May we meet again"]]},
+    {"protocol": "A", "action": "Quit", "messages": [], "end": True},
+]
+
+def make_log(actions: list[dict], times: int = 1) -> io.StringIO:
+    return io.StringIO("".join(json.dumps(action) + "\n" for action in actions * times))
+
+def test_mine_protocol():
+    shapes, skipped = mine_logs([make_log(recorded, 3)], workers=0, chunk_size=4)
+    protocols, warnings = shapes_into_protocols(shapes)
+    assert skipped == 0 and warnings == []
+    assert len(protocols) == 1
+    expected = message_into_session(
+        'Session: Def, Name: A, Cont: Session: Choice, Dir: send, Alternatives: ['
+        '(Label: Greeting, Session: Single, Dir: recv, Payload: { type: "string" }, Cont: '
+        'Session: Single, Dir: send, Payload: { type: "string" }, Cont: Session: Ref, Name: A), '
+        '(Label: Add, Session: Single, Dir: recv, Payload: { type: "array", payload: { type: "number" } }, Cont: '
+        'Session: Single, Dir: send, Payload: { type: "number" }, Cont: Session: Ref, Name: A), '
+        '(Label: Neg, Session: Single, Dir: recv, Payload: { type: "number" }, Cont: '
+        'Session: Single, Dir: send, Payload: { type: "number" }, Cont: Session: Ref, Name: A), '
+        '(Label: Goodbye, Session: Single, Dir: send, Payload: { type: "string" }, Cont: Session: Ref, Name: A), '
+        '(Label: Quit, Session: End)]'
+    )
+    assert protocols[0] == expected
+    assert message_into_session(session_into_message(protocols[0])) == expected
+
+def test_mine_most_common_shape():
+    actions = recorded + [{"protocol": "A", "action": "Neg", "messages": [["client", "5"], ["server", -5]]}]
+    shapes, _ = mine_logs([make_log(actions)], workers=0)
+    protocols, warnings = shapes_into_protocols(shapes)
+    assert len(warnings) == 1 and "Neg" in warnings[0]
+    neg = protocols[0].cont.alternatives[Label("Neg")]
+    assert neg.payload == '{ type: "number" }' # seen first and as often as the string
+
+def test_mine_skips_wrong_lines():
+    wrong = [{"protocol": "A"}, {"protocol": 1, "action": "Add", "messages": []}, ["A", "Add"],
+             {"protocol": "A", "action": "Add", "messages": [["proxy", 1]]}, {"protocol": "A", "action": "Add", "messages": [1]}]
+    log = io.StringIO('not json\n\n' + "".join(json.dumps(line) + "\n" for line in wrong) + json.dumps(recorded[0]) + "\n")
+    shapes, skipped = mine_logs([log], workers=0)
+    assert skipped == 6
+    assert list(shapes) == [("A", "Greeting")]
+
+def test_mine_with_workers():
+    logs = [make_log(recorded, 50), make_log([{"protocol": "B", "action": "List", "messages": [["server", [1, 2]]]}], 50)]
+    shapes, skipped = mine_logs(logs, workers=2, chunk_size=7)
+    assert skipped == 0
+    assert shapes[("A", "Add")][((("client", '{ type: "array", payload: { type: "number" } }'), ("server", '{ type: "number" }')), False)] == 50
+    protocols, _ = shapes_into_protocols(shapes)
+    assert [protocol.name for protocol in protocols] == ["A", "B"]
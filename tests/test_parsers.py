@@ -3,6 +3,7 @@ import sys
 from pathlib import Path
 sys.path.append(str(Path(__file__).resolve().parent.parent))
 
+import gc
 import pytest
 from session_logic.parsers import * 
 from session_logic.session_types import *
@@ -147,6 +148,45 @@ def test_session_into_message_protocol_b():
     as_string = session_into_message(protocol_b_session)
     assert as_string == protocol_b_str
 
+def test_message_into_session_nested_choice():
+    parsed = message_into_session(
+        'Session: Choice, Dir: send, Alternatives: [(Label: Outer, Session: Choice, Dir: recv, Alternatives: '
+        '[(Label: Inner, Session: End), (Label: Other, Session: Ref, Name: A)]), (Label: Quit, Session: End)]', "server")
+    assert list(parsed.alternatives) == [Label("Outer"), Label("Quit")]
+    inner = parsed.alternatives[Label("Outer")]
+    assert isinstance(inner, Choice) and inner.dir.dir == "recv"
+    assert list(inner.alternatives) == [Label("Inner"), Label("Other")]
+    assert inner.alternatives[Label("Other")].name == "A_server"
+
+def test_message_into_session_long_protocol():
+    # long protocols are parsed without running into the recursion limit
+    single = 'Session: Single, Dir: send, Payload: { type: "number" }, Cont: '
+    parsed = message_into_session(single * 5000 + 'Session: End')
+    for _ in range(5000):
+        assert isinstance(parsed, Single)
+        parsed = parsed.cont
+    assert isinstance(parsed, End)
+
+def test_session_into_message_nested_choice():
+    nested_str = (
+        'Session: Choice, Dir: send, Alternatives: [(Label: Outer, Session: Choice, Dir: recv, Alternatives: '
+        '[(Label: Inner, Session: End), (Label: Other, Session: Ref, Name: A)]), (Label: Quit, Session: End)]'
+    )
+    assert session_into_message(message_into_session(nested_str)) == nested_str
+
+def test_session_into_message_long_protocol():
+    long_str = 'Session: Single, Dir: send, Actor: Alice, Payload: { type: "number" }, Cont: ' * 5000 + 'Session: End'
+    assert session_into_message(message_into_session(long_str)) == long_str
+
+@pytest.mark.parametrize("protocol", [protocol_a_str, protocol_b_str, (
+    'Session: Def, Name: C, Cont: Session: Single, Dir: send, Actor: Plane, Payload: { type: "string" }, Cont: '
+    'Session: Choice, Dir: recv, Alternatives: [(Label: Land, Session: Single, Dir: recv, Payload: { type: "number" }, Cont: '
+    'Session: Ref, Name: C), (Label: Leave, Session: End)]'
+)])
+def test_dual_same_as_client_parse(protocol):
+    client = dual(message_into_session(protocol, "server"))
+    assert session_into_message(client) == session_into_message(message_into_session(protocol, "client"))
+
 # -- Failing protocol parsing tests -----------------------------------------------------------------------------------
 
 def test_invalid_prefix():
@@ -173,6 +213,14 @@ def test_missing_session_prefix():
     with pytest.raises(SessionError, match="Error parsing session"):
         message_into_session('Choice, Dir: send, Alternatives: []')  # Missing "Session: " prefix
 
+def test_trailing_text():
+    with pytest.raises(SessionError, match="Error parsing message into session: wrong syntax"):
+        message_into_session('Session: End, Session: End')
+
+def test_error_position():
+    with pytest.raises(SessionError, match="at position 21"):
+        message_into_session('Session: Ref, Name: A), Session: End')
+
 # -- Valid payload parsing/creation tests -----------------------------------------------------------------------------------
 
 # take json object and convert it to payload string
@@ -200,6 +248,28 @@ def test_json_def():
 def test_json_record():
     assert json_payload_to_string(example_record) == '{ type: "record", payload: [{ type: "number" }, { type: "string" }, { type: "bool" }] }'
 
+def test_json_array_merges_element_types():
+    assert json_payload_to_string('[1, 2.5]') == '{ type: "array", payload: { type: "number" } }'
+    assert json_payload_to_string('[[1, 2], [3]]') == '{ type: "array", payload: { type: "array", payload: { type: "number" } } }'
+    assert json_payload_to_string('[[1], ["a"]]') == ('{ type: "tuple", payload: [{ type: "array", payload: { type: "number" } }, '
+                                                       '{ type: "array", payload: { type: "string" } }] }')
+
+def test_json_empty_list():
+    assert json_payload_to_string('[]') == '{ type: "tuple", payload: [] }'
+
+def test_json_sampled_lists():
+    assert json_payload_to_string(json.dumps(list(range(10000))), sample=10) == '{ type: "array", payload: { type: "number" } }'
+    mixed = json.dumps([1, "a"] * 5000)
+    assert json_payload_to_string(mixed, sample=10) == '{ type: "union", payload: [{ type: "number" }, { type: "string" }] }'
+    assert json_payload_to_string('[1, "a"]', sample=10) == '{ type: "tuple", payload: [{ type: "number" }, { type: "string" }] }'
+
+def test_infer_deeply_nested_payload():
+    value = 1
+    for _ in range(5000):
+        value = {"x": value}
+    inferred = infer_payload_type(value)
+    assert inferred.count('type: "def"') == 5000 and inferred.endswith(' }' * 5000)
+
 # define your payload
 def test_payload_str():
     assert payload_to_string('string') == '{ type: "string" }'
@@ -245,4 +315,52 @@ def test_types_not_as_list():
 
 def test_types_not_as_str():
     with pytest.raises(ParsingError, match="Def payload has to be given as a string"):
-        payload_to_string('def', ['number'])
\ No newline at end of file
+        payload_to_string('def', ['number'])
+
+# -- Protocol digest tests -----------------------------------------------------------------------------------
+
+def test_protocols_digest_same_protocols():
+    assert protocols_digest([protocol_a_str, protocol_b_str]) == protocols_digest([protocol_a_str, protocol_b_str])
+
+def test_protocols_digest_different_protocols():
+    assert protocols_digest([protocol_a_str, protocol_b_str]) != protocols_digest([protocol_a_str])
+    assert protocols_digest([protocol_a_str, protocol_b_str]) != protocols_digest([protocol_b_str, protocol_a_str])
+
+# -- Forwarding payloads tests -----------------------------------------------------------------------------------
+
+def test_decode_command_keeps_payload_text():
+    command, payload_json = decode_command('[ "Add" , [1,  2] ]')
+    assert command == ["Add", [1, 2]]
+    assert payload_json == "[1,  2]"
+    assert json.loads(wrap_payload(payload_json)) == ["502: Operation succesful.", [1, 2]]
+
+def test_decode_command_without_payload():
+    assert decode_command('"Quit"') == ("Quit", None)
+    assert decode_command('{"batch": ["Quit"]}') == ({"batch": ["Quit"]}, None)
+
+def test_decode_command_invalid_json():
+    with pytest.raises(json.JSONDecodeError):
+        decode_command('["Add", [1, 2]] extra')
+    with pytest.raises(json.JSONDecodeError):
+        decode_command('["Add" [1, 2]]')
+
+# -- Parse cache tests -----------------------------------------------------------------------------------
+
+def test_identical_parts_shared():
+    session = message_into_session(protocol_a_str, "server")
+    add = session.cont.alternatives[Label("Add")]
+    neg = session.cont.alternatives[Label("Neg")]
+    assert add.cont is neg # both receive a number, send one back and start again
+    assert session == message_into_session(protocol_a_str, "server")
+
+def test_shared_parts_freed_with_protocol():
+    store = ProtocolStore(maxsize=1)
+    size = len(SessionTable.closed)
+    payload = '{ type: "tuple", payload: [{ type: "bool" }, { type: "null" }, { type: "string" }] }' # not used by other tests
+    server = message_into_session(f'Session: Def, Name: Freed, Cont: Session: Single, Dir: send, Payload: {payload}, Cont: Session: End', "server")
+    store.add("Freed", server, dual(server))
+    del server
+    assert len(SessionTable.closed) == size + 2 # the server and client sessions send in different directions
+    store.add("Other", Def(name="Other_server", cont=End()), Def(name="Other_client", cont=End())) # drops the protocol
+    gc.collect()
+    assert len(SessionTable.closed) == size
@@ -7,7 +7,11 @@ import json
 
 import pytest # for tests
 
-from session_logic.schema_validation import checkPayload
+import jsonschema
+from session_logic.schema_validation import checkPayload, get_validator, payload_schema, parse_payload_type, PayloadType
+from session_logic.schema_validation import attach_validators, checkSinglePayload
+from session_logic.session_types import *
+from session_logic.parsers import message_into_session, session_into_message
 
 # -- Define JSON test data ----------------------------------------------------------------------------------------------------------------------
 
@@ -82,4 +86,99 @@ def test_invalid_union():
     with pytest.raises(Exception):
         checkPayload(example_tuple,
             '{ type: "union", payload: [{ type: "number" }, { type: "string" }] }',
-            '{ type: "union", payload: [{ type: "number" }, { type: "string" }] }')
\ No newline at end of file
+            '{ type: "union", payload: [{ type: "number" }, { type: "string" }] }')
+
+def test_invalid_def_two_fields():
+    with pytest.raises(Exception):
+        checkPayload(json.dumps({"name": 7, "other": 8}),
+            '{ type: "def", name: { type: "string" }, payload: { type: "number" } }',
+            '{ type: "def", name: { type: "string" }, payload: { type: "number" } }')
+
+def test_invalid_record_field_type():
+    with pytest.raises(Exception):
+        checkPayload(json.dumps({"age": "25", "name": "Alice", "isAdmin": True}),
+            '{ type: "record", payload: [{ type: "number" }, { type: "string" }, { type: "bool" }] }',
+            '{ type: "record", payload: [{ type: "number" }, { type: "string" }, { type: "bool" }] }')
+
+# ---------------------- Validator cache ----------------------
+
+def test_validator_is_reused():
+    payload_type = '{ type: "tuple", payload: [{ type: "number" }, { type: "string" }] }'
+    assert get_validator(payload_type) is get_validator(payload_type)
+
+def test_def_validator_works_for_any_name():
+    payload_type = '{ type: "def", name: { type: "string" }, payload: { type: "number" } }'
+    assert checkPayload(json.dumps({"first": 1}), payload_type, payload_type) == "Valid payload type"
+    assert checkPayload(json.dumps({"second": 2}), payload_type, payload_type) == "Valid payload type"
+
+# ---------------------- Compiled checks ----------------------
+
+def test_compiled_checks_match_jsonschema():
+    # records are left out because JSON schema can't check their fields by order
+    payload_types = ['{ type: "any" }', '{ type: "number" }', '{ type: "string" }', '{ type: "bool" }', '{ type: "null" }',
+                     '{ type: "array", payload: { type: "number" } }',
+                     '{ type: "tuple", payload: [{ type: "number" }, { type: "string" }, { type: "bool" }] }',
+                     '{ type: "union", payload: [{ type: "number" }, { type: "string" }] }',
+                     '{ type: "def", name: { type: "string" }, payload: { type: "number" } }',
+                     '{ type: "array", payload: { type: "tuple", payload: [{ type: "number" }, { type: "any" }] } }']
+    values = [0, 2.5, True, None, "a", [], [1, 2], [1, "a", False], ["a", 1], [[1]], [[1, "a"], [2, [3]]], {}, {"a": 1}, {"a": 1, "b": "c"}, {"a": "b"}]
+    for payload_type in payload_types:
+        schema = payload_schema(payload_type)
+        validator = get_validator(payload_type)
+        for value in values:
+            assert validator(value) == jsonschema.Draft202012Validator(schema).is_valid(value), (payload_type, value)
+
+# ---------------------- Parsing payload types ----------------------
+
+def test_parse_nested_payload_type():
+    payload_type = '{ type: "tuple", payload: [{ type: "array", payload: { type: "number" } }, { type: "tuple", payload: [{ type: "bool" }, { type: "string" }] }] }'
+    assert parse_payload_type(payload_type) == PayloadType("tuple", (
+        PayloadType("array", (PayloadType("number"),)),
+        PayloadType("tuple", (PayloadType("bool"), PayloadType("string"))),
+    ))
+
+def test_nested_payloads():
+    array_of_arrays = '{ type: "array", payload: { type: "array", payload: { type: "string" } } }'
+    assert checkPayload(json.dumps([["a", "b"], [], ["c"]]), array_of_arrays, array_of_arrays) == "Valid payload type"
+    with pytest.raises(jsonschema.ValidationError):
+        checkPayload(json.dumps([["a", 1]]), array_of_arrays, array_of_arrays)
+    def_of_record = '{ type: "def", name: { type: "string" }, payload: { type: "record", payload: [{ type: "number" }, { type: "string" }] } }'
+    assert checkPayload(json.dumps({"person": {"age": 25, "name": "Alice"}}), def_of_record, def_of_record) == "Valid payload type"
+    with pytest.raises(jsonschema.ValidationError):
+        checkPayload(json.dumps({"person": {"name": "Alice", "age": 25}}), def_of_record, def_of_record)
+
+def test_parse_ignores_whitespace():
+    assert parse_payload_type('{type:"array",payload:{type:"null"}}') == parse_payload_type('{ type: "array", payload: { type: "null" } }')
+
+def test_parse_unknown_type():
+    with pytest.raises(TypeError):
+        parse_payload_type('{ type: "float" }')
+
+def test_parse_error_position():
+    with pytest.raises(TypeError, match="expected , but found '{' at position 46"): # missing comma between the tuple types
+        parse_payload_type('{ type: "tuple", payload: [{ type: "number" } { type: "string" }] }')
+
+def test_parse_trailing_text():
+    with pytest.raises(TypeError):
+        parse_payload_type('{ type: "number" } }')
+
+# ---------------------- Validators attached to sessions ----------------------
+
+def test_attach_validators():
+    protocol = session_into_message(Def(name="A", cont=Choice(dir=Dir("send"), alternatives={
+        Label("Neg"): Single(dir=Dir("recv"), payload='{ type: "number" }',
+                             cont=Single(dir=Dir("send"), payload='{ type: "string" }', cont=Ref("A"))),
+        Label("Quit"): End()})))
+    server, client = message_into_session(protocol, "server"), message_into_session(protocol, "client")
+    attach_validators(server, client)
+    neg_server, neg_client = server.cont.lookup(Label("Neg")), client.cont.lookup(Label("Neg"))
+    assert neg_server.validator is neg_client.validator is get_validator('{ type: "number" }')
+    assert checkSinglePayload(-3, neg_client) == "Valid payload type"
+    with pytest.raises(jsonschema.ValidationError):
+        checkSinglePayload(3, neg_server.cont)
+
+def test_attach_validators_different_payloads():
+    server = Single(dir=Dir("send"), payload='{ type: "number" }', cont=End())
+    client = Single(dir=Dir("recv"), payload='{ type: "string" }', cont=End())
+    with pytest.raises(TypeError):
+        attach_validators(server, client)
@@ -13,19 +13,44 @@ def test_label_equality():
     l2 = Label("Hello")
     assert l1 == l2
 
+def test_shared_components():
+    assert Dir("send") is Dir.SEND and Dir("recv") is Dir.RECV
+    assert Label("Hello") is Label("Hello")
+    assert End() is End()
+
+def test_sessions_immutable():
+    single = Single(dir=Dir.SEND, payload='{ type: "number" }', cont=End())
+    with pytest.raises(AttributeError):
+        single.payload = '{ type: "string" }'
+    with pytest.raises(AttributeError):
+        Ref("P").name = "Q"
+    with pytest.raises(AttributeError):
+        Dir.SEND.dir = "recv"
+    single.validator = bool # attached when the protocol is registered
+    assert single.validator is bool
+
+def test_session_equality():
+    def make(payload: str) -> Session:
+        return Def(name="P", cont=Choice(dir=Dir.SEND, alternatives={
+            Label("Go"): Single(dir=Dir.RECV, payload=payload, cont=Ref("P")), Label("Quit"): End()}))
+    assert make('{ type: "number" }') == make('{ type: "number" }')
+    assert make('{ type: "number" }') != make('{ type: "string" }')
+    assert Ref("P") != Def(name="P", cont=End())
+
 def test_choice_add_and_lookup():
     c = Choice(dir=Dir("send"), alternatives={})
     label = Label("Test")
     session = End()
-    c.add(label, session)
+    added = c.add(label, session)
     
-    assert c.lookup(label) == session
+    assert added.lookup(label) == session
+    assert c.alternatives == {} # the choice itself stays the same
 
 def test_choice_add_and_lookup_fail():
     c = Choice(dir=Dir("send"), alternatives={})
     label = Label("Test")
     session = End()
-    c.add(label, session)
+    c = c.add(label, session)
     
     with pytest.raises(ErrorInSessionDicts) as excinfo:
         c.lookup(Label("Smart"))
@@ -35,7 +60,7 @@ def test_choice_add_existing_label():
     c = Choice(dir=Dir("send"), alternatives={})
     label = Label("Test")
     session = End()
-    c.add(label, session)
+    c = c.add(label, session)
 
     with pytest.raises(ErrorInSessionDicts) as excinfo:
         c.add(label, session)
@@ -66,3 +91,124 @@ def test_global_dict_lookup_fail():
         gdict.lookup("NonExistentProto")
     assert "lookup" in str(excinfo.value).lower()
 
+
+
+def test_protocol_store_add_and_lookup():
+    store = ProtocolStore()
+    def_server = Def(name="MyProto_server", cont=End())
+    def_client = Def(name="MyProto_client", cont=End())
+    store.add("Session: Def, Name: MyProto, Cont: Session: End", def_server, def_client)
+
+    assert store.lookup("Session: Def, Name: MyProto, Cont: Session: End") == (def_server, def_client)
+    assert store.lookup("Session: Def, Name: Other, Cont: Session: End") is None
+
+def test_protocol_store_shared_between_dicts():
+    store = ProtocolStore()
+    def_server = Def(name="MyProto_server", cont=End())
+    store.add("Session: Def, Name: MyProto, Cont: Session: End", def_server, Def(name="MyProto_client", cont=End()))
+    first, second = GlobalDict(records={}), GlobalDict(records={})
+    first.add(store.lookup("Session: Def, Name: MyProto, Cont: Session: End")[0])
+    second.add(store.lookup("Session: Def, Name: MyProto, Cont: Session: End")[0])
+
+    assert first.lookup("MyProto_server") is second.lookup("MyProto_server")
+
+def test_protocol_store_duplicate_add():
+    store = ProtocolStore()
+    def_server = Def(name="MyProto_server", cont=End())
+    def_client = Def(name="MyProto_client", cont=End())
+    store.add("Session: Def, Name: MyProto, Cont: Session: End", def_server, def_client)
+
+    with pytest.raises(ErrorInSessionDicts) as excinfo:
+        store.add("Session: Def, Name: MyProto, Cont: Session: End", def_server, def_client)
+    assert "add protcol" in str(excinfo.value).lower()
+
+def test_protocol_store_sets():
+    store = ProtocolStore()
+    definitions = [(Def(name="MyProto_server", cont=End()), Def(name="MyProto_client", cont=End()))]
+    store.add_set("abc", definitions)
+
+    assert store.lookup_set("abc") == definitions
+    assert store.lookup_set("def") is None
+
+def test_protocol_store_drops_least_recently_used():
+    store = ProtocolStore(maxsize=2)
+    protocols = {name: (Def(name=f"{name}_server", cont=End()), Def(name=f"{name}_client", cont=End())) for name in "ABC"}
+    store.add("A", *protocols["A"])
+    store.add("B", *protocols["B"])
+    store.lookup("A") # A was used last, so B is dropped
+    store.add("C", *protocols["C"])
+    assert list(store.records) == ["A", "C"]
+    for digest in ("a", "b", "c"):
+        store.add_set(digest, [protocols["A"]])
+    assert list(store.sets) == ["b", "c"]
+
+def test_protocol_store_hits_and_misses():
+    store = ProtocolStore()
+    assert store.lookup("A") is None
+    store.add("A", Def(name="A_server", cont=End()), Def(name="A_client", cont=End()))
+    store.lookup("A")
+    assert (store.hits, store.misses) == (1, 1)
+
+def test_protocol_store_resize_and_disabled():
+    store = ProtocolStore(maxsize=3)
+    for name in "ABC":
+        store.add(name, Def(name=f"{name}_server", cont=End()), Def(name=f"{name}_client", cont=End()))
+    store.resize(1)
+    assert list(store.records) == ["C"]
+    store.resize(0)
+    store.add("D", Def(name="D_server", cont=End()), Def(name="D_client", cont=End()))
+    store.add_set("d", [])
+    assert not store.records and not store.sets
+
+def test_dual_flips_directions_and_names():
+    server = Def(name="P_server", cont=Choice(dir=Dir("send"), alternatives={
+        Label("Go"): Single(dir=Dir("recv"), payload='{ type: "number" }', cont=Ref("P_server")),
+        Label("Ask"): Single(dir=Dir("send"), actor="Bob", payload='{ type: "string" }', cont=End())
+    }))
+    client = dual(server)
+    assert client.name == "P_client"
+    assert str(client.cont.dir) == "send" # choices keep their direction
+    go = client.cont.alternatives[Label("Go")]
+    assert str(go.dir) == "send" and go.cont.name == "P_client"
+    ask = client.cont.alternatives[Label("Ask")]
+    assert str(ask.dir) == "send" and ask.actor == "Bob" # multiparty sessions keep their direction
+    assert server.name == "P_server" and str(server.cont.alternatives[Label("Go")].dir) == "recv" # not changed
+
+def test_dual_names_without_marker():
+    assert dual(Ref("P")).name == "P"
+    assert dual(dual(Ref("P_server"))).name == "P_server"
+
+def test_dual_long_session():
+    session = End()
+    for _ in range(5000):
+        session = Single(dir=Dir("send"), payload='{ type: "number" }', cont=session)
+    mirrored = dual(session)
+    for _ in range(5000):
+        assert str(mirrored.dir) == "recv"
+        mirrored = mirrored.cont
+    assert isinstance(mirrored, End)
+
+def test_session_table_shares_identical_sessions():
+    table = SessionTable()
+    first = table.single(Dir.SEND, '{ type: "number" }', table.ref("P_server"))
+    second = table.single(Dir.SEND, '{ type: "number" }', table.ref("P_server"))
+    assert first is second
+    assert table.single(Dir.RECV, '{ type: "number" }', table.ref("P_server")) is not first
+
+def test_session_table_shares_closed_sessions_between_tables():
+    quit_first = SessionTable().single(Dir.SEND, '{ type: "string" }', End())
+    quit_second = SessionTable().single(Dir.SEND, '{ type: "string" }', End())
+    assert quit_first is quit_second # no references, so every protocol can use it
+    ref_first = SessionTable().single(Dir.SEND, '{ type: "string" }', Ref("P_server"))
+    ref_second = SessionTable().single(Dir.SEND, '{ type: "string" }', Ref("P_server"))
+    assert ref_first is not ref_second # only shared within one table
+
+def test_session_table_share():
+    session = Def(name="P_server", cont=Choice(dir=Dir("send"), alternatives={
+        Label("Add"): Single(dir=Dir("recv"), payload='{ type: "number" }', cont=Ref("P_server")),
+        Label("Neg"): Single(dir=Dir("recv"), payload='{ type: "number" }', cont=Ref("P_server")),
+        Label("Quit"): End()
+    }))
+    shared = SessionTable().share(session)
+    assert shared == session
+    assert shared.cont.alternatives[Label("Add")] is shared.cont.alternatives[Label("Neg")]
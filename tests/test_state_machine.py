@@ -0,0 +1,157 @@
+# to be able to use modules from other files
+import sys
+from pathlib import Path
+sys.path.append(str(Path(__file__).resolve().parent.parent))
+
+import gc
+import pytest
+from session_logic.state_machine import *
+from session_logic.parsers import message_into_session
+
+protocol_str = (
+    'Session: Def, Name: A, Cont: Session: Choice, Dir: send, Alternatives: ['
+    '(Label: Add, Session: Single, Dir: recv, Payload: { type: "number" }, Cont: '
+    'Session: Single, Dir: send, Payload: { type: "number" }, Cont: Session: Ref, Name: A), '
+    '(Label: Quit, Session: End)]'
+)
+
+def make_protocol() -> tuple[Def, Def]:
+    server = message_into_session(protocol_str, "server")
+    return server, dual(server)
+
+def test_compile_protocol():
+    server, client = make_protocol()
+    machine = StateMachine()
+    choice = machine.states[machine.compile(server.cont, client.cont)]
+    assert choice.kind == CHOICE
+    assert choice.alternatives["Quit"] == END
+    client_sends = machine.states[choice.alternatives["Add"]]
+    assert client_sends.kind == SINGLE and client_sends.client_sends and client_sends.single.payload == '{ type: "number" }'
+    server_sends = machine.states[client_sends.next]
+    assert server_sends.kind == SINGLE and not server_sends.client_sends
+    ref = machine.states[server_sends.next]
+    assert ref.kind == REF and ref.names == ("A_server", "A_client")
+
+def test_compile_only_once():
+    server, client = make_protocol()
+    machine = StateMachine()
+    start = machine.compile(server.cont, client.cont)
+    size = len(machine.states)
+    assert machine.compile(server.cont, client.cont) == start
+    assert len(machine.states) == size
+
+def test_resolve():
+    server, client = make_protocol()
+    protocol_info = GlobalDict({})
+    protocol_info.add(server)
+    protocol_info.add(client)
+    machine = StateMachine()
+    assert machine.resolve(protocol_info, "A_server", "A_client") == machine.compile(server.cont, client.cont, (server.name, client.name))
+    assert machine.resolve(protocol_info, "B_server", "B_client") is None
+
+def test_compile_mismatched_sessions():
+    machine = StateMachine()
+    single = Single(dir=Dir.SEND, payload='{ type: "number" }', cont=End())
+    assert machine.states[machine.compile(single, single)].code == 321 # both sides send
+    ref = Ref("A") # kept, as states are freed with the sessions they were compiled from
+    assert machine.states[machine.compile(single, ref)].code == 312
+
+def test_compile_links_references_to_itself():
+    server, client = make_protocol()
+    machine = StateMachine()
+    start = machine.compile(server.cont, client.cont, (server.name, client.name))
+    client_sends = machine.states[machine.states[start].alternatives["Add"]]
+    assert machine.states[client_sends.next].next == start # back to the choice without a REF state
+    assert all(state.kind != REF for state in machine.states if state is not None)
+
+def test_compile_keeps_references_to_other_protocols():
+    machine = StateMachine()
+    server = Single(dir=Dir.SEND, payload='{ type: "number" }', cont=Ref("B_server"))
+    client = dual(server)
+    state = machine.states[machine.compile(server, client, ("A_server", "A_client"))]
+    assert machine.states[state.next].kind == REF
+
+def test_check_sound_protocol():
+    server, client = make_protocol()
+    protocol_info = GlobalDict({})
+    protocol_info.add(server)
+    protocol_info.add(client)
+    machine = StateMachine()
+    assert machine.check(protocol_info, "A_server", "A_client") == machine.resolve(protocol_info, "A_server", "A_client")
+
+def test_check_undefined_reference():
+    server = Def(name="A_server", cont=Single(dir=Dir.SEND, payload='{ type: "number" }', cont=Ref("B_server")))
+    protocol_info = GlobalDict({})
+    protocol_info.add(server)
+    protocol_info.add(dual(server))
+    with pytest.raises(ProtocolError) as error:
+        StateMachine().check(protocol_info, "A_server", "A_client")
+    assert error.value.code == 350
+
+def test_check_mismatched_directions():
+    server = Def(name="A_server", cont=Single(dir=Dir.SEND, payload='{ type: "number" }', cont=End(), actor="Bob"))
+    protocol_info = GlobalDict({})
+    protocol_info.add(server)
+    protocol_info.add(dual(server)) # keeps the direction, so both sides send
+    with pytest.raises(ProtocolError) as error:
+        StateMachine().check(protocol_info, "A_server", "A_client")
+    assert error.value.code == 321
+
+def test_check_recursion_without_action():
+    protocol_info = GlobalDict({})
+    for name, other in (("A", "B"), ("B", "A")): # A is B and B is A
+        server = Def(name=f"{name}_server", cont=Ref(f"{other}_server"))
+        protocol_info.add(server)
+        protocol_info.add(dual(server))
+    with pytest.raises(ProtocolError) as error:
+        StateMachine().check(protocol_info, "A_server", "A_client")
+    assert error.value.code == 312
+
+def test_states_freed_with_protocol():
+    machine = StateMachine()
+    server, client = make_protocol()
+    machine.compile(server.cont, client.cont, (server.name, client.name))
+    size = len(machine.states)
+    assert len(machine.protocols) == 1
+    del server, client
+    gc.collect()
+    assert not machine.protocols
+    assert all(state is None for state in machine.states[1:]) # only the END state is left
+    server, client = make_protocol()
+    machine.compile(server.cont, client.cont, (server.name, client.name))
+    assert len(machine.states) == size # freed states are used again
+
+def test_states_follow_protocol_store():
+    machine = StateMachine()
+    store = ProtocolStore(maxsize=2)
+    for i in range(10):
+        server = message_into_session(protocol_str.replace("Name: A", f"Name: A{i}"), "server")
+        client = dual(server)
+        store.add(str(i), server, client)
+        machine.compile(server.cont, client.cont, (server.name, client.name))
+    del server, client
+    gc.collect()
+    assert len(machine.protocols) == 2 # only the protocols the store keeps
+    assert sum(state is not None for state in machine.states) == 1 + 2 * 3 # END and 3 states per protocol
+
+def test_states_freed_for_protocols_without_singles():
+    # Choice{Q: End} is shared by the server and client (and by every protocol with the same body)
+    machine = StateMachine()
+    store = ProtocolStore(maxsize=4)
+    for i in range(200):
+        server = message_into_session(f'Session: Def, Name: P{i}, Cont: Session: Choice, Dir: send, Alternatives: [(Label: Q{i}, Session: End)]', "server")
+        client = dual(server)
+        assert server.cont is client.cont
+        store.add(str(i), server, client)
+        machine.compile(server.cont, client.cont, (server.name, client.name))
+    del server, client
+    gc.collect()
+    assert len(machine.protocols) == 4
+    assert sum(state is not None for state in machine.states) == 1 + 4
+
+def test_protocols_with_the_same_body_share_states():
+    machine = StateMachine()
+    protocols = [message_into_session(f'Session: Def, Name: P{i}, Cont: Session: Choice, Dir: send, Alternatives: [(Label: Q, Session: End)]', "server")
+                 for i in range(200)]
+    starts = {machine.compile(protocol.cont, protocol.cont, (protocol.name, protocol.name)) for protocol in protocols}
+    assert len(starts) == 1 and len(machine.protocols) == 1